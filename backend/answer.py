@@ -2,18 +2,42 @@ from fastapi import FastAPI, HTTPException, Query
 from pydantic import BaseModel
 import os
 import json
+import time
+import uuid
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Literal
+import concurrent.futures
 import faiss
-from sentence_transformers import SentenceTransformer
 import uvicorn
+from model_registry import registry as model_registry
+import vector_index
+from live_index import LiveIndex
+from sharded_index import ShardedIndex, ShardUnavailable
+from query_cache import TTLCache, normalize_query
+from lexical_index import reciprocal_rank_fusion
 
 app = FastAPI(title="Simple RAG API")
 
 # Define models
+class QueryFilter(BaseModel):
+    # Inclusive range on metadata.verification_date (ISO-8601 dates or timestamps)
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    analysis_id_prefix: Optional[str] = None
+    # Exact matches on metadata fields, e.g. {"verdict": "False"}
+    metadata: Optional[Dict[str, Any]] = None
+
 class QueryRequest(BaseModel):
     query: str
     top_k: int = 5
+    filter: Optional[QueryFilter] = None
+    # "dense" (vectors), "lexical" (BM25) or "hybrid" (both, fused by reciprocal rank)
+    mode: Literal["dense", "lexical", "hybrid"] = "dense"
+    # Drop vector hits below this cosine similarity (dense and hybrid modes)
+    min_score: Optional[float] = None
+    # Recall/latency knobs; only the one matching the loaded index type applies
+    ef_search: Optional[int] = None  # HNSW
+    nprobe: Optional[int] = None     # IVF
 
 class Document(BaseModel):
     id: str
@@ -25,93 +49,359 @@ class QueryResponse(BaseModel):
     results: List[Document]
     query: str
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+    filter: Optional[QueryFilter] = None
+    mode: Literal["dense", "lexical", "hybrid"] = "dense"
+    min_score: Optional[float] = None
+    ef_search: Optional[int] = None
+    nprobe: Optional[int] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]
+
+class IngestDocument(BaseModel):
+    id: Optional[str] = None
+    content: str
+    metadata: Optional[Dict[str, Any]] = None
+    # Must come from the service's embedding model; encoded here when omitted
+    embedding: Optional[List[float]] = None
+
+class IngestRequest(BaseModel):
+    documents: List[IngestDocument]
+
+class IngestResponse(BaseModel):
+    ids: List[str]
+    added: int
+    version: int
+
 # Global variables
 embeddings_dir = "embeddings-s3-bucket"
+# Prebuilt index written by build_index.py; without it a flat index is built
+# from embeddings.npy at startup
+INDEX_PATH = os.getenv("RAG_INDEX_PATH", os.path.join(embeddings_dir, "index.faiss"))
+INDEX_MMAP = os.getenv("RAG_INDEX_MMAP", "1") != "0"
+DEFAULT_EF_SEARCH = int(os.getenv("RAG_EF_SEARCH", "64"))
+DEFAULT_NPROBE = int(os.getenv("RAG_NPROBE", "16"))
+MAX_BATCH_QUERIES = int(os.getenv("RAG_MAX_BATCH_QUERIES", "256"))
+# Hybrid mode: candidates taken from each leg before fusion, and the RRF constant
+HYBRID_DEPTH = int(os.getenv("RAG_HYBRID_DEPTH", "50"))
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+# Runs the lexical leg of hybrid queries alongside the dense one
+lexical_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25")
+# Watch embeddings/ for analyses uploaded by combined_3.main and ingest them
+WATCH_EMBEDDINGS = os.getenv("RAG_WATCH_EMBEDDINGS", "1") != "0"
+# Serve <embeddings_dir>/shards (written by shard_corpus.py) from one process
+# per shard, with this process scattering queries and merging the results
+SHARDED = os.getenv("RAG_SHARDED", "0") != "0"
+# Normalized query text -> embedding, and (query, search options, index
+# version) -> results; any ingest or snapshot bumps the version, so cached
+# results never outlive the index they came from
+query_embedding_cache = TTLCache(int(os.getenv("RAG_QUERY_CACHE_SIZE", "10000")),
+                                 float(os.getenv("RAG_QUERY_CACHE_TTL_S", "3600")))
+result_cache = TTLCache(int(os.getenv("RAG_RESULT_CACHE_SIZE", "10000")),
+                        float(os.getenv("RAG_RESULT_CACHE_TTL_S", "300")))
 model = None
-index = None
-documents = {}
+live_index = None
+sharded_index = None
+
+def encode(texts):
+    return np.asarray(model.encode(texts), dtype=np.float32)
+
+def encode_queries(texts):
+    """Encode query texts, reusing cached embeddings and encoding the misses in one call."""
+    keys = [normalize_query(text) for text in texts]
+    vectors = [query_embedding_cache.get(key) for key in keys]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        encoded = encode([texts[i] for i in missing])
+        for i, vector in zip(missing, encoded):
+            vectors[i] = vector
+            query_embedding_cache.put(keys[i], vector)
+    return np.vstack(vectors)
+
+def search_many(texts, top_k, ef_search=None, nprobe=None, query_filter=None, mode="dense", min_score=None):
+    """
+    Run one search per query text, serving repeats from the result cache.
+    
+    Parameters:
+    query_filter (QueryFilter, optional): Metadata conditions applied inside the search
+    mode (str): 'dense', 'lexical' or 'hybrid'
+    min_score (float, optional): Cosine similarity cut-off for vector hits
+    
+    Returns:
+    list: A list of Documents per query, in order
+    """
+    filter_key = json.dumps(query_filter.model_dump(), sort_keys=True, default=str) if query_filter else None
+    options = (top_k, ef_search or DEFAULT_EF_SEARCH, nprobe or DEFAULT_NPROBE, filter_key, mode, min_score)
+    version = sharded_index.version if sharded_index is not None else live_index.state.version
+    keys = [(normalize_query(text), options, version) for text in texts]
+    results = [result_cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+    
+    conditions = None
+    if query_filter is not None:
+        conditions = {
+            "date_from": query_filter.date_from,
+            "date_to": query_filter.date_to,
+            "analysis_id_prefix": query_filter.analysis_id_prefix,
+            "equals": query_filter.metadata,
+        }
+    
+    if sharded_index is not None:
+        queries = [texts[i] for i in missing]
+        try:
+            hits = search_shards(queries, top_k, options, conditions, mode, min_score)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except ShardUnavailable as e:
+            # The shard is being restarted in the background
+            raise HTTPException(status_code=503, detail=str(e))
+        except TimeoutError as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        for query_hits, i in zip(hits, missing):
+            results[i] = [to_document(doc, score) for score, doc in query_hits]
+            result_cache.put(keys[i], results[i])
+        return results
+    
+    rows = None
+    if conditions is not None:
+        # Precomputed row sets, handed to FAISS as an ID selector
+        try:
+            rows = live_index.metadata.select(**conditions)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    if mode != "dense" and live_index.lexical is None:
+        raise HTTPException(status_code=400, detail="Lexical search is disabled on this server")
+    
+    queries = [texts[i] for i in missing]
+    # Pin one index state so both legs see the same rows
+    state = live_index.state
+    if mode == "lexical":
+        lexical = live_index.lexical_search(queries, top_k, rows=rows, state=state)
+        ranked = lexical
+    elif mode == "hybrid":
+        depth = max(top_k, HYBRID_DEPTH)
+        lexical_future = lexical_executor.submit(live_index.lexical_search, queries, depth, rows, state)
+        _, indices, _ = live_index.search(
+            encode_queries(queries), depth,
+            ef_search=options[1], nprobe=options[2], rows=rows, state=state, min_score=min_score,
+        )
+        ranked = [
+            reciprocal_rank_fusion([indices[row], lexical_indices], top_k, RRF_K)
+            for row, (_, lexical_indices) in enumerate(lexical_future.result())
+        ]
+    else:
+        scores, indices, _ = live_index.search(
+            encode_queries(queries), top_k,
+            ef_search=options[1], nprobe=options[2], rows=rows, state=state, min_score=min_score,
+        )
+        ranked = list(zip(scores, indices))
+    
+    for (scores, indices), i in zip(ranked, missing):
+        results[i] = to_documents(scores, indices, state)
+        result_cache.put((keys[i][0], options, state.version), results[i])
+    return results
+
+def search_shards(queries, top_k, options, conditions, mode, min_score):
+    """Scatter one search_many batch over the shard processes; returns (score, document) pairs per query."""
+    if mode == "lexical":
+        return sharded_index.lexical_search(queries, top_k, conditions=conditions)
+    if mode == "hybrid":
+        return sharded_index.hybrid_search(
+            encode_queries(queries), queries, top_k, max(top_k, HYBRID_DEPTH),
+            ef_search=options[1], nprobe=options[2], conditions=conditions, min_score=min_score, rrf_k=RRF_K,
+        )
+    return sharded_index.search(encode_queries(queries), top_k, ef_search=options[1], nprobe=options[2],
+                                conditions=conditions, min_score=min_score)
 
 @app.on_event("startup")
 async def startup_event():
-    global model, index, documents
+    global model, live_index, sharded_index
     
     # Load the embedding model
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    # Shared all-MiniLM-L6-v2; runs on ONNX Runtime when INFERENCE_BACKEND=onnx
+    model = model_registry.get("minilm")
     
     # Check if embeddings directory exists
     if not os.path.exists(embeddings_dir):
         raise Exception(f"Embeddings directory '{embeddings_dir}' not found")
     
-    # Load documents and embeddings
-    embeddings_path = os.path.join(embeddings_dir, "embeddings.npy")
-    documents_path = os.path.join(embeddings_dir, "documents.json")
-    
-    if not os.path.exists(embeddings_path) or not os.path.exists(documents_path):
-        raise Exception(f"Required files not found in '{embeddings_dir}'")
-    
-    # Load embeddings
-    embeddings = np.load(embeddings_path)
+    start_time = time.time()
+    if SHARDED:
+        sharded_index = ShardedIndex(os.path.join(embeddings_dir, "shards"), mmap=INDEX_MMAP, encode=encode,
+                                     embedding_model_id=model_registry.specs["minilm"]["model"])
+        infos = sharded_index.load()
+        # Restarting dead shard processes always runs; scanning embeddings/ only with RAG_WATCH_EMBEDDINGS
+        sharded_index.start_background(os.path.join(embeddings_dir, "embeddings") if WATCH_EMBEDDINGS else None)
+        print(f"Loaded {sum(info['ntotal'] for info in infos)} documents across {len(infos)} "
+              f"{sharded_index.spec['by']} shards in {time.time() - start_time:.2f} seconds")
+        return
     
-    # Load documents
-    with open(documents_path, 'r') as f:
-        documents = json.load(f)
+    # Load documents, the index and anything still in the write-ahead log
+    live_index = LiveIndex(embeddings_dir, INDEX_PATH, mmap=INDEX_MMAP, encode=encode,
+                           embedding_model_id=model_registry.specs["minilm"]["model"])
+    live_index.load()
+    # Snapshots, spooled ingests from other workers and following the writer
+    # always run; scanning embeddings/ only with RAG_WATCH_EMBEDDINGS
+    live_index.start_background(watch=WATCH_EMBEDDINGS)
     
-    # Create FAISS index
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings.astype(np.float32))
-    
-    print(f"Loaded {len(documents)} documents with {embeddings.shape[0]} embeddings")
+    stats = live_index.stats()
+    print(f"Loaded {stats['ntotal']} documents "
+          f"({stats['index'].get('index_type', 'unknown')} index) in {time.time() - start_time:.2f} seconds")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if live_index is not None:
+        live_index.stop()
+    if sharded_index is not None:
+        sharded_index.shutdown()
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
 @app.post("/query", response_model=QueryResponse)
-async def query(request: QueryRequest):
-    if model is None or index is None:
+def query(request: QueryRequest):
+    # Sync endpoint: encoding, the hybrid lexical leg and shard scatter-gather all block, so run off the event loop
+    if model is None or (live_index is None and sharded_index is None):
         raise HTTPException(status_code=500, detail="Service not initialized properly")
     
-    # Encode the query
-    query_embedding = model.encode([request.query])[0].reshape(1, -1).astype(np.float32)
+    # Encode the query and search for similar vectors
+    results = search_many([request.query], request.top_k, ef_search=request.ef_search, nprobe=request.nprobe,
+                          query_filter=request.filter, mode=request.mode, min_score=request.min_score)[0]
     
-    # Search for similar vectors
-    distances, indices = index.search(query_embedding, request.top_k)
+    return QueryResponse(results=results, query=request.query)
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+def query_batch(request: BatchQueryRequest):
+    # Sync endpoint: one encode call and one multi-vector search for the batch's cache misses, off the event loop
+    if model is None or (live_index is None and sharded_index is None):
+        raise HTTPException(status_code=500, detail="Service not initialized properly")
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    if not request.queries:
+        return BatchQueryResponse(results=[])
     
-    # Prepare results
-    results = []
-    for i, doc_idx in enumerate(indices[0]):
-        if doc_idx < len(documents):
-            doc = documents[str(doc_idx)]
-            results.append(
-                Document(
-                    id=str(doc_idx),
-                    content=doc["content"],
-                    metadata=doc.get("metadata", {}),
-                    score=float(1.0 - distances[0][i]/100.0)  # Convert distance to similarity score
-                )
-            )
+    results = search_many(request.queries, request.top_k, ef_search=request.ef_search, nprobe=request.nprobe,
+                          query_filter=request.filter, mode=request.mode, min_score=request.min_score)
     
-    return QueryResponse(results=results, query=request.query)
+    return BatchQueryResponse(results=[
+        QueryResponse(results=documents, query=query_text)
+        for query_text, documents in zip(request.queries, results)
+    ])
+
+def to_document(doc, score):
+    return Document(
+        id=doc["id"],
+        content=doc["content"],
+        metadata=doc.get("metadata", {}),
+        # Cosine similarity, BM25 or fused rank score depending on the mode
+        score=float(score)
+    )
+
+def to_documents(scores, indices, state):
+    """Turn one query's search results into Documents, resolved against the searched state."""
+    results = []
+    for score, doc_idx in zip(scores, indices):
+        # ANN indexes pad with -1 when they find fewer than top_k neighbours
+        if 0 <= doc_idx < state.ntotal:
+            results.append(to_document(live_index.document(doc_idx), score))
+    return results
 
 @app.get("/documents/{doc_id}", response_model=Document)
-async def get_document(doc_id: str):
-    if doc_id not in documents:
+def get_document(doc_id: str):
+    # Sync endpoint: with shards this waits on a shard process
+    if sharded_index is not None:
+        try:
+            doc = sharded_index.get(doc_id)
+        except ShardUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except TimeoutError as e:
+            raise HTTPException(status_code=504, detail=str(e))
+    else:
+        doc = live_index.get(doc_id) if live_index is not None else None
+    if doc is None:
         raise HTTPException(status_code=404, detail=f"Document with ID {doc_id} not found")
     
-    doc = documents[doc_id]
     return Document(
         id=doc_id,
         content=doc["content"],
         metadata=doc.get("metadata", {})
     )
 
+@app.post("/documents", response_model=IngestResponse)
+def add_documents(request: IngestRequest):
+    # Sync endpoint: runs in the threadpool so encoding and the WAL fsync never block queries
+    if model is None or (live_index is None and sharded_index is None):
+        raise HTTPException(status_code=500, detail="Service not initialized properly")
+    
+    docs = [
+        {"id": d.id or uuid.uuid4().hex, "content": d.content, "metadata": d.metadata or {}}
+        for d in request.documents
+    ]
+    dimension = sharded_index.dimension if sharded_index is not None else live_index.state.base.d
+    vectors = np.zeros((len(docs), dimension), dtype=np.float32)
+    missing = [i for i, d in enumerate(request.documents) if d.embedding is None]
+    if missing:
+        vectors[missing] = encode([docs[i]["content"] for i in missing])
+    for i, d in enumerate(request.documents):
+        if d.embedding is not None:
+            if len(d.embedding) != vectors.shape[1]:
+                raise HTTPException(status_code=400, detail=f"Embedding for document {i} has dimension "
+                                                            f"{len(d.embedding)}, expected {vectors.shape[1]}")
+            vectors[i] = d.embedding
+    
+    if sharded_index is not None:
+        try:
+            ids = sharded_index.add(docs, vectors)
+        except ShardUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except TimeoutError as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        return IngestResponse(ids=ids, added=len(ids), version=sharded_index.version)
+    ids = live_index.add(docs, vectors)
+    return IngestResponse(ids=ids, added=len(ids), version=live_index.state.version)
+
+@app.post("/shards/{shard_id}/reload")
+def reload_shard(shard_id: int, rebuild: bool = False):
+    """
+    Swap in a freshly loaded process for one shard, e.g. after rebuilding its
+    index with build_index.py; with rebuild=true the new process rebuilds the
+    index itself. The other shards, and this one's old process, keep serving.
+    """
+    if sharded_index is None:
+        raise HTTPException(status_code=400, detail="The index is not sharded (set RAG_SHARDED=1)")
+    try:
+        info = sharded_index.reload(shard_id, rebuild=rebuild)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload of shard {shard_id} failed: {str(e)}")
+    return {"shard": shard_id, "ntotal": info["ntotal"], "index": info["index"], "version": sharded_index.version}
+
 # Utility endpoint to get document count
 @app.get("/stats")
-async def get_stats():
+def get_stats():
+    if sharded_index is not None:
+        shards = sharded_index.stats()
+        return {
+            "document_count": shards["ntotal"],
+            "embeddings_directory": embeddings_dir,
+            "shards": shards,
+            "query_embedding_cache": query_embedding_cache.stats(),
+            "result_cache": result_cache.stats(),
+        }
     return {
-        "document_count": len(documents),
-        "embeddings_directory": embeddings_dir
+        "document_count": live_index.state.ntotal if live_index is not None else 0,
+        "embeddings_directory": embeddings_dir,
+        "index": live_index.stats() if live_index is not None else None,
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "result_cache": result_cache.stats(),
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+"""
+Build the RAG service's vector index offline and write it to disk.
+
+answer.py memory-maps the result at startup instead of rebuilding an index
+from embeddings.npy on every boot.
+
+Usage:
+    python build_index.py [--type hnsw] [--metric ip] [--embeddings-dir embeddings-s3-bucket] [--output PATH]
+                          [--M 32] [--ef-construction 200] [--nlist 1024] [--m 16] [--nbits 8]
+
+--type is one of flat, hnsw, ivfpq, ivfopq. With the default --metric ip vectors are
+L2-normalized before indexing, so search scores are cosine similarities.
+The index is written to <embeddings-dir>/index.faiss unless --output is
+given, with a .meta.json sidecar recording how it was built.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+import vector_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--type", default="hnsw", choices=sorted(vector_index.INDEX_TYPES))
+    parser.add_argument("--metric", default="ip", choices=sorted(vector_index.METRICS))
+    parser.add_argument("--embeddings-dir", default="embeddings-s3-bucket")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--M", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["M"])
+    parser.add_argument("--ef-construction", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["ef_construction"])
+    parser.add_argument("--nlist", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["nlist"])
+    parser.add_argument("--m", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["m"])
+    parser.add_argument("--nbits", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["nbits"])
+    parser.add_argument("--train-sample", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["train_sample"])
+    args = parser.parse_args()
+
+    embeddings_path = os.path.join(args.embeddings_dir, "embeddings.npy")
+    output = args.output or os.path.join(args.embeddings_dir, "index.faiss")
+    options = {
+        "M": args.M,
+        "ef_construction": args.ef_construction,
+        "nlist": args.nlist,
+        "m": args.m,
+        "nbits": args.nbits,
+        "train_sample": args.train_sample,
+    }
+
+    embeddings = np.load(embeddings_path, mmap_mode="r")
+    print(f"Building {args.type} index over {embeddings.shape[0]} vectors of dimension {embeddings.shape[1]}")
+    start_time = time.time()
+    index = vector_index.build_index(embeddings, args.type, metric=args.metric, **options)
+    print(f"Built index in {time.time() - start_time:.2f} seconds")
+
+    # Write next to the target and rename so a running service never maps a half-written file
+    tmp_path = output + ".tmp"
+    vector_index.write_index(index, tmp_path, args.type, **options)
+    os.replace(tmp_path + ".meta.json", output + ".meta.json")
+    os.replace(tmp_path, output)
+    print(f"Wrote {output} ({os.path.getsize(output) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import model_workers
+from model_registry import registry as model_registry
+
+# How many texts go through the model in one forward pass, and how long the
+# worker waits for more requests to arrive before running a partial batch.
+MAX_BATCH_SIZE = int(os.getenv("CLASSIFIER_MAX_BATCH_SIZE", "32"))
+MAX_WAIT_MS = float(os.getenv("CLASSIFIER_MAX_WAIT_MS", "5"))
+
+
+def _format_result(label_scores):
+    # top_k=None gives every label's probability; keep the winning label in the
+    # same {"label", "score"} shape callers already use and attach the rest
+    top = max(label_scores, key=lambda item: item["score"])
+    return {
+        "label": top["label"],
+        "score": top["score"],
+        "scores": {item["label"]: item["score"] for item in label_scores},
+    }
+
+
+class ClassifierService:
+    """Micro-batching front end for a text-classification model in the registry.
+
+    Callers from any thread submit texts and get futures back. A single worker
+    thread drains the queue, waiting up to ``max_wait_ms`` for the batch to fill,
+    and runs every pending text through the model as one padded batch.
+    """
+
+    def __init__(self, model_name="fake-news", max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self.batches_run = 0
+        self.items_classified = 0
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name=f"{self.model_name}-classifier", daemon=True
+                )
+                self._worker.start()
+
+    def _collect_batch(self):
+        # Block for the first item, then keep taking items until the batch is
+        # full or the wait window closes
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _infer(self, texts):
+        # With MODEL_WORKERS set the batch runs in a model worker process,
+        # otherwise on the model loaded in this process
+        pool = model_workers.get_pool()
+        if pool is not None:
+            return pool.classify(texts, model=self.model_name)
+        return model_registry.run(
+            self.model_name, texts,
+            batch_size=len(texts), truncation=True, padding=True, top_k=None
+        )
+
+    def _run(self):
+        while True:
+            # Requests cancelled while queued (e.g. the client went away) are
+            # dropped; the rest can no longer be cancelled once marked running
+            batch = [(text, future) for text, future in self._collect_batch()
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [text for text, _ in batch]
+            try:
+                results = self._infer(texts)
+                self.batches_run += 1
+                self.items_classified += len(texts)
+                for (_, future), label_scores in zip(batch, results):
+                    future.set_result(_format_result(label_scores))
+            except Exception as e:
+                # Anything left unresolved fails, and the worker lives on for the next batch
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def submit(self, text):
+        """Queue one text (or ``{"text", "text_pair"}`` pair) and return a Future
+        resolving to ``{"label", "score", "scores"}``."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def classify(self, texts, timeout=None):
+        """Classify ``texts`` and block until every result is back."""
+        futures = [self.submit(text) for text in texts]
+        return [future.result(timeout=timeout) for future in futures]
+
+    async def classify_async(self, texts):
+        """Asyncio counterpart of ``classify`` for use inside request handlers."""
+        futures = [asyncio.wrap_future(self.submit(text)) for text in texts]
+        return await asyncio.gather(*futures)
+
+    def classify_article(self, article_text):
+        """Article-level score for a whole (already length-limited) article."""
+        return self.classify([article_text])[0]
+
+    def classify_claims(self, claims):
+        """Claim-level scores, one per extracted statement."""
+        return self.classify(claims)
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches_run": self.batches_run,
+            "items_classified": self.items_classified,
+            "average_batch_size": (self.items_classified / self.batches_run) if self.batches_run else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+
+fake_news_classifier = ClassifierService("fake-news")
+# Claim/evidence pairs are short and plentiful, so the NLI model gets bigger batches
+nli_classifier = ClassifierService("nli", max_batch_size=int(os.getenv("NLI_MAX_BATCH_SIZE", "64")))
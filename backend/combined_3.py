@@ -10,15 +10,21 @@ import subprocess
 import time
 import concurrent.futures
 import boto3
-from transformers import pipeline
-from google import generativeai as genai
 import os
 import numpy as np
+import requests
 from typing import List, Dict, Any, Optional
 import faiss
 from sentence_transformers import SentenceTransformer
 import uvicorn
 from fastapi import FastAPI, HTTPException, Query
+import gemini_client
+import summarizer
+from classifier_service import fake_news_classifier
+from long_document import classify_long_document
+from stance import score_stances
+from embeddings import generate_embeddings_batch, embed_long_text
+import model_workers
 
 load_dotenv()
 
@@ -27,6 +33,7 @@ bedrock_client = boto3.client("bedrock-runtime")
 
 serper_key = os.getenv("SERPER_DEV_KEY")
 os.environ["SERPER_API_KEY"] = serper_key  # Ensure it's available globally
+SCRAPE_TIMEOUT_S = float(os.getenv("SCRAPE_TIMEOUT_S", "15"))
 
 # Pydantic models for Article Fact Checking
 class ArticleRequest(BaseModel):
@@ -111,6 +118,12 @@ def extract_chunks(article_text: str) -> list:
     return chunks
 
 # Scraping and search functions
+def fetch_article_text(url, pool):
+    """Download a page here and extract its text in a model worker process"""
+    response = requests.get(url, timeout=SCRAPE_TIMEOUT_S, headers={"User-Agent": "Mozilla/5.0"})
+    response.raise_for_status()
+    return pool.html_to_text([response.text])[0]
+
 def scrape_article_content(url, attempt=1, max_attempts=3):
     """Scrape content from a URL with retry mechanism"""
     if not url or url == "None":
@@ -118,9 +131,14 @@ def scrape_article_content(url, attempt=1, max_attempts=3):
         
     try:
         print(f"Attempting to scrape: {url}")
-        scraping_tool = ScrapeWebsiteTool(website_url=url)
-        # Explicitly pass the URL to the tool
-        result = scraping_tool.run()
+        pool = model_workers.get_pool()
+        if pool is not None:
+            # HTML parsing is CPU-bound; keep it off this process's GIL
+            result = fetch_article_text(url, pool)
+        else:
+            scraping_tool = ScrapeWebsiteTool(website_url=url)
+            # Explicitly pass the URL to the tool
+            result = scraping_tool.run()
         
         # If result is extremely short, it might be a failed scrape
         if len(result) < 100 and attempt < max_attempts:
@@ -340,133 +358,66 @@ def list_available_bedrock_models():
         return []
 
 def summarization(text, api_key=None):
-    # Use provided API key or check environment variable
-    GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-    
-    # Check if we have a valid API key
-    if not GEMINI_API_KEY:
-        print("API key not found. Please provide a valid Gemini API key.")
-        return "API key not found"
+    # Summarize locally when there is no Gemini key or SUMMARY_TIER says so
+    if not summarizer.use_remote():
+        return summarizer.summarize_locally(text)
     
     try:
-        # Initialize the client
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        
-        # Generate the summary
-        response = client.models.generate_content(
-            model='gemini-2.0-flash', 
-            contents=f'Summarize the following article:\n\n{text}'
-        )
-        return response.text
-    except ValueError as e:
-        print(f"API Client Error: {e}")
-        return "Error: Could not initialize Gemini client. Check your API key."
+        # Generate the summary with the shared, long-lived Gemini client
+        # (map-reduce over paragraph groups for long articles)
+        return gemini_client.run_sync(summarizer.summarize(text))
     except Exception as e:
         print(f"Error generating summary: {str(e)}")
-        return f"Error: {str(e)}"
+        if summarizer.SUMMARY_TIER == "gemini":
+            return f"Error: {str(e)}"
+        print("Falling back to extractive summary...")
+        return summarizer.summarize_locally(text)
 
-def generate_embeddings(text, model_provider="bedrock"):
+def generate_embeddings(text, model_provider="bedrock", tagged=False):
     """
     Generate embeddings for the given text using the specified model provider.
     
+    The embedding router applies per-provider timeouts and circuit breakers,
+    falls back along bedrock -> huggingface -> ollama, and can hedge a slow
+    remote call with the local model. Cached vectors are reused. Text longer
+    than the model's window is embedded in overlapping chunks, not truncated.
+    
     Parameters:
     text (str): The text to generate embeddings for
-    model_provider (str): The model provider to use ('bedrock', 'huggingface', or 'ollama')
+    model_provider (str): The model provider to try first ('bedrock', 'huggingface', or 'ollama')
+    tagged (bool): Return {"embedding", "provider", "model_id", "dimension", "chunks"} instead of the bare list
     
     Returns:
     list or dict: The embeddings generated from the text
     """
     if not text:
         print("Warning: Empty text provided for embeddings generation")
-        return []
-    
-    # Truncate text if it's too long (most embedding models have token limits)
-    max_chars = 8000
-    if len(text) > max_chars:
-        print(f"Text too long for embedding ({len(text)} chars). Truncating to {max_chars} chars.")
-        text = text[:max_chars]
-    
-    if model_provider.lower() == "bedrock":
-        try:
-            # Amazon Bedrock embedding models
-            response = bedrock_client.invoke_model(
-                modelId="amazon.titan-embed-text-v1",  # You can change to other models like "cohere.embed-english-v3"
-                body=json.dumps({
-                    "inputText": text,
-                    "embeddingConfig": {
-                        "outputEmbeddingLength": 768  # Adjust based on the model used
-                    }
-                })
-            )
-            
-            # Parse the response
-            response_body = json.loads(response.get('body').read().decode('utf-8'))
-            embeddings = response_body.get('embedding', [])
-            
-            print(f"Generated embeddings using Bedrock with dimension {len(embeddings)}")
-            return embeddings
-            
-        except Exception as e:
-            print(f"Error generating embeddings with Bedrock: {str(e)}")
-            # Fall back to HuggingFace if Bedrock fails
-            print("Falling back to HuggingFace for embeddings...")
-            return generate_embeddings(text, "huggingface")
-    
-    elif model_provider.lower() == "huggingface":
-        try:
-            # Use a sentence-transformers model from HuggingFace
-            from transformers import AutoTokenizer, AutoModel
-            import torch
-            
-            # Load model and tokenizer (all-MiniLM-L6-v2 is small and fast)
-            model_name = "sentence-transformers/all-MiniLM-L6-v2"
-            tokenizer = AutoTokenizer.from_pretrained(model_name)
-            model = AutoModel.from_pretrained(model_name)
-            
-            # Tokenize and prepare inputs
-            inputs = tokenizer(text, padding=True, truncation=True, return_tensors="pt", max_length=512)
-            
-            # Get embeddings
-            with torch.no_grad():
-                outputs = model(**inputs)
-                # Use mean pooling for sentence embeddings
-                embeddings = outputs.last_hidden_state.mean(dim=1).squeeze().tolist()
-            
-            print(f"Generated embeddings using HuggingFace with dimension {len(embeddings)}")
-            return embeddings
-            
-        except Exception as e:
-            print(f"Error generating embeddings with HuggingFace: {str(e)}")
-            # Fall back to Ollama if HuggingFace fails
-            print("Falling back to Ollama for embeddings...")
-            return generate_embeddings(text, "ollama")
-    
-    elif model_provider.lower() == "ollama":
-        try:
-            # Use Ollama for embeddings (requires Ollama to be running)
-            command = ["ollama", "embeddings", "llama3.2"]
-            result = subprocess.run(
-                command,
-                input=text,
-                text=True,
-                capture_output=True,
-                check=True,
-                timeout=60,
-                encoding="utf-8"
-            )
-            
-            # Parse the JSON response
-            embeddings = json.loads(result.stdout)
-            print(f"Generated embeddings using Ollama with dimension {len(embeddings)}")
-            return embeddings
-            
-        except Exception as e:
-            print(f"Error generating embeddings with Ollama: {str(e)}")
-            return []
+        return {"embedding": [], "provider": None, "model_id": None, "dimension": 0, "chunks": []} if tagged else []
     
-    else:
-        print(f"Unknown model provider: {model_provider}")
-        return []
+    # Long texts are split by the model's token limit and embedded chunk by
+    # chunk (one batch) instead of being truncated; the document vector is the
+    # pooled chunk vectors
+    try:
+        result = embed_long_text(text, model_provider)
+    except Exception as e:
+        print(f"Error generating embeddings: {str(e)}")
+        return {"embedding": [], "provider": None, "model_id": None, "dimension": 0, "chunks": []} if tagged else []
+    
+    embeddings = result.document.tolist()
+    print(f"Generated embeddings using {result.provider} ({result.model_id}) with dimension {result.dimension} "
+          f"from {len(result.chunk_texts)} chunk(s)")
+    if tagged:
+        return {
+            "embedding": embeddings,
+            "provider": result.provider,
+            "model_id": result.model_id,
+            "dimension": result.dimension,
+            "chunks": [
+                {"text": chunk_text, "embedding": vector.tolist()}
+                for chunk_text, vector in zip(result.chunk_texts, result.chunks)
+            ] if len(result.chunk_texts) > 1 else []
+        }
+    return embeddings
 
 
 def upload_to_s3(data, bucket_name, file_key, region_name=None):
@@ -510,6 +461,19 @@ def upload_to_s3(data, bucket_name, file_key, region_name=None):
         print(f"Error uploading to S3: {str(e)}")
         return False
 
+def summary_delta_events(summary_stream, analysis_id, wait=False):
+    """Turn summary tokens received so far (or, with wait, all remaining ones) into progress updates"""
+    if summary_stream is None:
+        return
+    deltas = summary_stream.wait() if wait else summary_stream.drain()
+    for delta in deltas:
+        yield {
+            "status": "processing", 
+            "message": "Summary update", 
+            "data": {"summary_delta": delta},
+            "analysis_id": analysis_id
+        }
+
 def main(article_text, upload_to_s3_bucket=None, s3_region=None):
     """
     Main function for fact checking with streaming output.
@@ -543,32 +507,42 @@ def main(article_text, upload_to_s3_bucket=None, s3_region=None):
     # First progress update
     yield {"status": "starting", "message": "Starting fact check process", "analysis_id": analysis_id}
     
-    # Add sentiment analysis for the original article using BERT pipeline
+    # Step 1: Extract chunks from the article
+    yield {"status": "processing", "message": "Extracting statements to verify...", "analysis_id": analysis_id}
+    chunks = extract_chunks(article_text)
+    yield {
+        "status": "processing", 
+        "message": f"Found {len(chunks)} statements to verify", 
+        "data": {"chunks_count": len(chunks)},
+        "analysis_id": analysis_id
+    }
+    
+    # Start streaming the summary now so it forms while evidence is gathered;
+    # its tokens are forwarded between the verification steps below
+    summary_stream = None
+    if summarizer.use_remote():
+        summary_stream = summarizer.start_summary_stream(article_text)
+    
+    # Queue every claim on the shared classifier before scoring the article so
+    # the claims and the article windows go through the model together
+    claim_futures = [fake_news_classifier.submit(chunk) for chunk in chunks]
+    
+    # Score the whole article with the BERT classifier. The article is split
+    # into overlapping token windows scored as one batch, and the extracted
+    # claims steer attention pooling when LONG_DOC_POOLING=attention.
     yield {"status": "processing", "message": "Analyzing article sentiment...", "analysis_id": analysis_id}
     try:
-        from transformers import pipeline
-        import re
-
-        # Tokenize text for length check
-        tokenized_text = re.findall(r'\w+|[^\w\s]', article_text)
-        
-        # If text is too long, truncate it
-        if len(tokenized_text) > 450:  # Using 450 for safety margin
-            truncated_text = ' '.join(tokenized_text[:450])
-            pipe = pipeline("text-classification", model="dhruvpal/fake-news-bert")
-            result = pipe(truncated_text)
-        else:
-            pipe = pipeline("text-classification", model="dhruvpal/fake-news-bert")
-            result = pipe(article_text)
-            
+        result = classify_long_document(article_text, claims=chunks)
         sentiment_result = {
-            "score": result[0]["score"],
-            "reasoning": result[0]["label"]
+            "score": result["score"],
+            "reasoning": result["label"],
+            "windows": result["windows"],
+            "pooling": result["pooling"]
         }
         result_data["sentiment_analysis"] = sentiment_result
         yield {
             "status": "processing", 
-            "message": f"Sentiment analysis complete: {result[0]['label']} ({result[0]['score']:.2f})", 
+            "message": f"Sentiment analysis complete: {result['label']} ({result['score']:.2f}) over {result['windows']} windows", 
             "data": {"sentiment": sentiment_result},
             "analysis_id": analysis_id
         }
@@ -585,18 +559,34 @@ def main(article_text, upload_to_s3_bucket=None, s3_region=None):
             "analysis_id": analysis_id
         }
     
-    # Step 1: Extract chunks from the article
-    yield {"status": "processing", "message": "Extracting statements to verify...", "analysis_id": analysis_id}
-    chunks = extract_chunks(article_text)
-    yield {
-        "status": "processing", 
-        "message": f"Found {len(chunks)} statements to verify", 
-        "data": {"chunks_count": len(chunks)},
-        "analysis_id": analysis_id
-    }
+    # Collect the per-claim credibility scores
+    claim_scores = []
+    try:
+        for chunk, future in zip(chunks, claim_futures):
+            claim_result = future.result()
+            claim_scores.append({
+                "statement": chunk,
+                "label": claim_result["label"],
+                "score": claim_result["score"]
+            })
+        if claim_scores:
+            yield {
+                "status": "processing", 
+                "message": f"Scored credibility of {len(claim_scores)} statements", 
+                "data": {"claim_scores": claim_scores},
+                "analysis_id": analysis_id
+            }
+    except Exception as e:
+        claim_scores = []
+        yield {
+            "status": "warning", 
+            "message": f"Error scoring statements: {str(e)}", 
+            "analysis_id": analysis_id
+        }
     
     # Step 2: For each chunk, search for news and add to results
     for i, chunk in enumerate(chunks):
+        yield from summary_delta_events(summary_stream, analysis_id)
         yield {
             "status": "processing", 
             "message": f"Verifying statement {i+1}/{len(chunks)}: {chunk[:50]}...", 
@@ -626,6 +616,11 @@ def main(article_text, upload_to_s3_bucket=None, s3_region=None):
                 "search_topic": search_result.get("topic", chunk),
                 "articles": articles_with_content
             }
+            if claim_scores:
+                fact_check_entry["credibility"] = {
+                    "label": claim_scores[i]["label"],
+                    "score": claim_scores[i]["score"]
+                }
             
             result_data["fact_checks"].append(fact_check_entry)
             
@@ -644,6 +639,11 @@ def main(article_text, upload_to_s3_bucket=None, s3_region=None):
                 "articles": [],
                 "error": "No articles found for this statement"
             }
+            if claim_scores:
+                fact_check_entry["credibility"] = {
+                    "label": claim_scores[i]["label"],
+                    "score": claim_scores[i]["score"]
+                }
             result_data["fact_checks"].append(fact_check_entry)
             
             yield {
@@ -653,30 +653,57 @@ def main(article_text, upload_to_s3_bucket=None, s3_region=None):
                 "analysis_id": analysis_id
             }
     
+    yield from summary_delta_events(summary_stream, analysis_id)
+    
+    # Check whether the gathered evidence supports or contradicts each claim
+    yield {"status": "processing", "message": "Scoring evidence stance for each statement...", "analysis_id": analysis_id}
+    try:
+        stances, factuality_score = score_stances(result_data["fact_checks"])
+        for fact_check_entry, stance in zip(result_data["fact_checks"], stances):
+            fact_check_entry["stance"] = stance
+        result_data["factuality_score"] = factuality_score
+        verdicts = [stance["verdict"] for stance in stances]
+        yield {
+            "status": "processing", 
+            "message": (f"Stance scoring complete: {verdicts.count('supported')} supported, "
+                        f"{verdicts.count('refuted')} refuted, {verdicts.count('uncertain')} uncertain"), 
+            "data": {"stances": stances, "factuality_score": factuality_score},
+            "analysis_id": analysis_id
+        }
+    except Exception as e:
+        result_data["factuality_score"] = None
+        yield {
+            "status": "warning", 
+            "message": f"Error scoring evidence stance: {str(e)}", 
+            "analysis_id": analysis_id
+        }
+    
     # Generate summary
     yield {"status": "processing", "message": "Generating article summary...", "analysis_id": analysis_id}
     
-    if not os.getenv('GEMINI_API_KEY'):
+    summary = None
+    if summary_stream is not None:
+        # Finish the summary that has been streaming since the statements were
+        # extracted, forwarding whatever tokens are still arriving
+        yield from summary_delta_events(summary_stream, analysis_id, wait=True)
+        if summary_stream.error:
+            print(f"Error generating summary: {str(summary_stream.error)}")
+            yield {"status": "warning", "message": f"Error generating summary: {str(summary_stream.error)}", "analysis_id": analysis_id}
+        else:
+            summary = summary_stream.text
+    elif summarizer.SUMMARY_TIER != "extractive":
         yield {"status": "warning", "message": "No GEMINI_API_KEY found in environment", "analysis_id": analysis_id}
-        if not api_key:
-            yield {"status": "warning", "message": "Summarization skipped - no API key", "analysis_id": analysis_id}
-            summary = "Summarization skipped due to missing API key."
-            result_data["summary"] = summary
-            
-            # Save partial results without embeddings
-            filename = save_results_to_file(result_data)
-            yield {
-                "status": "completed", 
-                "message": f"Fact checking complete without summary. Results saved to {filename}", 
-                "data": {"filename": filename, "result_data": result_data},
-                "analysis_id": analysis_id
-            }
-            return result_data, summary, None
-    else:
-        api_key = os.getenv('GEMINI_API_KEY')
     
-    # Generate summary using the article text
-    summary = summarization(article_text, api_key)
+    if not summary and summarizer.SUMMARY_TIER != "gemini":
+        # Local extractive summary: no network, a few milliseconds
+        try:
+            summary = summarizer.summarize_locally(article_text)
+            yield {"status": "processing", "message": "Generated extractive summary locally", "analysis_id": analysis_id}
+        except Exception as e:
+            yield {"status": "warning", "message": f"Error generating extractive summary: {str(e)}", "analysis_id": analysis_id}
+    
+    if not summary:
+        summary = "Summarization failed."
     result_data["summary"] = summary
     
     yield {
@@ -688,14 +715,18 @@ def main(article_text, upload_to_s3_bucket=None, s3_region=None):
     
     # Generate embeddings for the summary
     yield {"status": "processing", "message": "Generating embeddings for the summary...", "analysis_id": analysis_id}
-    embeddings = generate_embeddings(summary, "bedrock")
+    tagged_embeddings = generate_embeddings(summary, "bedrock", tagged=True)
+    embeddings = tagged_embeddings["embedding"]
     result_data["summary_embeddings"] = embeddings
+    # Record which model space the vector lives in so indexes never mix them
+    result_data["summary_embedding_model"] = tagged_embeddings["model_id"]
+    result_data["summary_embedding_dimension"] = tagged_embeddings["dimension"]
     
     if embeddings:
         yield {
             "status": "processing", 
-            "message": f"Generated embeddings (dimension: {len(embeddings)})", 
-            "data": {"embedding_dimension": len(embeddings)},
+            "message": f"Generated embeddings with {tagged_embeddings['model_id']} (dimension: {len(embeddings)})", 
+            "data": {"embedding_dimension": len(embeddings), "embedding_model": tagged_embeddings["model_id"]},
             "analysis_id": analysis_id
         }
     else:
@@ -729,7 +760,10 @@ def main(article_text, upload_to_s3_bucket=None, s3_region=None):
                 "analysis_id": analysis_id,
                 "verification_date": result_data["verification_date"],
                 "summary": summary,
-                "embeddings": embeddings
+                "embeddings": embeddings,
+                "model_id": tagged_embeddings["model_id"],
+                "dimension": tagged_embeddings["dimension"],
+                "chunks": tagged_embeddings["chunks"]
             }
             upload_success = upload_to_s3(embeddings_data, upload_to_s3_bucket, embeddings_key, s3_region)
             
@@ -0,0 +1,153 @@
+"""
+Compact per-analysis embedding shards into the binary corpus the RAG service loads.
+
+Reads <embeddings-dir>/embeddings/{analysis_id}.json (as uploaded by
+combined_3.main) and appends, one row per analysis:
+    embeddings.npy          contiguous float32 matrix
+    documents.jsonl         offset-indexed document store (see doc_store.py)
+    documents.offsets.npy
+    doc_ids.json            document id -> row
+
+Vectors are L2-normalized as they are compacted (see build_index.py --metric).
+
+Runs incrementally: compaction_manifest.json records every shard already
+compacted (or rejected), so re-running only processes new files. All shards
+must share one embedding model and dimension; the first compacted shard fixes
+them, and shards that don't match are rejected and listed in the manifest.
+
+Don't point it at a directory a running answer.py is snapshotting into;
+compact into a build directory, run build_index.py there, then ship both.
+
+Usage:
+    python compact_embeddings.py [--embeddings-dir embeddings-s3-bucket] [--shards-dir DIR]
+                                 [--dimension 768] [--model-id MODEL]
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+import doc_store
+
+MANIFEST_FILE = "compaction_manifest.json"
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"dimension": None, "model_id": None, "rows": 0, "shards": {}, "rejected": {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def compact(embeddings_dir, shards_dir=None, dimension=None, model_id=None):
+    """
+    Append every not-yet-compacted shard to the corpus in ``embeddings_dir``.
+
+    Returns:
+    dict: Counts of compacted, rejected and skipped shards, and total rows
+    """
+    shards_dir = shards_dir or os.path.join(embeddings_dir, "embeddings")
+    embeddings_path = os.path.join(embeddings_dir, "embeddings.npy")
+    manifest = load_manifest(embeddings_dir)
+    dimension = manifest["dimension"] or dimension
+    model_id = manifest["model_id"] or model_id
+
+    store = doc_store.DocumentStore(embeddings_dir) if doc_store.exists(embeddings_dir) else None
+    existing_ids = store.ids if store is not None else {}
+    rows_before = len(store) if store is not None else 0
+    pending = [
+        path for path in sorted(glob.glob(os.path.join(shards_dir, "*.json")))
+        if os.path.basename(path) not in manifest["shards"] and os.path.basename(path) not in manifest["rejected"]
+    ]
+    print(f"{len(pending)} new shards in {shards_dir} ({len(manifest['shards'])} already compacted)")
+
+    # Stream vectors to a raw scratch file so the batch never has to fit in memory
+    scratch_path = os.path.join(embeddings_dir, ".compaction.f32")
+    docs, compacted, skipped = [], {}, 0
+    start_time = time.time()
+    with open(scratch_path, 'wb') as scratch:
+        for path in pending:
+            name = os.path.basename(path)
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                manifest["rejected"][name] = f"unreadable: {e}"
+                continue
+
+            doc = doc_store.document_from_shard(data)
+            vector = np.asarray(data.get("embeddings") or [], dtype=np.float32)
+            if doc is None or vector.ndim != 1 or not len(vector):
+                manifest["rejected"][name] = "missing summary, analysis_id or embeddings"
+                continue
+            if data.get("dimension") is not None and data["dimension"] != len(vector):
+                manifest["rejected"][name] = f"declares dimension {data['dimension']} but holds {len(vector)} values"
+                continue
+            if dimension is None:
+                dimension, model_id = len(vector), model_id or data.get("model_id")
+                print(f"Corpus dimension {dimension}, model {model_id}")
+            if len(vector) != dimension:
+                manifest["rejected"][name] = f"dimension {len(vector)} != corpus dimension {dimension}"
+                continue
+            if model_id and data.get("model_id") and data["model_id"] != model_id:
+                manifest["rejected"][name] = f"model {data['model_id']} != corpus model {model_id}"
+                continue
+            if not np.all(np.isfinite(vector)):
+                manifest["rejected"][name] = "non-finite values"
+                continue
+            if doc["id"] in existing_ids or doc["id"] in compacted:
+                skipped += 1
+                manifest["shards"][name] = {"id": doc["id"], "row": None, "duplicate": True}
+                continue
+
+            scratch.write((vector / max(np.linalg.norm(vector), 1e-12)).tobytes())
+            compacted[doc["id"]] = name
+            docs.append(doc)
+
+    try:
+        if docs:
+            new_rows = np.memmap(scratch_path, dtype=np.float32, mode="r", shape=(len(docs), dimension))
+            total = doc_store.append_rows(embeddings_path, new_rows, expected_rows=rows_before)
+            del new_rows
+            doc_store.append_documents(embeddings_dir, docs, expected_rows=rows_before)
+            for row, doc in enumerate(docs, start=rows_before):
+                manifest["shards"][compacted[doc["id"]]] = {"id": doc["id"], "row": row}
+            manifest["rows"] = total
+        manifest["dimension"], manifest["model_id"] = dimension, model_id
+        manifest["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        save_manifest(embeddings_dir, manifest)
+    finally:
+        os.remove(scratch_path)
+        if store is not None:
+            store.close()
+
+    rejected = len([p for p in pending if os.path.basename(p) in manifest["rejected"]])
+    print(f"Compacted {len(docs)} shards ({rejected} rejected, {skipped} duplicates) "
+          f"in {time.time() - start_time:.2f} seconds; corpus has {manifest['rows']} rows")
+    return {"compacted": len(docs), "rejected": rejected, "skipped": skipped, "rows": manifest["rows"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings-dir", default="embeddings-s3-bucket")
+    parser.add_argument("--shards-dir", default=None)
+    parser.add_argument("--dimension", type=int, default=None, help="Expected dimension for a new corpus")
+    parser.add_argument("--model-id", default=None, help="Expected embedding model for a new corpus")
+    args = parser.parse_args()
+    compact(args.embeddings_dir, args.shards_dir, args.dimension, args.model_id)
+
+
+if __name__ == "__main__":
+    main()
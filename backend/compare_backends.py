@@ -0,0 +1,125 @@
+"""
+Compare the PyTorch and ONNX Runtime inference backends on the same texts.
+
+Reports label agreement / probability drift for the fake-news classifier,
+cosine similarity for the MiniLM embedder, and batch latency for both.
+
+Usage:
+    python compare_backends.py [--texts FILE] [--batch-size 16] [--runs 5] [--no-quantize]
+
+FILE may be a .txt file (one text per blank-line separated block) or a
+fact_check_results*.json file. By default every fact_check_results*.json in
+this directory is used (articles and extracted statements).
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+import onnx_backend
+from model_registry import MODEL_SPECS, ModelRegistry
+
+
+def load_texts(path=None):
+    paths = [path] if path else sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                               "fact_check_results*.json")))
+    texts = []
+    for p in paths:
+        if p.endswith(".txt"):
+            with open(p, encoding="utf-8") as f:
+                texts.extend(block.strip() for block in f.read().split("\n\n") if block.strip())
+            continue
+        with open(p, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("article"):
+            texts.append(data["article"])
+        texts.extend(check["statement"] for check in data.get("fact_checks", []) if check.get("statement"))
+    return texts
+
+
+def time_batches(fn, texts, batch_size, runs):
+    latencies = []
+    outputs = None
+    for _ in range(runs):
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            start_time = time.perf_counter()
+            outputs.extend(fn(batch))
+            latencies.append((time.perf_counter() - start_time) * 1000.0)
+    return outputs, np.array(latencies)
+
+
+def describe(latencies, n_texts, runs):
+    total_s = latencies.sum() / 1000.0
+    return (f"p50 {np.percentile(latencies, 50):.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms, "
+            f"{n_texts * runs / total_s:.1f} texts/s")
+
+
+def compare_classifier(torch_models, onnx_models, texts, batch_size, runs):
+    run_kwargs = {"truncation": True, "padding": True, "top_k": None}
+    torch_out, torch_lat = time_batches(
+        lambda b: torch_models.run("fake-news", b, batch_size=len(b), **run_kwargs), texts, batch_size, runs)
+    onnx_out, onnx_lat = time_batches(
+        lambda b: onnx_models.run("fake-news", b, batch_size=len(b), **run_kwargs), texts, batch_size, runs)
+
+    agree = 0
+    drift = []
+    for t, o in zip(torch_out, onnx_out):
+        t_scores = {item["label"]: item["score"] for item in t}
+        o_scores = {item["label"]: item["score"] for item in o}
+        agree += max(t_scores, key=t_scores.get) == max(o_scores, key=o_scores.get)
+        drift.append(max(abs(t_scores[label] - o_scores.get(label, 0.0)) for label in t_scores))
+
+    print("\n=== fake-news classifier ===")
+    print(f"Label agreement: {agree}/{len(texts)} ({100.0 * agree / len(texts):.1f}%)")
+    print(f"Max |Δp|: {max(drift):.4f}, mean |Δp|: {float(np.mean(drift)):.4f}")
+    print(f"PyTorch: {describe(torch_lat, len(texts), runs)}")
+    print(f"ONNX:    {describe(onnx_lat, len(texts), runs)}")
+    print(f"Speedup: {torch_lat.sum() / onnx_lat.sum():.2f}x")
+
+
+def compare_embedder(torch_models, onnx_models, texts, batch_size, runs):
+    torch_out, torch_lat = time_batches(
+        lambda b: torch_models.run("minilm", b, normalize_embeddings=True), texts, batch_size, runs)
+    onnx_out, onnx_lat = time_batches(
+        lambda b: onnx_models.run("minilm", b, normalize_embeddings=True), texts, batch_size, runs)
+
+    cosine = np.sum(np.asarray(torch_out) * np.asarray(onnx_out), axis=1)
+    print("\n=== all-MiniLM-L6-v2 embedder ===")
+    print(f"Cosine(PyTorch, ONNX): min {cosine.min():.4f}, mean {cosine.mean():.4f}")
+    print(f"PyTorch: {describe(torch_lat, len(texts), runs)}")
+    print(f"ONNX:    {describe(onnx_lat, len(texts), runs)}")
+    print(f"Speedup: {torch_lat.sum() / onnx_lat.sum():.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare PyTorch and ONNX Runtime inference backends")
+    parser.add_argument("--texts", help="Text or fact_check_results JSON file to evaluate on")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--runs", type=int, default=5, help="Timed passes over the texts")
+    parser.add_argument("--no-quantize", action="store_true", help="Compare against the fp32 ONNX export")
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts)
+    if not texts:
+        print("No texts found to compare on.")
+        return
+    print(f"Comparing backends on {len(texts)} texts (batch size {args.batch_size}, {args.runs} runs)")
+
+    onnx_backend.ONNX_QUANTIZE = not args.no_quantize
+    torch_models = ModelRegistry({name: dict(spec, backend="torch") for name, spec in MODEL_SPECS.items()})
+    onnx_models = ModelRegistry({name: dict(spec, backend="onnx") for name, spec in MODEL_SPECS.items()})
+    for models in (torch_models, onnx_models):
+        # Load and run once so the timings don't include model loading
+        models.warmup(list(MODEL_SPECS))
+
+    compare_classifier(torch_models, onnx_models, texts, args.batch_size, args.runs)
+    compare_embedder(torch_models, onnx_models, texts, args.batch_size, args.runs)
+
+
+if __name__ == "__main__":
+    main()
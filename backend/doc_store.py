@@ -0,0 +1,213 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# On-disk layout, all in one directory:
+#   documents.jsonl        one JSON document per row, appended in row order
+#   documents.offsets.npy  int64 byte offsets, rows + 1 entries (offset[-1] = end of data)
+#   doc_ids.json           document id -> row
+# Rows are read with pread by offset, so opening the store costs one small
+# array load regardless of how many documents it holds.
+DATA_FILE = "documents.jsonl"
+OFFSETS_FILE = "documents.offsets.npy"
+IDS_FILE = "doc_ids.json"
+
+
+def exists(directory):
+    return os.path.exists(os.path.join(directory, OFFSETS_FILE))
+
+
+def document_from_shard(data):
+    """
+    Build the stored document for one embeddings/{analysis_id}.json shard.
+
+    Returns None for shards without a summary or analysis id.
+    """
+    if not data.get("summary") or not data.get("analysis_id"):
+        return None
+    return {
+        "id": data["analysis_id"],
+        "content": data["summary"],
+        "metadata": {
+            "analysis_id": data["analysis_id"],
+            "verification_date": data.get("verification_date"),
+            "embedding_model": data.get("model_id"),
+        },
+    }
+
+
+class DocumentStore:
+    """Read-only view of an offset-indexed document store."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.offsets = np.load(os.path.join(directory, OFFSETS_FILE))
+        with open(os.path.join(directory, IDS_FILE), 'r') as f:
+            self.ids = json.load(f)
+        self._fd = os.open(os.path.join(directory, DATA_FILE), os.O_RDONLY)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(os.pread(self._fd, end - start, start))
+
+    def row_of(self, doc_id):
+        row = self.ids.get(doc_id)
+        # The id map is replaced before the offsets, so it can briefly run ahead
+        return row if row is not None and row < len(self) else None
+
+    def close(self):
+        os.close(self._fd)
+
+
+_append_lock = threading.Lock()
+
+
+def append_documents(directory, docs, expected_rows=None):
+    """
+    Append documents to the store in ``directory``, creating it if needed.
+
+    Data is appended first and the offsets/id files are replaced afterwards,
+    so a crash part-way leaves the previous store intact (any bytes past the
+    last recorded offset are truncated on the next append).
+
+    Parameters:
+    directory (str): Store directory
+    docs (list): Dicts with id, content and metadata, in row order
+    expected_rows (int, optional): Rows the store must hold before appending; guards against writers racing
+
+    Returns:
+    int: Rows in the store after appending
+    """
+    data_path = os.path.join(directory, DATA_FILE)
+    offsets_path = os.path.join(directory, OFFSETS_FILE)
+    ids_path = os.path.join(directory, IDS_FILE)
+
+    with _append_lock:
+        if exists(directory):
+            offsets = np.load(offsets_path)
+            with open(ids_path, 'r') as f:
+                ids = json.load(f)
+        else:
+            offsets = np.zeros(1, dtype=np.int64)
+            ids = {}
+        if expected_rows is not None and len(offsets) - 1 != expected_rows:
+            raise ValueError(f"Document store has {len(offsets) - 1} rows, expected {expected_rows}")
+
+        new_offsets = []
+        with open(data_path, 'ab') as f:
+            f.truncate(int(offsets[-1]))
+            position = int(offsets[-1])
+            for doc in docs:
+                line = (json.dumps(doc, default=str) + "\n").encode("utf-8")
+                f.write(line)
+                position += len(line)
+                new_offsets.append(position)
+                ids[doc["id"]] = len(offsets) - 1 + len(new_offsets) - 1
+            f.flush()
+            os.fsync(f.fileno())
+
+        offsets = np.concatenate([offsets, np.asarray(new_offsets, dtype=np.int64)])
+        tmp_path = offsets_path + ".tmp.npy"
+        np.save(tmp_path, offsets)
+        tmp_ids = ids_path + ".tmp"
+        with open(tmp_ids, 'w') as f:
+            json.dump(ids, f)
+        os.replace(tmp_ids, ids_path)
+        os.replace(tmp_path, offsets_path)
+        return len(offsets) - 1
+
+
+def truncate_documents(directory, rows):
+    """
+    Drop every row from ``rows`` on from the store in ``directory``, e.g. rows
+    an interrupted snapshot wrote past the index.
+
+    Returns:
+    int: Rows in the store afterwards
+    """
+    offsets_path = os.path.join(directory, OFFSETS_FILE)
+    ids_path = os.path.join(directory, IDS_FILE)
+
+    with _append_lock:
+        offsets = np.load(offsets_path)
+        if len(offsets) - 1 <= rows:
+            return len(offsets) - 1
+        with open(ids_path, 'r') as f:
+            ids = json.load(f)
+        ids = {doc_id: row for doc_id, row in ids.items() if row < rows}
+        # Same order as append_documents; the data past the last offset is
+        # truncated by the next append
+        tmp_path = offsets_path + ".tmp.npy"
+        np.save(tmp_path, offsets[:rows + 1])
+        tmp_ids = ids_path + ".tmp"
+        with open(tmp_ids, 'w') as f:
+            json.dump(ids, f)
+        os.replace(tmp_ids, ids_path)
+        os.replace(tmp_path, offsets_path)
+        return rows
+
+
+def truncate_rows(npy_path, rows, block_rows=65536):
+    """
+    Rewrite the float32 matrix at ``npy_path`` keeping only its first ``rows`` rows.
+
+    Returns:
+    int: Rows in the file afterwards
+    """
+    old = np.load(npy_path, mmap_mode="r")
+    if old.shape[0] <= rows:
+        return old.shape[0]
+    tmp_path = npy_path + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(rows, old.shape[1]))
+    for start in range(0, rows, block_rows):
+        end = min(start + block_rows, rows)
+        out[start:end] = old[start:end]
+    out.flush()
+    del out, old
+    os.replace(tmp_path, npy_path)
+    return rows
+
+
+def append_rows(npy_path, new_rows, expected_rows=None, block_rows=65536):
+    """
+    Rewrite the float32 matrix at ``npy_path`` as its current rows followed by ``new_rows``.
+
+    Old and new rows are copied block by block into a fresh memmap, so
+    neither has to fit in memory (``new_rows`` may itself be a memmap).
+
+    Parameters:
+    npy_path (str): .npy file, created if missing
+    new_rows (numpy.ndarray): Rows to append
+    expected_rows (int, optional): Rows the file must hold before appending
+    block_rows (int): Rows copied per block
+
+    Returns:
+    int: Rows in the file afterwards
+    """
+    old = np.load(npy_path, mmap_mode="r") if os.path.exists(npy_path) else None
+    old_rows = old.shape[0] if old is not None else 0
+    if expected_rows is not None and old_rows != expected_rows:
+        raise ValueError(f"{npy_path} has {old_rows} rows, expected {expected_rows}")
+    if old is not None and old.shape[1] != new_rows.shape[1]:
+        raise ValueError(f"{npy_path} has dimension {old.shape[1]}, new rows have {new_rows.shape[1]}")
+
+    total = old_rows + new_rows.shape[0]
+    tmp_path = npy_path + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(total, new_rows.shape[1]))
+    for source, offset in ((old, 0), (new_rows, old_rows)):
+        if source is None:
+            continue
+        for start in range(0, source.shape[0], block_rows):
+            end = min(start + block_rows, source.shape[0])
+            out[offset + start:offset + end] = source[start:end]
+    out.flush()
+    del out, old
+    os.replace(tmp_path, npy_path)
+    return total
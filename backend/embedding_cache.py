@@ -0,0 +1,148 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+# Vectors are stored as SQLite blobs keyed by (model id, dimension, hash of the
+# normalized text). float16 halves the footprint at a precision cost well below
+# what matters for similarity search; set EMBEDDING_CACHE_DTYPE=float32 to keep
+# exact vectors.
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "1") != "0"
+
+
+def normalize_text(text):
+    """Unicode-normalize and collapse whitespace so trivially different copies share an entry."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(text, model_id, dimension):
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model_id}:{dimension}:{digest}"
+
+
+class EmbeddingCache:
+    """Persistent LRU cache of embedding vectors backed by SQLite."""
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, dtype=EMBEDDING_CACHE_DTYPE, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model_id TEXT NOT NULL, dimension INTEGER NOT NULL,"
+            " dtype TEXT NOT NULL, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    def get_many(self, texts, model_id, dimension):
+        """Return a list with a float32 vector for each cached text and None for misses."""
+        keys = [cache_key(text, model_id, dimension) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.dtype(dtype)).astype(np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+
+        results = [found.get(key) for key in keys]
+        hits = sum(result is not None for result in results)
+        self.hits += hits
+        self.misses += len(results) - hits
+        # What the provider would have sent back for these as float32 vectors
+        self.bytes_saved += sum(result.nbytes for result in results if result is not None)
+        return results
+
+    def get(self, text, model_id, dimension):
+        return self.get_many([text], model_id, dimension)[0]
+
+    def put_many(self, texts, vectors, model_id, dimension):
+        """Store vectors (one per text) and evict least recently used entries past the limit."""
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            if vector.shape != (dimension,):
+                continue
+            rows.append((cache_key(text, model_id, dimension), model_id, dimension, self.dtype.str,
+                         vector.astype(self.dtype).tobytes(), now))
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)", rows)
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (excess,),
+                )
+                self.evictions += excess
+            self._conn.commit()
+
+    def put(self, text, vector, model_id, dimension):
+        self.put_many([text], [vector], model_id, dimension)
+
+    def stats(self):
+        with self._lock:
+            entries, stored_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "dtype": self.dtype.name,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "stored_bytes": stored_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the shared embedding cache, or None when EMBEDDING_CACHE_ENABLED=0."""
+    global _cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
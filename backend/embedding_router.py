@@ -0,0 +1,232 @@
+import concurrent.futures
+import os
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from embeddings import PROVIDER_MODELS, _embed_with_cache, provider_model, provider_progress
+
+# Providers tried in order when the preferred one fails or its breaker is open
+PROVIDER_CHAIN = [p.strip() for p in os.getenv("EMBEDDING_PROVIDER_CHAIN", "bedrock,huggingface,ollama").split(",") if p.strip()]
+# Seconds a call may go without progress before it is abandoned. Bedrock and
+# Ollama embed chunk by chunk, so for them the clock restarts whenever a
+# request completes and a large rate-limited batch isn't cut off part-way;
+# the local model embeds a batch in one go and gets the timeout once.
+PROVIDER_TIMEOUTS = {
+    "bedrock": float(os.getenv("BEDROCK_EMBED_TIMEOUT_S", "10")),
+    "huggingface": float(os.getenv("LOCAL_EMBED_TIMEOUT_S", "30")),
+    "ollama": float(os.getenv("OLLAMA_EMBED_TIMEOUT_S", "60")),
+}
+REMOTE_PROVIDERS = {"bedrock"}
+# When a remote call hasn't answered after EMBED_HEDGE_AFTER_S, race
+# EMBED_HEDGE_PROVIDER against it and keep whichever finishes first.
+# 0 disables hedging.
+HEDGE_AFTER_S = float(os.getenv("EMBED_HEDGE_AFTER_S", "0"))
+HEDGE_PROVIDER = os.getenv("EMBED_HEDGE_PROVIDER", "huggingface")
+# Consecutive failures that open a breaker, and how long it stays open
+BREAKER_FAILURES = int(os.getenv("EMBED_BREAKER_FAILURES", "3"))
+BREAKER_RESET_S = float(os.getenv("EMBED_BREAKER_RESET_S", "30"))
+
+
+class TaggedEmbeddings(NamedTuple):
+    """Embedding vectors plus the model space they belong to."""
+    vectors: np.ndarray
+    provider: str
+    model_id: str
+    dimension: int
+
+
+class CircuitBreaker:
+    """Stops calling a provider after repeated failures, then lets one trial call through."""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_S):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class EmbeddingRouter:
+    """Routes embedding requests across providers with timeouts, breakers and optional hedging."""
+
+    def __init__(self, chain=PROVIDER_CHAIN, timeouts=PROVIDER_TIMEOUTS,
+                 hedge_after=HEDGE_AFTER_S, hedge_provider=HEDGE_PROVIDER):
+        self.chain = list(chain)
+        self.timeouts = dict(timeouts)
+        self.hedge_after = hedge_after
+        self.hedge_provider = hedge_provider
+        self.breakers = {provider: CircuitBreaker() for provider in PROVIDER_MODELS}
+        # Calls run here so a hung provider can be abandoned at its timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="embed")
+        self.hedges_started = 0
+        self.hedges_won = 0
+
+    def _tag(self, provider, vectors):
+        model_id, dimension = provider_model(provider)
+        return TaggedEmbeddings(vectors, provider, model_id, dimension)
+
+    def _submit(self, provider, texts):
+        return self._executor.submit(_embed_with_cache, texts, provider)
+
+    def _finish(self, provider, future):
+        try:
+            vectors = future.result(timeout=0)
+        except Exception:
+            self.breakers[provider].record_failure()
+            raise
+        self.breakers[provider].record_success()
+        return self._tag(provider, vectors)
+
+    @staticmethod
+    def _wait(futures, provider, timeout):
+        """
+        Wait for the first of ``futures`` to finish.
+
+        Gives up once ``provider`` has completed no request for ``timeout``
+        seconds (or after ``timeout`` outright for untracked providers).
+
+        Returns:
+        set: The finished futures, empty on timeout
+        """
+        seen = provider_progress(provider)
+        last_progress = time.monotonic()
+        while True:
+            remaining = last_progress + timeout - time.monotonic()
+            done, _ = concurrent.futures.wait(futures, timeout=max(min(remaining, 1.0), 0.0),
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if done:
+                return done
+            progress = provider_progress(provider)
+            if progress != seen:
+                seen, last_progress = progress, time.monotonic()
+            elif remaining <= 0:
+                return set()
+
+    def _call(self, provider, texts):
+        timeout = self.timeouts.get(provider, 30.0)
+        primary = self._submit(provider, texts)
+
+        can_hedge = (
+            self.hedge_after > 0
+            and provider in REMOTE_PROVIDERS
+            and self.hedge_provider != provider
+            and self.hedge_provider in PROVIDER_MODELS
+        )
+        done, _ = concurrent.futures.wait([primary], timeout=self.hedge_after if can_hedge else 0)
+        if not can_hedge or done or not self.breakers[self.hedge_provider].allow():
+            if not done and not self._wait([primary], provider, timeout):
+                self.breakers[provider].record_failure()
+                raise TimeoutError(f"{provider} embeddings made no progress for {timeout}s")
+            return self._finish(provider, primary)
+
+        self.hedges_started += 1
+        hedge = self._submit(self.hedge_provider, texts)
+        pending = {primary: provider, hedge: self.hedge_provider}
+        last_error = None
+        while pending:
+            # The primary's progress keeps both calls alive
+            done = self._wait(list(pending), provider, timeout)
+            if not done:
+                break
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = self._finish(name, future)
+                except Exception as e:
+                    print(f"Embedding provider {name} failed: {e}")
+                    last_error = e
+                    continue
+                if name != provider:
+                    self.hedges_won += 1
+                return result
+        if not pending:
+            # Both calls failed before the deadline; report why, not a timeout
+            raise last_error
+        # Whatever is still running has stalled
+        for name in pending.values():
+            self.breakers[name].record_failure()
+        raise TimeoutError(f"{provider} embeddings made no progress for {timeout}s")
+
+    def embed(self, texts, preferred=None):
+        """
+        Embed texts with the first healthy provider.
+
+        Parameters:
+        texts (list): Texts to embed
+        preferred (str, optional): Provider to try first; the rest of the chain follows
+
+        Returns:
+        TaggedEmbeddings: float32 matrix tagged with the provider, model id and dimension
+        """
+        texts = [text or "" for text in texts]
+        chain = list(self.chain)
+        if preferred:
+            preferred = preferred.lower()
+            chain = [preferred] + [p for p in chain if p != preferred]
+
+        errors = []
+        for provider in chain:
+            if provider not in PROVIDER_MODELS:
+                errors.append(f"{provider}: unknown provider")
+                continue
+            if not self.breakers[provider].allow():
+                errors.append(f"{provider}: circuit open")
+                continue
+            try:
+                return self._call(provider, texts)
+            except Exception as e:
+                print(f"Error generating embeddings with {provider}: {str(e)}")
+                errors.append(f"{provider}: {e}")
+        raise RuntimeError("All embedding providers failed: " + "; ".join(errors))
+
+    def stats(self):
+        return {
+            "chain": self.chain,
+            "timeouts": self.timeouts,
+            "hedge_after_s": self.hedge_after,
+            "hedge_provider": self.hedge_provider,
+            "hedges_started": self.hedges_started,
+            "hedges_won": self.hedges_won,
+            "breakers": {
+                provider: {"state": breaker.state, "failures": breaker.failures}
+                for provider, breaker in self.breakers.items()
+            },
+        }
+
+
+router = EmbeddingRouter()
@@ -0,0 +1,397 @@
+import json
+import os
+import subprocess
+import threading
+import time
+import concurrent.futures
+from typing import NamedTuple
+
+import boto3
+from botocore.config import Config
+import numpy as np
+
+import embedding_cache
+import model_workers
+from model_registry import registry as model_registry
+
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+
+BEDROCK_EMBEDDING_MODEL = os.getenv("BEDROCK_EMBEDDING_MODEL", "amazon.titan-embed-text-v1")
+BEDROCK_EMBEDDING_DIMENSION = int(os.getenv("BEDROCK_EMBEDDING_DIMENSION", "768"))
+OLLAMA_EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "llama3.2")
+OLLAMA_EMBEDDING_DIMENSION = int(os.getenv("OLLAMA_EMBEDDING_DIMENSION", "3072"))
+# Unset means "whatever LOCAL_EMBEDDING_MODEL produces", read from the model on first use
+LOCAL_EMBEDDING_DIMENSION = int(os.getenv("LOCAL_EMBEDDING_DIMENSION", "0")) or None
+# Titan embeds one text per request, so batches fan out as concurrent requests:
+# at most BEDROCK_EMBED_CONCURRENCY in flight and BEDROCK_EMBED_RPS started per second
+BEDROCK_EMBED_CONCURRENCY = int(os.getenv("BEDROCK_EMBED_CONCURRENCY", "8"))
+BEDROCK_EMBED_RPS = float(os.getenv("BEDROCK_EMBED_RPS", "20"))
+
+# Per-provider input limits. Inputs over max_tokens are split with
+# chunk_text_by_tokens and their chunk vectors averaged, never clipped.
+PROVIDER_LIMITS = {
+    "bedrock": {"max_tokens": int(os.getenv("BEDROCK_MAX_INPUT_TOKENS", "4096"))},
+    "huggingface": {"batch_size": LOCAL_EMBEDDING_BATCH_SIZE},
+    "ollama": {"max_tokens": int(os.getenv("OLLAMA_MAX_INPUT_TOKENS", "2048"))},
+}
+
+# Model id and vector dimension behind each provider; cache entries are keyed
+# by these. Read them through provider_model(), which fills in a dimension
+# left as None from the loaded model.
+PROVIDER_MODELS = {
+    "bedrock": (BEDROCK_EMBEDDING_MODEL, BEDROCK_EMBEDDING_DIMENSION),
+    "huggingface": (model_registry.specs["minilm"]["model"], LOCAL_EMBEDDING_DIMENSION),
+    "ollama": (OLLAMA_EMBEDDING_MODEL, OLLAMA_EMBEDDING_DIMENSION),
+}
+_dimension_lock = threading.Lock()
+
+
+def provider_model(provider):
+    """
+    Model id and vector dimension behind ``provider``.
+
+    Returns:
+    tuple: (model_id, dimension)
+    """
+    model_id, dimension = PROVIDER_MODELS[provider]
+    if dimension is None:
+        with _dimension_lock:
+            model_id, dimension = PROVIDER_MODELS[provider]
+            if dimension is None:
+                # Only the local model is left unconfigured; ask it (or a model worker holding it)
+                pool = model_workers.get_pool()
+                if pool is not None:
+                    dimension = int(pool.embed(["dimension probe"]).shape[1])
+                else:
+                    dimension = int(model_registry.get("minilm").get_sentence_embedding_dimension())
+                PROVIDER_MODELS[provider] = (model_id, dimension)
+    return model_id, dimension
+
+_bedrock_client = None
+
+
+def get_bedrock_client():
+    global _bedrock_client
+    if _bedrock_client is None:
+        # Bounded timeouts so a hung call fails over instead of stalling the pipeline
+        _bedrock_client = boto3.client("bedrock-runtime", config=Config(
+            connect_timeout=float(os.getenv("BEDROCK_CONNECT_TIMEOUT_S", "3")),
+            read_timeout=float(os.getenv("BEDROCK_READ_TIMEOUT_S", "10")),
+            retries={"max_attempts": 2}
+        ))
+    return _bedrock_client
+
+
+class RateLimiter:
+    """Token bucket shared by every thread calling one provider."""
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate = rate_per_second
+        self.capacity = burst or max(1.0, rate_per_second)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+bedrock_rate_limiter = RateLimiter(BEDROCK_EMBED_RPS)
+
+# Requests each chunked provider has completed, so the router can tell a
+# large, rate-limited batch that is still moving from a provider that hangs
+_progress = {"bedrock": 0, "ollama": 0}
+_progress_lock = threading.Lock()
+
+
+def _record_progress(provider):
+    with _progress_lock:
+        _progress[provider] += 1
+
+
+def provider_progress(provider):
+    """Requests ``provider`` has completed so far in this process (None if it isn't tracked)."""
+    return _progress.get(provider)
+
+
+def embed_local(texts, batch_size=LOCAL_EMBEDDING_BATCH_SIZE):
+    """
+    Embed texts with the shared local all-MiniLM-L6-v2 model.
+
+    The model is loaded once per process (or per model worker when
+    MODEL_WORKERS is set). Token embeddings are mean-pooled over the attention
+    mask, so padding doesn't dilute short texts, and every vector is L2-normalized.
+
+    Parameters:
+    texts (list): Strings to embed; they are run through the model batch_size at a time
+    batch_size (int): Texts per forward pass
+
+    Returns:
+    numpy.ndarray: float32 matrix of shape (len(texts), dimension)
+    """
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    pool = model_workers.get_pool()
+    if pool is not None:
+        return pool.embed(texts)
+    embeddings = model_registry.run("minilm", texts, batch_size=batch_size, normalize_embeddings=True)
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+def _embed_in_chunks(texts, provider, embed_many):
+    """
+    Embed texts through a provider that takes one bounded input per call.
+
+    Texts over the provider's max_tokens are split with chunk_text_by_tokens
+    and their chunk vectors averaged, weighted by token count. Empty texts
+    get a zero vector rather than failing the whole batch.
+
+    Parameters:
+    texts (list): Strings to embed
+    provider (str): Key into PROVIDER_LIMITS and PROVIDER_MODELS
+    embed_many (callable): list of chunk texts -> one vector per chunk
+
+    Returns:
+    numpy.ndarray: float32 matrix of shape (len(texts), dimension)
+    """
+    dimension = provider_model(provider)[1]
+    pieces, owners, weights = [], [], []
+    for i, text in enumerate(texts):
+        for chunk, count in chunk_text_by_tokens(text, PROVIDER_LIMITS[provider]["max_tokens"]):
+            pieces.append(chunk)
+            owners.append(i)
+            weights.append(max(count, 1))
+
+    vectors = np.zeros((len(texts), dimension), dtype=np.float32)
+    if not pieces:
+        return vectors
+    embedded = np.asarray(embed_many(pieces), dtype=np.float32)
+    if embedded.ndim != 2 or embedded.shape[1] != dimension:
+        raise ValueError(f"{provider} returned shape {embedded.shape}, expected dimension {dimension}")
+    weights = np.asarray(weights, dtype=np.float32)
+    totals = np.zeros(len(texts), dtype=np.float32)
+    np.add.at(vectors, owners, embedded * weights[:, None])
+    np.add.at(totals, owners, weights)
+    filled = totals > 0
+    vectors[filled] /= totals[filled, None]
+    return vectors
+
+
+def embed_bedrock_one(text):
+    """Embed a single text (within the Bedrock token limit) with Bedrock Titan. Returns a list of floats."""
+    bedrock_rate_limiter.acquire()
+    response = get_bedrock_client().invoke_model(
+        modelId=BEDROCK_EMBEDDING_MODEL,
+        body=json.dumps({
+            "inputText": text,
+            "embeddingConfig": {
+                "outputEmbeddingLength": BEDROCK_EMBEDDING_DIMENSION
+            }
+        })
+    )
+    response_body = json.loads(response.get('body').read().decode('utf-8'))
+    _record_progress("bedrock")
+    return response_body.get('embedding', [])
+
+
+def embed_bedrock(texts, max_workers=BEDROCK_EMBED_CONCURRENCY):
+    """Embed texts with Bedrock, running chunk requests concurrently under the rate limit."""
+    def embed_many(pieces):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(embed_bedrock_one, pieces))
+
+    return _embed_in_chunks(texts, "bedrock", embed_many)
+
+
+def embed_ollama(texts):
+    """Embed texts one chunk at a time through the local Ollama CLI."""
+    def embed_many(pieces):
+        vectors = []
+        for piece in pieces:
+            result = subprocess.run(
+                ["ollama", "embeddings", OLLAMA_EMBEDDING_MODEL],
+                input=piece,
+                text=True,
+                capture_output=True,
+                check=True,
+                timeout=60,
+                encoding="utf-8"
+            )
+            vectors.append(json.loads(result.stdout))
+            _record_progress("ollama")
+        return vectors
+
+    return _embed_in_chunks(texts, "ollama", embed_many)
+
+
+def _embed_uncached(texts, provider):
+    if provider == "bedrock":
+        return embed_bedrock(texts)
+    if provider == "huggingface":
+        return embed_local(texts, batch_size=PROVIDER_LIMITS["huggingface"]["batch_size"])
+    if provider == "ollama":
+        return embed_ollama(texts)
+    raise ValueError(f"Unknown model provider: {provider}")
+
+
+def _embed_with_cache(texts, provider):
+    # Only texts the cache hasn't seen for this provider's model go to the provider
+    if provider not in PROVIDER_MODELS:
+        raise ValueError(f"Unknown model provider: {provider}")
+    model_id, dimension = provider_model(provider)
+    cache = embedding_cache.get_cache()
+    cached = cache.get_many(texts, model_id, dimension) if cache is not None else [None] * len(texts)
+
+    missing = [i for i, vector in enumerate(cached) if vector is None]
+    embeddings = np.empty((len(texts), dimension), dtype=np.float32)
+    if missing:
+        fresh = np.asarray(_embed_uncached([texts[i] for i in missing], provider), dtype=np.float32)
+        if fresh.shape[1] != dimension:
+            raise ValueError(f"{provider} returned dimension {fresh.shape[1]} but {model_id} is configured "
+                             f"with {dimension}; check its *_EMBEDDING_DIMENSION setting")
+        embeddings[missing] = fresh
+        if cache is not None:
+            cache.put_many([texts[i] for i in missing], fresh, model_id, dimension)
+    for i, vector in enumerate(cached):
+        if vector is not None:
+            embeddings[i] = vector
+    return embeddings
+
+
+def generate_embeddings_batch(texts, model_provider="bedrock", tagged=False):
+    """
+    Generate embeddings for many texts at once.
+
+    Texts already in the embedding cache are served from it. The rest go to
+    the provider: Bedrock requests run concurrently under a rate limit and the
+    local model embeds them in batched forward passes. Provider selection,
+    timeouts and fallback are handled by the embedding router; the whole batch
+    always comes from one model.
+
+    Parameters:
+    texts (list): The texts to embed
+    model_provider (str): Provider to try first: 'bedrock', 'huggingface', or 'ollama'
+    tagged (bool): Return a TaggedEmbeddings (vectors + provider/model id/dimension)
+
+    Returns:
+    numpy.ndarray or TaggedEmbeddings: Contiguous float32 matrix, one row per text
+    """
+    from embedding_router import router
+
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    result = router.embed(texts, preferred=model_provider)
+    print(f"Generated {len(texts)} embeddings using {result.provider} with dimension {result.dimension}")
+    return result if tagged else result.vectors
+
+
+# Long texts are split into chunks of at most this many tokens (with
+# EMBED_CHUNK_OVERLAP tokens shared between neighbours) before embedding.
+# The local model's limit comes from its own max_seq_length; Titan accepts
+# far more, but ~1k-token chunks keep passages small enough to retrieve.
+EMBED_CHUNK_TOKENS = {
+    "bedrock": int(os.getenv("BEDROCK_EMBED_CHUNK_TOKENS", "1024")),
+    "huggingface": int(os.getenv("LOCAL_EMBED_CHUNK_TOKENS", "254")),
+    "ollama": int(os.getenv("OLLAMA_EMBED_CHUNK_TOKENS", "1024")),
+}
+EMBED_CHUNK_OVERLAP = int(os.getenv("EMBED_CHUNK_OVERLAP", "32"))
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_chunk_tokenizer():
+    # Only the tokenizer is needed to measure chunks, not the model weights
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(model_registry.specs["minilm"]["model"])
+    return _tokenizer
+
+
+def chunk_text_by_tokens(text, max_tokens, overlap=EMBED_CHUNK_OVERLAP):
+    """
+    Split text into chunks of at most max_tokens tokens, sharing overlap tokens.
+
+    Chunk boundaries come from the tokenizer's character offsets, so each chunk
+    is an exact slice of the original text.
+
+    Returns:
+    list: (chunk_text, token_count) tuples
+    """
+    encoded = get_chunk_tokenizer()(text, add_special_tokens=False, return_offsets_mapping=True)
+    offsets = encoded["offset_mapping"]
+    if len(offsets) <= max_tokens:
+        return [(text, len(offsets))] if text.strip() else []
+
+    overlap = min(overlap, max_tokens // 2)
+    chunks = []
+    start = 0
+    while start < len(offsets):
+        end = min(start + max_tokens, len(offsets))
+        chunks.append((text[offsets[start][0]:offsets[end - 1][1]], end - start))
+        if end == len(offsets):
+            break
+        start = end - overlap
+    return chunks
+
+
+class LongTextEmbeddings(NamedTuple):
+    """Pooled document vector plus the per-chunk vectors it was built from."""
+    document: np.ndarray
+    chunks: np.ndarray
+    chunk_texts: list
+    provider: str
+    model_id: str
+    dimension: int
+
+
+def embed_long_text(text, model_provider="bedrock"):
+    """
+    Embed a text of any length without truncating it.
+
+    The text is split by the provider's token limit, every chunk is embedded
+    in one batch, and the chunk vectors are averaged (weighted by token count)
+    into an L2-normalized document vector.
+
+    Parameters:
+    text (str): The text to embed
+    model_provider (str): Provider to try first
+
+    Returns:
+    LongTextEmbeddings: document vector, chunk matrix, chunk texts and model tag
+    """
+    provider = model_provider.lower()
+    chunks = chunk_text_by_tokens(text, EMBED_CHUNK_TOKENS.get(provider, EMBED_CHUNK_TOKENS["huggingface"]))
+    if not chunks:
+        raise ValueError("No text to embed")
+
+    chunk_texts = [chunk for chunk, _ in chunks]
+    result = generate_embeddings_batch(chunk_texts, provider, tagged=True)
+    if result.provider != provider:
+        # The fallback model has a smaller window; re-chunk for it so no chunk
+        # gets silently truncated
+        chunks = chunk_text_by_tokens(text, EMBED_CHUNK_TOKENS.get(result.provider, EMBED_CHUNK_TOKENS["huggingface"]))
+        chunk_texts = [chunk for chunk, _ in chunks]
+        result = generate_embeddings_batch(chunk_texts, result.provider, tagged=True)
+
+    weights = np.array([count for _, count in chunks], dtype=np.float32)
+    document = (weights[:, None] * result.vectors).sum(axis=0) / weights.sum()
+    document /= max(float(np.linalg.norm(document)), 1e-12)
+    return LongTextEmbeddings(document.astype(np.float32), result.vectors, chunk_texts,
+                              result.provider, result.model_id, result.dimension)
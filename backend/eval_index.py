@@ -0,0 +1,113 @@
+"""
+Evaluate a vector index against exact (flat) search over the same corpus.
+
+Reports the index's memory footprint next to a flat float32 index, and
+recall@k and per-query latency over queries sampled from the corpus: from
+the index alone, and re-ranked against the full-precision vectors (read from
+the embeddings.npy memmap) at each --rerank factor.
+
+Usage:
+    python eval_index.py [--embeddings-dir embeddings-s3-bucket] [--index PATH]
+                         [--type ivfopq] [--nlist 1024] [--m 16] [--nbits 8] [--train-sample 100000]
+                         [--queries 1000] [--k 10] [--rerank 1,4,10] [--nprobe 16] [--ef-search 64]
+
+Without --type the index at --index (default <embeddings-dir>/index.faiss) is
+evaluated; with --type one is built in memory first, e.g. to compare ivfpq
+and ivfopq settings before running build_index.py.
+"""
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+
+import vector_index
+
+BLOCK_ROWS = 65536
+
+
+def exact_top_k(vectors, queries, k):
+    """Exact inner-product top-k over normalized ``vectors``, scanned block by block like a flat index."""
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, vectors.shape[0], BLOCK_ROWS):
+        block = vector_index.normalize(vectors[start:start + BLOCK_ROWS])
+        scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+        ids = np.concatenate([best_ids, np.broadcast_to(np.arange(start, start + len(block)),
+                                                        (len(queries), len(block)))], axis=1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(ids, top, axis=1)
+    return best_ids
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f[f >= 0]) & set(t[t >= 0])) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings-dir", default="embeddings-s3-bucket")
+    parser.add_argument("--index", default=None)
+    parser.add_argument("--type", default=None, choices=sorted(vector_index.INDEX_TYPES))
+    parser.add_argument("--M", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["M"])
+    parser.add_argument("--nlist", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["nlist"])
+    parser.add_argument("--m", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["m"])
+    parser.add_argument("--nbits", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["nbits"])
+    parser.add_argument("--train-sample", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["train_sample"])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", default="1,4,10", help="Comma-separated re-rank factors; 1 = no re-ranking")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    args = parser.parse_args()
+
+    vectors = np.load(os.path.join(args.embeddings_dir, "embeddings.npy"), mmap_mode="r")
+    n, dimension = vectors.shape
+
+    start_time = time.time()
+    if args.type:
+        options = {"M": args.M, "nlist": args.nlist, "m": args.m, "nbits": args.nbits,
+                   "train_sample": args.train_sample}
+        index = vector_index.build_index(vectors, args.type, **options)
+        label = args.type
+        print(f"Built {label} index in {time.time() - start_time:.2f} seconds")
+    else:
+        index_path = args.index or os.path.join(args.embeddings_dir, "index.faiss")
+        index = vector_index.load_index(index_path, mmap=False)
+        label = vector_index.read_index_meta(index_path).get("index_type", os.path.basename(index_path))
+        print(f"Loaded {index_path} in {time.time() - start_time:.2f} seconds")
+
+    index_bytes = faiss.serialize_index(index).nbytes
+    flat_bytes = n * dimension * 4
+    print(f"\n{n} vectors of dimension {dimension}")
+    print(f"  flat float32: {flat_bytes / 1e6:10.1f} MB ({dimension * 4} bytes/vector)")
+    print(f"  {label:12s}: {index_bytes / 1e6:10.1f} MB ({index_bytes / max(n, 1):.1f} bytes/vector, "
+          f"{flat_bytes / max(index_bytes, 1):.1f}x smaller)")
+
+    rows = np.sort(np.random.default_rng(0).choice(n, min(args.queries, n), replace=False))
+    queries = vector_index.normalize(vectors[rows])
+    start_time = time.time()
+    truth = exact_top_k(vectors, queries, args.k)
+    flat_ms = (time.time() - start_time) * 1000.0 / len(queries)
+
+    print(f"\nrecall@{args.k} over {len(queries)} sampled queries (nprobe={args.nprobe}, efSearch={args.ef_search})")
+    print(f"  {'exact (flat)':24s} recall 1.000  {flat_ms:8.3f} ms/query")
+    for factor in (int(f) for f in args.rerank.split(",") if f.strip()):
+        start_time = time.time()
+        if factor <= 1:
+            _, found = vector_index.search(index, queries, args.k, ef_search=args.ef_search, nprobe=args.nprobe)
+            name = label
+        else:
+            _, candidates = vector_index.search(index, queries, args.k * factor,
+                                                ef_search=args.ef_search, nprobe=args.nprobe)
+            _, found = vector_index.rerank(queries, candidates, vectors, args.k)
+            name = f"{label} + rerank x{factor}"
+        elapsed_ms = (time.time() - start_time) * 1000.0 / len(queries)
+        print(f"  {name:24s} recall {recall_at_k(found, truth):.3f}  {elapsed_ms:8.3f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
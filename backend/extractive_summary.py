@@ -0,0 +1,81 @@
+import os
+import re
+
+import numpy as np
+
+from embeddings import embed_local
+
+# Summary length: SUMMARY_RATIO of the article's sentences, clamped to
+# [SUMMARY_MIN_SENTENCES, SUMMARY_MAX_SENTENCES]
+SUMMARY_RATIO = float(os.getenv("EXTRACTIVE_SUMMARY_RATIO", "0.2"))
+SUMMARY_MIN_SENTENCES = int(os.getenv("EXTRACTIVE_SUMMARY_MIN_SENTENCES", "3"))
+SUMMARY_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_SUMMARY_MAX_SENTENCES", "8"))
+RANKING = os.getenv("EXTRACTIVE_SUMMARY_RANKING", "textrank")  # textrank | centroid
+
+_SENTENCE_SPLIT = re.compile(r'(?:(?<=[.!?])|(?<=[.!?]["\'”’)]))\s+(?=[A-Z0-9"\'“‘(])')
+
+
+def split_sentences(text):
+    sentences = []
+    for paragraph in text.split("\n"):
+        paragraph = paragraph.strip()
+        if paragraph:
+            sentences.extend(s.strip() for s in _SENTENCE_SPLIT.split(paragraph) if len(s.strip()) > 20)
+    return sentences
+
+
+def textrank_scores(embeddings, damping=0.85, iterations=50, tol=1e-6):
+    """PageRank over the cosine-similarity graph of L2-normalized sentence embeddings."""
+    similarity = embeddings @ embeddings.T
+    np.fill_diagonal(similarity, 0.0)
+    np.clip(similarity, 0.0, None, out=similarity)
+
+    row_sums = similarity.sum(axis=1, keepdims=True)
+    n = len(embeddings)
+    # Sentences similar to nothing spread their weight evenly
+    transition = np.where(row_sums > 0, similarity / np.where(row_sums > 0, row_sums, 1.0), 1.0 / n)
+
+    scores = np.full(n, 1.0 / n, dtype=np.float32)
+    for _ in range(iterations):
+        updated = (1.0 - damping) / n + damping * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < tol:
+            scores = updated
+            break
+        scores = updated
+    return scores
+
+
+def centroid_scores(embeddings):
+    """Cosine similarity of each sentence to the article's mean embedding."""
+    centroid = embeddings.mean(axis=0)
+    centroid /= max(np.linalg.norm(centroid), 1e-12)
+    return embeddings @ centroid
+
+
+def summarize(text, ranking=RANKING, num_sentences=None):
+    """
+    Build an extractive summary from the article's most central sentences.
+
+    Parameters:
+    text (str): The article text
+    ranking (str): 'textrank' or 'centroid'
+    num_sentences (int, optional): Sentences to keep (default derived from SUMMARY_RATIO)
+
+    Returns:
+    str: The selected sentences, in their original order
+    """
+    sentences = split_sentences(text)
+    if not sentences:
+        return text.strip()[:1000]
+
+    if num_sentences is None:
+        num_sentences = int(round(len(sentences) * SUMMARY_RATIO))
+        num_sentences = max(SUMMARY_MIN_SENTENCES, min(SUMMARY_MAX_SENTENCES, num_sentences))
+    if len(sentences) <= num_sentences:
+        return " ".join(sentences)
+
+    embeddings = embed_local(sentences)
+    scores = centroid_scores(embeddings) if ranking == "centroid" else textrank_scores(embeddings)
+
+    keep = np.sort(np.argsort(-scores)[:num_sentences])
+    return " ".join(sentences[i] for i in keep)
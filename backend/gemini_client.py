@@ -0,0 +1,148 @@
+import asyncio
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+
+from google import genai
+
+GEMINI_MODEL = os.getenv("GEMINI_SUMMARY_MODEL", "gemini-2.0-flash")
+SUMMARY_PROMPT = "Summarize the following article:\n\n{text}"
+# Longest a summary (streamed or not) may take from start to finish before it
+# is cancelled and callers fall back to the extractive summary
+GEMINI_TIMEOUT_S = float(os.getenv("GEMINI_TIMEOUT_S", "60"))
+
+_client = None
+_client_lock = threading.Lock()
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide Gemini client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise ValueError("GEMINI_API_KEY not set")
+                _client = genai.Client(api_key=api_key)
+    return _client
+
+
+def _get_loop():
+    # One long-lived event loop in a background thread drives every async
+    # Gemini call, so sync code (the fact-check generator) can use the async
+    # client without spinning up a loop per request
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="gemini-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+async def stream_generate(prompt, model=GEMINI_MODEL):
+    """Async generator yielding text deltas from Gemini's streaming API."""
+    client = get_client()
+    async for chunk in await client.aio.models.generate_content_stream(model=model, contents=prompt):
+        if chunk.text:
+            yield chunk.text
+
+
+async def generate(prompt, model=GEMINI_MODEL):
+    """Return the full response text for ``prompt``."""
+    parts = []
+    async for delta in stream_generate(prompt, model=model):
+        parts.append(delta)
+    return "".join(parts)
+
+
+def run_sync(coro, timeout=GEMINI_TIMEOUT_S):
+    """Run a coroutine on the shared Gemini loop and block for its result.
+
+    After ``timeout`` seconds the coroutine is cancelled and TimeoutError raised.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _get_loop())
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"Gemini did not finish within {timeout:.0f}s")
+
+
+class SummaryStream:
+    """A summary being generated in the background.
+
+    Deltas are buffered as they arrive. ``drain`` hands over whatever has come
+    in so far without blocking; ``wait`` blocks until generation is finished
+    or ``timeout`` seconds after the stream started, when generation is
+    cancelled and ``error`` set to a TimeoutError.
+    """
+
+    _DONE = object()
+
+    def __init__(self, coro_factory, timeout=GEMINI_TIMEOUT_S):
+        self._queue = queue.Queue()
+        self._parts = []
+        self.error = None
+        self.done = False
+        self.timeout = timeout
+        self._deadline = time.monotonic() + timeout
+        self._future = asyncio.run_coroutine_threadsafe(self._run(coro_factory), _get_loop())
+
+    async def _run(self, coro_factory):
+        try:
+            async for delta in coro_factory():
+                self._queue.put(delta)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._queue.put(self._DONE)
+
+    def _take(self, item):
+        if item is self._DONE:
+            self.done = True
+            return None
+        self._parts.append(item)
+        return item
+
+    def drain(self):
+        """Return the deltas received since the last call, without blocking."""
+        deltas = []
+        while not self.done:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            delta = self._take(item)
+            if delta is not None:
+                deltas.append(delta)
+        return deltas
+
+    def wait(self):
+        """Yield the remaining deltas as they arrive until the summary is finished."""
+        while not self.done:
+            try:
+                item = self._queue.get(timeout=max(self._deadline - time.monotonic(), 0.0))
+            except queue.Empty:
+                self._future.cancel()
+                self.error = TimeoutError(f"Gemini summary did not finish within {self.timeout:.0f}s")
+                self.done = True
+                return
+            delta = self._take(item)
+            if delta is not None:
+                yield delta
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+
+def start_summary_stream(text, model=GEMINI_MODEL):
+    """Start summarizing ``text`` in the background and return a SummaryStream."""
+    return SummaryStream(lambda: stream_generate(SUMMARY_PROMPT.format(text=text), model=model))
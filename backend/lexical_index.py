@@ -0,0 +1,153 @@
+import math
+import re
+import threading
+from array import array
+
+import numpy as np
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Words, numbers and compounds like "h.r.1234", "s-123", "2024-01-05" or
+# "3.5"; compounds are indexed whole and as their parts, so both "h.r.1234"
+# and "1234" match
+_TOKEN = re.compile(r"\w+(?:[.\-/:]\w+)*")
+_PARTS = re.compile(r"[.\-/:]")
+
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        if _PARTS.search(token):
+            tokens.extend(part for part in _PARTS.split(token) if part)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-memory inverted index over document content, scored with BM25.
+
+    Each term's postings are two parallel arrays (rows as uint32, term
+    frequencies as uint16) appended in row order, so the index costs about
+    six bytes per (term, document) pair and grows in place as documents are
+    ingested. Readers copy the slices they need, so appends never wait on
+    queries.
+    """
+
+    def __init__(self, docs=()):
+        self.terms = {}             # term -> (rows, frequencies)
+        self.lengths = array("I")   # tokens per row
+        self.total_length = 0
+        self._lock = threading.Lock()
+        # numpy copy of lengths, refreshed only after new rows arrive
+        self._lengths_view = np.zeros(0, dtype=np.float32)
+        for row, doc in enumerate(docs):
+            self.add(row, doc["content"])
+
+    def add(self, row, text):
+        with self._lock:
+            if row != len(self.lengths):
+                raise ValueError(f"Rows must be added in order: expected {len(self.lengths)}, got {row}")
+            counts = {}
+            tokens = tokenize(text or "")
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, count in counts.items():
+                postings = self.terms.get(term)
+                if postings is None:
+                    postings = self.terms[term] = (array("I"), array("H"))
+                postings[1].append(min(count, 65535))
+                postings[0].append(row)
+            self.lengths.append(len(tokens))
+            self.total_length += len(tokens)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def search(self, query, k, ntotal=None, rows=None):
+        """
+        Top-k rows for ``query`` by BM25.
+
+        Parameters:
+        query (str): Query text
+        k (int): Results to return
+        ntotal (int, optional): Only consider rows below this (the searched index state)
+        rows (numpy.ndarray, optional): Sorted rows allowed by a metadata filter
+
+        Returns:
+        tuple: (scores, rows) as float32/int64 arrays, best first
+        """
+        n = min(len(self.lengths), ntotal if ntotal is not None else len(self.lengths))
+        terms = set(tokenize(query))
+        if not n or not terms:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        lengths = self._lengths_view
+        if len(lengths) < n:
+            lengths = self._lengths_view = np.frombuffer(self.lengths[:], dtype=np.uint32).astype(np.float32)
+        avg_length = max(self.total_length / max(len(self.lengths), 1), 1e-6)
+        candidate_rows, contributions = [], []
+        for term in terms:
+            postings = self.terms.get(term)
+            if postings is None:
+                continue
+            size = min(len(postings[0]), len(postings[1]))
+            term_rows = np.frombuffer(postings[0][:size], dtype=np.uint32).astype(np.int64)
+            frequencies = np.frombuffer(postings[1][:size], dtype=np.uint16).astype(np.float32)
+            keep = term_rows < n
+            term_rows, frequencies = term_rows[keep], frequencies[keep]
+            if not len(term_rows):
+                continue
+            idf = math.log(1.0 + (n - len(term_rows) + 0.5) / (len(term_rows) + 0.5))
+            norm = K1 * (1.0 - B + B * lengths[term_rows] / avg_length)
+            candidate_rows.append(term_rows)
+            contributions.append(idf * frequencies * (K1 + 1.0) / (frequencies + norm))
+        if not candidate_rows:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        # Sum per row over the matched terms only, not over the whole corpus
+        matched, inverse = np.unique(np.concatenate(candidate_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions)).astype(np.float32)
+        if rows is not None:
+            allowed = np.isin(matched, rows, assume_unique=True)
+            matched, scores = matched[allowed], scores[allowed]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            matched, scores = matched[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return scores[order], matched[order]
+
+    def stats(self):
+        return {
+            "documents": len(self.lengths),
+            "terms": len(self.terms),
+            "postings": sum(len(rows) for rows, _ in list(self.terms.values())),
+            "avg_length": self.total_length / max(len(self.lengths), 1),
+        }
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=60):
+    """
+    Fuse ranked row lists: each row scores sum(1 / (rrf_k + rank)) over the lists it appears in.
+
+    Parameters:
+    rankings (list): Sequences of rows, best first (-1 entries are ignored)
+    k (int): Results to return
+    rrf_k (int): Damping constant; 60 is the usual choice
+
+    Returns:
+    tuple: (scores, rows), best first
+    """
+    fused = {}
+    for ranking in rankings:
+        rank = 0
+        for row in ranking:
+            if row < 0:
+                continue
+            rank += 1
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (rrf_k + rank)
+    best = sorted(fused.items(), key=lambda item: -item[1])[:k]
+    return (np.array([score for _, score in best], dtype=np.float32),
+            np.array([row for row, _ in best], dtype=np.int64))
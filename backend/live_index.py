@@ -0,0 +1,732 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from typing import NamedTuple
+
+import faiss
+import numpy as np
+
+import doc_store
+import vector_index
+from lexical_index import BM25Index
+from metadata_index import MetadataIndex
+
+# Background maintenance: the watcher polls <embeddings_dir>/embeddings/*.json
+# every RAG_WATCH_INTERVAL_S, and the delta is folded into the on-disk index
+# once it holds RAG_SNAPSHOT_MIN_ROWS rows or RAG_SNAPSHOT_INTERVAL_S has passed.
+WATCH_INTERVAL_S = float(os.getenv("RAG_WATCH_INTERVAL_S", "10"))
+SNAPSHOT_INTERVAL_S = float(os.getenv("RAG_SNAPSHOT_INTERVAL_S", "300"))
+SNAPSHOT_MIN_ROWS = int(os.getenv("RAG_SNAPSHOT_MIN_ROWS", "1000"))
+# Keep a BM25 index over document content next to the vector index
+LEXICAL_INDEX = os.getenv("RAG_LEXICAL_INDEX", "1") != "0"
+# Compressed (PQ) indexes fetch RAG_RERANK_FACTOR x top_k candidates and
+# re-rank them exactly against embeddings.npy, memory-mapped; 1 disables
+RERANK_FACTOR = int(os.getenv("RAG_RERANK_FACTOR", "4"))
+# How long a reader that finds the files mid-snapshot waits for the writer to finish
+LOAD_WAIT_S = float(os.getenv("RAG_LOAD_WAIT_S", "300"))
+
+
+class IndexState(NamedTuple):
+    """
+    One immutable view of the index. Writers build a new state and swap the
+    reference; readers grab the reference once and never take a lock.
+    """
+    base: object               # faiss index over rows [0, base_count), usually mmapped
+    base_count: int
+    delta: object              # flat faiss index over rows [base_count, ntotal)
+    delta_vectors: np.ndarray  # the delta's vectors, kept for snapshotting
+    ntotal: int
+    version: int
+    vectors: object = None     # full-precision base vectors (memmap) when re-ranking
+
+
+class LiveIndex:
+    """
+    Vector index plus documents that accept new rows while serving queries.
+
+    New rows go to a write-ahead log first, then into a small flat delta index
+    searched alongside the base index. Snapshots fold the delta into the base
+    index and append to embeddings.npy and the document store, after which
+    the WAL is dropped. If a snapshot is interrupted, the rows it wrote past
+    the index are cut off again on the next load or snapshot and come back
+    from the WAL.
+
+    Several processes (e.g. uvicorn workers) can serve one directory, but only
+    the one holding the exclusive lock on writer.lock writes: it owns the WAL,
+    the watcher and snapshots. The others are readers. Their add() durably
+    spools documents to ingest.spool/ for the writer to apply, and they pick up
+    the writer's snapshots as index.faiss changes. If the writer exits, the
+    next reader to get the lock takes over and replays its WAL.
+    """
+
+    def __init__(self, directory, index_path, mmap=True, encode=None, embedding_model_id=None):
+        """
+        Parameters:
+        directory (str): Embeddings directory holding embeddings.npy, documents.json and the WAL
+        index_path (str): Prebuilt index file (see build_index.py)
+        mmap (bool): Memory-map the base index
+        encode (callable, optional): texts -> float32 matrix, for documents arriving without a usable vector
+        embedding_model_id (str, optional): Model the index vectors come from; other models' vectors are re-encoded
+        """
+        self.directory = directory
+        self.index_path = index_path
+        self.mmap = mmap
+        self.encode = encode
+        self.embedding_model_id = embedding_model_id
+        self.embeddings_path = os.path.join(directory, "embeddings.npy")
+        self.documents_path = os.path.join(directory, "documents.json")
+        self.wal_path = os.path.join(directory, "ingest.wal")
+        self.watch_dir = os.path.join(directory, "embeddings")
+        self.lock_path = os.path.join(directory, "writer.lock")
+        self.spool_dir = os.path.join(directory, "ingest.spool")
+
+        # Rows [0, len(store)) are read from the on-disk document store (see
+        # doc_store.py); later rows live in the append-only documents list.
+        # A reader only looks at rows below its state's ntotal. The pair is
+        # swapped as one after a snapshot moves rows from the list to the store.
+        self._documents = (None, [])
+        self.rows = {}
+        self.metadata = MetadataIndex()
+        self.lexical = BM25Index() if LEXICAL_INDEX else None
+        self.state = None
+        self.info = {}
+        self.normalized = True
+        self.writer = False
+        self.rerank_error = None
+        self._lock_fd = None
+        self._index_signature = None
+        self._retired_store = None
+
+        self._write_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._seen_files = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.ingested = 0
+        self.spooled = 0
+        self.snapshots = 0
+        self.last_snapshot_at = time.time()
+        self.last_snapshot_error = None
+
+    # Loading
+
+    def load(self):
+        deadline = time.time() + LOAD_WAIT_S
+        while True:
+            self.acquire_writer()
+            store, stored, base, info = self._open_files()
+            rows = len(store) if store is not None else len(stored)
+            counts = self._row_counts(base.ntotal, rows)
+            if len(set(counts.values())) == 1:
+                break
+            if store is not None:
+                store.close()
+            # Snapshots write embeddings.npy, then the documents, then the
+            # index, and drop the WAL only after that. Rows past the index
+            # are therefore still in the WAL and can be cut off and replayed.
+            recoverable = base.ntotal <= min(counts.values())
+            if self.writer and recoverable:
+                print(f"Row counts in '{self.directory}' disagree ({counts}) after an interrupted snapshot; "
+                      f"truncating to the index's {base.ntotal} rows and replaying the write-ahead log")
+                self._truncate(base.ntotal, stored)
+                continue
+            if self.writer or not recoverable or time.time() >= deadline:
+                # Row i of the index must be row i of the documents, or hits resolve to the wrong documents
+                raise Exception(f"Row counts in '{self.directory}' disagree ({counts}). If documents and "
+                                f"embeddings.npy agree, rebuild the index with build_index.py; otherwise "
+                                f"restore the directory from a consistent copy")
+            # A reader may be looking at the writer mid-snapshot; wait for it
+            # to finish, or take over and repair if it died
+            time.sleep(1)
+
+        self.info = info
+        if store is not None:
+            self._documents = (store, [])
+        for row, doc in enumerate(stored):
+            # Legacy single-file documents.json
+            self._append_document({
+                "id": doc.get("id", str(row)),
+                "content": doc["content"],
+                "metadata": doc.get("metadata", {}),
+            })
+        # One pass over the documents feeds both the metadata and the BM25 index
+        def documents():
+            for row in range(self._stored_rows() + len(self.documents)):
+                doc = self.document(row)
+                if self.lexical is not None:
+                    self.lexical.add(row, doc["content"])
+                yield doc
+
+        start_time = time.time()
+        self.metadata = MetadataIndex(documents())
+        print(f"Indexed metadata{' and text' if self.lexical is not None else ''} of {self.metadata.rows} "
+              f"documents in {time.time() - start_time:.2f} seconds")
+
+        # Inner-product indexes hold normalized vectors; legacy L2 ones hold
+        # whatever was ingested and their scores are only approximate
+        self.normalized = base.metric_type == faiss.METRIC_INNER_PRODUCT
+        if not self.normalized:
+            print(f"{self.index_path} is an L2 index; run migrate_cosine.py for exact cosine scores")
+
+        self.state = self._new_state(base, base.ntotal, np.zeros((0, base.d), dtype=np.float32), version=0,
+                                     vectors=self._open_vectors(base.ntotal))
+        self._index_signature = self._signature()
+        if not self.writer:
+            print(f"Another process is writing '{self.directory}'; serving it read-only")
+            return
+        replayed = self._replay_wal()
+        if replayed:
+            print(f"Replayed {replayed} documents from the write-ahead log")
+
+    def _open_files(self):
+        """
+        Open the document store (or read legacy documents.json) and the base index.
+
+        Returns:
+        tuple: (DocumentStore or None, legacy documents in row order, faiss index, index meta)
+        """
+        store, stored = None, []
+        if doc_store.exists(self.directory):
+            store = doc_store.DocumentStore(self.directory)
+        elif os.path.exists(self.documents_path):
+            # Legacy single-file documents.json, keyed by row
+            with open(self.documents_path, 'r') as f:
+                stored = json.load(f)
+            stored = [stored[key] for key in sorted(stored, key=int)]
+        else:
+            raise Exception(f"Required files not found in '{self.directory}'")
+
+        if os.path.exists(self.index_path):
+            # Built offline; mapping it is near-instant and shares page cache across workers
+            return store, stored, vector_index.load_index(self.index_path, mmap=self.mmap), \
+                vector_index.read_index_meta(self.index_path)
+        if not os.path.exists(self.embeddings_path):
+            raise Exception(f"Required files not found in '{self.directory}'")
+        print(f"No prebuilt index at {self.index_path}; building a flat index (run build_index.py to avoid this)")
+        base = vector_index.build_index(np.load(self.embeddings_path), "flat")
+        return store, stored, base, {"index_type": "flat", "metric": "ip"}
+
+    def _truncate(self, rows, stored):
+        """Cut embeddings.npy and the documents back to the index's ``rows``; writer only."""
+        if os.path.exists(self.embeddings_path):
+            doc_store.truncate_rows(self.embeddings_path, rows)
+        if doc_store.exists(self.directory):
+            doc_store.truncate_documents(self.directory, rows)
+        elif len(stored) > rows:
+            tmp_path = self.documents_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({str(row): stored[row] for row in range(rows)}, f, default=str)
+            os.replace(tmp_path, self.documents_path)
+
+    def acquire_writer(self):
+        """Take the directory's writer lock if no other process holds it; returns whether this process writes."""
+        if self.writer:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # Held for the life of the process; the kernel drops it if we die
+        self._lock_fd = fd
+        self.writer = True
+        return True
+
+    def release_writer(self):
+        """Give up the writer lock, e.g. to hand the directory to a replacement process."""
+        with self._write_lock:
+            if self._lock_fd is not None:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                os.close(self._lock_fd)
+                self._lock_fd = None
+            self.writer = False
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _row_counts(self, index_rows, document_rows):
+        counts = {"index": index_rows, "documents": document_rows}
+        if os.path.exists(self.embeddings_path):
+            counts["embeddings.npy"] = np.load(self.embeddings_path, mmap_mode="r").shape[0]
+        return counts
+
+    @property
+    def store(self):
+        return self._documents[0]
+
+    @property
+    def documents(self):
+        return self._documents[1]
+
+    def _stored_rows(self):
+        return len(self.store) if self.store is not None else 0
+
+    def _swap_store(self, store):
+        """Serve the rows ``store`` holds from disk and drop them from memory; call with the write lock held."""
+        old_store, documents = self._documents
+        moved = len(store) - (len(old_store) if old_store is not None else 0)
+        self._documents = (store, documents[moved:])
+        for doc in documents[:moved]:
+            self.rows.pop(doc["id"], None)
+        # Queries may still be reading through the old store; close it on the next swap
+        if self._retired_store is not None:
+            self._retired_store.close()
+        self._retired_store = old_store
+
+    def _append_document(self, doc):
+        self.rows[doc["id"]] = self._stored_rows() + len(self.documents)
+        self.documents.append(doc)
+
+    def _row_of(self, doc_id):
+        row = self.rows.get(doc_id)
+        if row is None and self.store is not None:
+            row = self.store.row_of(doc_id)
+        return row
+
+    def document(self, row):
+        store, documents = self._documents
+        stored = len(store) if store is not None else 0
+        return store[row] if row < stored else documents[row - stored]
+
+    def _new_state(self, base, base_count, delta_vectors, version, vectors=None):
+        delta = faiss.IndexFlat(base.d, base.metric_type)
+        if len(delta_vectors):
+            delta.add(delta_vectors)
+        return IndexState(base, base_count, delta, delta_vectors, base_count + len(delta_vectors), version, vectors)
+
+    def _open_vectors(self, base_count):
+        """
+        Memory-map embeddings.npy for re-ranking a compressed base index, or None.
+
+        When a compressed index can't be re-ranked the reason is kept in
+        ``rerank_error`` and reported by stats().
+        """
+        self.rerank_error = None
+        if (self.info.get("index_type") not in vector_index.COMPRESSED_TYPES or RERANK_FACTOR <= 1
+                or not self.normalized):
+            return None
+        if not os.path.exists(self.embeddings_path):
+            self.rerank_error = f"{self.embeddings_path} not found"
+        else:
+            vectors = np.load(self.embeddings_path, mmap_mode="r")
+            if vectors.shape[0] >= base_count:
+                return vectors
+            self.rerank_error = f"{self.embeddings_path} has {vectors.shape[0]} rows but the index has {base_count}"
+        print(f"{self.rerank_error}; serving compressed scores without re-ranking")
+        return None
+
+    def _wal_files(self):
+        # Rotated logs (from snapshots that didn't finish) first, then the live one
+        rotated = sorted(glob.glob(self.wal_path + ".*"), key=lambda p: int(p.rsplit(".", 1)[1]))
+        return rotated + ([self.wal_path] if os.path.exists(self.wal_path) else [])
+
+    def _replay_wal(self):
+        docs, vectors = [], []
+        for path in self._wal_files():
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn final write from a crash; everything before it is intact
+                        break
+                    docs.append({k: record[k] for k in ("id", "content", "metadata")})
+                    vectors.append(record["embedding"])
+        if not docs:
+            return 0
+        return len(self._apply(docs, np.asarray(vectors, dtype=np.float32), log=False))
+
+    # Reads
+
+    def search(self, queries, k, ef_search=None, nprobe=None, rows=None, state=None, min_score=None):
+        """
+        Search base and delta; returns (scores, rows, state).
+
+        Scores are cosine similarities. ``rows`` (sorted int64, e.g. from
+        MetadataIndex.select) restricts the search to those rows via faiss ID
+        selectors, and hits scoring below ``min_score`` come back as -1 like
+        faiss padding. The state is returned so callers resolve rows against
+        the same view the search ran on; pass ``state`` to pin the view (e.g.
+        to match a concurrent lexical search).
+        """
+        state = state or self.state
+        if self.normalized:
+            queries = vector_index.normalize(queries)
+        metric = state.base.metric_type
+        n_queries = len(queries)
+        base_selector = delta_selector = None
+        if rows is not None:
+            rows = rows[rows < state.ntotal]
+            split = np.searchsorted(rows, state.base_count)
+            base_rows, delta_rows = rows[:split], rows[split:] - state.base_count
+            if not len(rows):
+                distances, ids = vector_index.empty_results(n_queries, k, metric)
+                return vector_index.to_similarity(distances, metric), ids, state
+            # The buffers must outlive the searches below
+            base_selector, base_buffer = vector_index.id_selector(base_rows, state.base_count)
+            delta_selector, delta_buffer = vector_index.id_selector(delta_rows, max(state.delta.ntotal, 1))
+
+        if rows is not None and not len(base_rows):
+            distances, ids = vector_index.empty_results(n_queries, k, metric)
+        elif state.vectors is not None:
+            # Over-fetch from the compressed index, then score exactly from the memmap
+            _, candidates = vector_index.search(state.base, queries, k * RERANK_FACTOR, ef_search=ef_search,
+                                                nprobe=nprobe, selector=base_selector)
+            distances, ids = vector_index.rerank(queries, candidates, state.vectors, k)
+        else:
+            distances, ids = vector_index.search(state.base, queries, k, ef_search=ef_search, nprobe=nprobe,
+                                                 selector=base_selector)
+        if state.ntotal > state.base_count and (rows is None or len(delta_rows)):
+            delta_distances, delta_ids = vector_index.search(state.delta, queries, min(k, state.delta.ntotal),
+                                                             selector=delta_selector)
+            delta_ids = np.where(delta_ids >= 0, delta_ids + state.base_count, -1)
+            distances, ids = vector_index.merge_results([distances, delta_distances], [ids, delta_ids], k, metric)
+        scores = vector_index.to_similarity(distances, metric)
+        if min_score is not None:
+            ids = np.where(scores >= min_score, ids, -1)
+        return scores, ids, state
+
+    def lexical_search(self, texts, k, rows=None, state=None):
+        """
+        BM25 search for each text over the rows visible in ``state``.
+
+        Returns:
+        list: (scores, rows) per text, best first
+        """
+        if self.lexical is None:
+            raise ValueError("Lexical search is disabled (RAG_LEXICAL_INDEX=0)")
+        ntotal = (state or self.state).ntotal
+        return [self.lexical.search(text, k, ntotal=ntotal, rows=rows) for text in texts]
+
+    def get(self, doc_id):
+        row = self._row_of(doc_id)
+        if row is None or row >= self.state.ntotal:
+            return None
+        return self.document(row)
+
+    # Writes
+
+    def add(self, docs, vectors):
+        """
+        Durably append documents and their vectors; ids already present are skipped.
+
+        In a reader process the documents are spooled for the writer instead,
+        and become searchable here once the writer's next snapshot is picked up.
+
+        Parameters:
+        docs (list): Dicts with id, content and metadata
+        vectors (numpy.ndarray): One row per document
+
+        Returns:
+        list: Ids that were added
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not self.writer:
+            return self._spool(docs, vectors)
+        return self._apply(docs, vectors, log=True)
+
+    def _new_rows(self, docs, vectors, state):
+        """Validate and normalize vectors, and drop ids that are repeated or already indexed."""
+        if vectors.ndim != 2 or vectors.shape[1] != state.base.d:
+            raise ValueError(f"Expected vectors of dimension {state.base.d}, got shape {vectors.shape}")
+        if self.normalized:
+            vectors = vector_index.normalize(vectors)
+        keep, seen = [], set()
+        for i, doc in enumerate(docs):
+            if doc["id"] in seen or self._row_of(doc["id"]) is not None:
+                continue
+            seen.add(doc["id"])
+            keep.append(i)
+        return [docs[i] for i in keep], vectors[keep]
+
+    def _spool(self, docs, vectors):
+        docs, vectors = self._new_rows(docs, vectors, self.state)
+        if not docs:
+            return []
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, f"{time.time_ns()}-{os.getpid()}.jsonl")
+        # Written aside and renamed, so the writer never sees a partial file
+        with open(path + ".tmp", 'w') as f:
+            for doc, vector in zip(docs, vectors):
+                f.write(json.dumps(dict(doc, embedding=vector.tolist()), default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.spooled += len(docs)
+        return [doc["id"] for doc in docs]
+
+    def _drain_spool(self):
+        """Writer side: apply documents spooled by reader processes."""
+        added = 0
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, "*.jsonl"))):
+            try:
+                with open(path, 'r') as f:
+                    records = [json.loads(line) for line in f if line.strip()]
+                docs = [{k: record[k] for k in ("id", "content", "metadata")} for record in records]
+                added += len(self.add(docs, np.asarray([record["embedding"] for record in records],
+                                                       dtype=np.float32)))
+                os.remove(path)
+            except Exception as e:
+                print(f"Error applying spooled documents from {path}: {str(e)}")
+                os.replace(path, path + ".rejected")
+        return added
+
+    def _apply(self, docs, vectors, log):
+        with self._write_lock:
+            state = self.state
+            docs, vectors = self._new_rows(docs, vectors, state)
+            if not docs:
+                return []
+
+            if log:
+                with open(self.wal_path, 'a') as f:
+                    for doc, vector in zip(docs, vectors):
+                        f.write(json.dumps(dict(doc, embedding=vector.tolist()), default=str) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            for doc in docs:
+                self._append_document(doc)
+                self.metadata.add(self.rows[doc["id"]], doc)
+                if self.lexical is not None:
+                    self.lexical.add(self.rows[doc["id"]], doc["content"])
+            delta_vectors = np.vstack([state.delta_vectors, vectors])
+            self.state = self._new_state(state.base, state.base_count, delta_vectors, state.version + 1,
+                                         vectors=state.vectors)
+            self.ingested += len(docs)
+            return [doc["id"] for doc in docs]
+
+    def ingest_file(self, path):
+        """Ingest one embeddings/{analysis_id}.json file uploaded by combined_3.main."""
+        with open(path, 'r') as f:
+            data = json.load(f)
+        doc = doc_store.document_from_shard(data)
+        if doc is None:
+            return []
+        vector = np.asarray(data.get("embeddings") or [], dtype=np.float32)
+        same_space = (vector.shape == (self.state.base.d,)
+                      and (data.get("model_id") is None or data.get("model_id") == self.embedding_model_id))
+        if not same_space:
+            # Vectors from another model can't share the index; embed the summary ourselves
+            if self.encode is None:
+                print(f"Skipping {path}: {data.get('model_id')} vectors don't match the index")
+                return []
+            vector = self.encode([doc["content"]])[0]
+        return self.add([doc], vector.reshape(1, -1))
+
+    def scan(self):
+        """Ingest new or changed files in the watched directory."""
+        added = 0
+        for path in glob.glob(os.path.join(self.watch_dir, "*.json")):
+            try:
+                mtime = os.path.getmtime(path)
+                if self._seen_files.get(path) == mtime:
+                    continue
+                added += len(self.ingest_file(path))
+                self._seen_files[path] = mtime
+            except Exception as e:
+                print(f"Error ingesting {path}: {str(e)}")
+        return added
+
+    # Snapshots
+
+    def snapshot(self):
+        """
+        Fold the delta into the on-disk index, embeddings and documents.
+
+        Runs off the query path: readers keep using the current state until
+        the new one is swapped in, and ingestion continues into a fresh WAL.
+        """
+        if not self.writer:
+            raise RuntimeError(f"Only the process holding {self.lock_path} writes snapshots")
+        with self._snapshot_lock:
+            with self._write_lock:
+                state = self.state
+                if state.ntotal == state.base_count:
+                    return False
+                # Rows ingested from here on go to a new log
+                rotated = [path for path in self._wal_files() if path != self.wal_path]
+                if os.path.exists(self.wal_path):
+                    rotated_path = f"{self.wal_path}.{time.time_ns()}"
+                    os.replace(self.wal_path, rotated_path)
+                    rotated.append(rotated_path)
+
+            start_time = time.time()
+            merged = faiss.clone_index(state.base)
+            merged.add(state.delta_vectors)
+            # Drop rows a failed earlier attempt wrote past the index
+            self._truncate(state.base_count, [])
+            self._write_embeddings(state)
+            self._write_documents(state)
+            tmp_path = self.index_path + ".tmp"
+            vector_index.write_index(merged, tmp_path, self.info.get("index_type", "flat"),
+                                     **self.info.get("options", {}))
+            os.replace(tmp_path + ".meta.json", self.index_path + ".meta.json")
+            os.replace(tmp_path, self.index_path)
+            base = vector_index.load_index(self.index_path, mmap=self.mmap)
+            vectors = self._open_vectors(state.ntotal)
+            store = doc_store.DocumentStore(self.directory) if self.store is not None else None
+
+            with self._write_lock:
+                current = self.state
+                newer = current.delta_vectors[state.ntotal - current.base_count:]
+                self.state = self._new_state(base, state.ntotal, newer, current.version + 1, vectors=vectors)
+                if store is not None:
+                    self._swap_store(store)
+            for path in rotated:
+                if os.path.exists(path):
+                    os.remove(path)
+
+            self.info = vector_index.read_index_meta(self.index_path)
+            self.snapshots += 1
+            self.last_snapshot_at = time.time()
+            print(f"Snapshot of {state.ntotal} rows written in {time.time() - start_time:.2f} seconds")
+            return True
+
+    def refresh(self):
+        """
+        Reader side: switch to the snapshot the writer last published, if it changed.
+
+        Rows are append-only, so the rows new to this process are added to the
+        metadata and BM25 indexes and the new store and base index swapped in.
+        Returns whether a new snapshot was loaded.
+        """
+        signature = self._signature()
+        if signature is None or signature == self._index_signature:
+            return False
+        store = doc_store.DocumentStore(self.directory) if self.store is not None else None
+        if store is not None:
+            documents = None
+        else:
+            with open(self.documents_path, 'r') as f:
+                stored = json.load(f)
+            documents = [stored[key] for key in sorted(stored, key=int)]
+        base = vector_index.load_index(self.index_path, mmap=self.mmap)
+        rows = len(store) if store is not None else len(documents)
+        embedding_rows = (np.load(self.embeddings_path, mmap_mode="r").shape[0]
+                          if os.path.exists(self.embeddings_path) else rows)
+        if not rows == embedding_rows == base.ntotal:
+            # Caught the writer part-way through a snapshot; try again next time
+            if store is not None:
+                store.close()
+            return False
+
+        with self._write_lock:
+            for row in range(self._stored_rows() + len(self.documents), rows):
+                doc = store[row] if store is not None else documents[row]
+                if store is None:
+                    doc = {"id": doc.get("id", str(row)), "content": doc["content"],
+                           "metadata": doc.get("metadata", {})}
+                    self._append_document(doc)
+                self.metadata.add(row, doc)
+                if self.lexical is not None:
+                    self.lexical.add(row, doc["content"])
+            if store is not None:
+                self._swap_store(store)
+            self.info = vector_index.read_index_meta(self.index_path)
+            state = self.state
+            self.state = self._new_state(base, base.ntotal, np.zeros((0, base.d), dtype=np.float32),
+                                         state.version + 1, vectors=self._open_vectors(base.ntotal))
+            self._index_signature = signature
+        print(f"Loaded the writer's snapshot of {base.ntotal} rows")
+        return True
+
+    def _write_embeddings(self, state):
+        if not os.path.exists(self.embeddings_path):
+            # Index-only directory; nothing to keep in step
+            return
+        # A row-count mismatch raises and fails the snapshot: the WAL is kept
+        # and the index isn't extended past the vectors re-ranking reads
+        doc_store.append_rows(self.embeddings_path, state.delta_vectors, expected_rows=state.base_count)
+
+    def _write_documents(self, state):
+        if self.store is not None:
+            new_docs = [self.document(row) for row in range(state.base_count, state.ntotal)]
+            doc_store.append_documents(self.directory, new_docs, expected_rows=state.base_count)
+            return
+        tmp_path = self.documents_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({str(row): self.document(row) for row in range(state.ntotal)}, f, default=str)
+        os.replace(tmp_path, self.documents_path)
+
+    # Background maintenance
+
+    def start_background(self, watch_interval=WATCH_INTERVAL_S, watch=True):
+        """
+        Start the maintenance thread: in the writer it applies spooled documents,
+        snapshots the delta and (with ``watch``) ingests new analyses; in a reader
+        it follows the writer's snapshots and takes over if the writer exits.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._maintain, args=(watch_interval, watch),
+                                        daemon=True, name="rag-index-maintenance")
+        self._thread.start()
+
+    def stop(self, wait=False):
+        """Stop background maintenance; with ``wait``, also let a running scan or snapshot finish."""
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def _maintain(self, watch_interval, watch):
+        while not self._stop.wait(watch_interval):
+            if not self.writer:
+                try:
+                    self.refresh()
+                    if self.acquire_writer():
+                        self.refresh()
+                        replayed = self._replay_wal()
+                        print(f"Took over writing '{self.directory}' "
+                              f"({replayed} documents replayed from the write-ahead log)")
+                except Exception as e:
+                    print(f"Error following index snapshots: {str(e)}")
+                continue
+
+            if watch and os.path.isdir(self.watch_dir):
+                added = self.scan()
+                if added:
+                    print(f"Ingested {added} new analyses from {self.watch_dir}")
+            added = self._drain_spool()
+            if added:
+                print(f"Applied {added} documents spooled by other processes")
+            state = self.state
+            pending = state.ntotal - state.base_count
+            due = time.time() - self.last_snapshot_at >= SNAPSHOT_INTERVAL_S
+            if pending >= SNAPSHOT_MIN_ROWS or (pending and due):
+                try:
+                    self.snapshot()
+                    self.last_snapshot_error = None
+                except Exception as e:
+                    self.last_snapshot_error = str(e)
+                    print(f"Error writing index snapshot: {str(e)}")
+
+    def stats(self):
+        state = self.state
+        return {
+            "index": dict(self.info, path=self.index_path, mmap=self.mmap),
+            "dimension": state.base.d,
+            "ntotal": state.ntotal,
+            "base_rows": state.base_count,
+            "delta_rows": state.ntotal - state.base_count,
+            "version": state.version,
+            "rerank_factor": RERANK_FACTOR if state.vectors is not None else None,
+            "rerank_error": self.rerank_error,
+            "metadata": self.metadata.stats(),
+            "lexical": self.lexical.stats() if self.lexical is not None else None,
+            "writer": self.writer,
+            "ingested": self.ingested,
+            "spooled": self.spooled,
+            "snapshots": self.snapshots,
+            "last_snapshot_at": self.last_snapshot_at,
+            "last_snapshot_error": self.last_snapshot_error,
+        }
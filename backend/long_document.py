@@ -0,0 +1,174 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from classifier_service import fake_news_classifier
+from model_registry import registry as model_registry
+
+# Window length is the model's own limit (512 for BERT) minus [CLS]/[SEP];
+# consecutive windows share WINDOW_OVERLAP tokens so no sentence is only ever
+# seen cut in half.
+WINDOW_OVERLAP = int(os.getenv("LONG_DOC_WINDOW_OVERLAP", "64"))
+POOLING = os.getenv("LONG_DOC_POOLING", "mean")  # mean | max | attention
+WINDOW_CACHE_SIZE = int(os.getenv("LONG_DOC_WINDOW_CACHE_SIZE", "4096"))
+POOLING_MODES = ("mean", "max", "attention")
+
+_window_cache = OrderedDict()
+_window_cache_lock = threading.Lock()
+_tokenizers = {}
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer(name):
+    # Only the tokenizer is needed to cut windows; the weights stay with
+    # whichever process runs the classifier (possibly a model worker)
+    tokenizer = _tokenizers.get(name)
+    if tokenizer is None:
+        with _tokenizer_lock:
+            tokenizer = _tokenizers.get(name)
+            if tokenizer is None:
+                from transformers import AutoTokenizer
+                tokenizer = _tokenizers[name] = AutoTokenizer.from_pretrained(model_registry.specs[name]["model"])
+    return tokenizer
+
+
+def _window_key(token_ids):
+    return hashlib.sha1(np.asarray(token_ids, dtype=np.int32).tobytes()).hexdigest()
+
+
+def _cache_get(key):
+    with _window_cache_lock:
+        result = _window_cache.get(key)
+        if result is not None:
+            _window_cache.move_to_end(key)
+        return result
+
+
+def _cache_put(key, result):
+    with _window_cache_lock:
+        _window_cache[key] = result
+        _window_cache.move_to_end(key)
+        while len(_window_cache) > WINDOW_CACHE_SIZE:
+            _window_cache.popitem(last=False)
+
+
+def build_windows(text, tokenizer, overlap=WINDOW_OVERLAP):
+    """
+    Split text into token windows that fit the model.
+
+    Paragraphs are packed whole into windows where possible, so editing one
+    paragraph only changes the windows that contain it and the rest stay cached.
+    A paragraph longer than a window is split into strided windows on its own.
+
+    Returns:
+    list: Token id lists (without special tokens), each at most the model limit
+    """
+    window_size = tokenizer.model_max_length - tokenizer.num_special_tokens_to_add()
+    overlap = min(overlap, window_size // 2)
+    stride = window_size - overlap
+
+    paragraphs = [p.strip() for p in text.split("\n") if p.strip()]
+    encoded = tokenizer(paragraphs, add_special_tokens=False)["input_ids"] if paragraphs else []
+
+    windows = []
+    current = []
+    for ids in encoded:
+        if len(ids) > window_size:
+            if current:
+                windows.append(current)
+                current = []
+            for start in range(0, len(ids), stride):
+                windows.append(ids[start:start + window_size])
+                if start + window_size >= len(ids):
+                    break
+            continue
+
+        if current and len(current) + len(ids) > window_size:
+            windows.append(current)
+            # Carry the tail of the previous window over as context
+            current = current[-overlap:] if overlap else []
+            if len(current) + len(ids) > window_size:
+                current = []
+        current = current + ids
+
+    if current:
+        windows.append(current)
+    return windows
+
+
+def _claim_attention(windows, claims, tokenizer, temperature=5.0):
+    # Weight each window by how much of the best-matching claim's vocabulary it
+    # contains, then softmax so the weights sum to one
+    claim_sets = [set(ids) for ids in tokenizer(claims, add_special_tokens=False)["input_ids"] if ids]
+    if not claim_sets:
+        return None
+
+    overlaps = np.zeros(len(windows), dtype=np.float32)
+    for i, window in enumerate(windows):
+        window_set = set(window)
+        overlaps[i] = max(len(window_set & claim) / len(claim) for claim in claim_sets)
+
+    logits = temperature * overlaps
+    weights = np.exp(logits - logits.max())
+    return weights / weights.sum()
+
+
+def classify_long_document(text, pooling=POOLING, claims=None, classifier=fake_news_classifier):
+    """
+    Classify an article of any length with the fake-news model.
+
+    Parameters:
+    text (str): The full article text
+    pooling (str): How window scores are combined: 'mean', 'max', or 'attention'
+        ('attention' weights windows by overlap with ``claims`` and falls back to
+        'mean' when there are none)
+    claims (list, optional): Extracted claims used by attention pooling
+
+    Returns:
+    dict: {"label", "score", "scores", "windows", "cached_windows", "pooling"}
+    """
+    if pooling not in POOLING_MODES:
+        raise ValueError(f"Unknown pooling mode: {pooling}")
+
+    tokenizer = get_tokenizer(classifier.model_name)
+    windows = build_windows(text, tokenizer)
+    if not windows:
+        raise ValueError("No text to classify")
+
+    # Only windows we haven't scored before go to the model, as one batch
+    keys = [_window_key(window) for window in windows]
+    results = [_cache_get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        fresh = classifier.classify([tokenizer.decode(windows[i]) for i in missing])
+        for i, result in zip(missing, fresh):
+            results[i] = result
+            _cache_put(keys[i], result)
+
+    labels = sorted(results[0]["scores"])
+    matrix = np.array([[result["scores"].get(label, 0.0) for label in labels] for result in results],
+                      dtype=np.float32)
+
+    weights = None
+    if pooling == "attention" and claims:
+        weights = _claim_attention(windows, claims, tokenizer)
+    if pooling == "max":
+        pooled = matrix.max(axis=0)
+    elif weights is not None:
+        pooled = weights @ matrix
+    else:
+        pooled = matrix.mean(axis=0)
+        pooling = "mean"
+
+    best = int(pooled.argmax())
+    return {
+        "label": labels[best],
+        "score": float(pooled[best]),
+        "scores": {label: float(score) for label, score in zip(labels, pooled)},
+        "windows": len(windows),
+        "cached_windows": len(windows) - len(missing),
+        "pooling": pooling,
+    }
@@ -51,6 +51,12 @@ s3_client = boto3.client(
     region_name=os.getenv('AWS_REGION', s3_region)
 )
 
+from model_registry import registry as model_registry
+from classifier_service import fake_news_classifier
+import model_workers
+import embedding_cache
+from embedding_router import router as embedding_router
+
 # Attempt to import fact-checking module; provide fallback if unavailable
 try:
     from combined_3 import main as fact_check_main
@@ -110,6 +116,47 @@ async def startup_event():
     except Exception as e:
         print(f"Error initializing Gemini model: {e}")
 
+    # Load the models listed in WARMUP_MODELS in the background so the first
+    # fact check doesn't pay for it; /api/ready reports when they're done.
+    asyncio.get_running_loop().run_in_executor(None, model_registry.warmup)
+
+    # Start the model worker processes (no-op unless MODEL_WORKERS > 0)
+    model_workers.get_pool()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    model_workers.shutdown_pool()
+
+@app.get("/api/ready")
+async def readiness_check():
+    # With a worker pool the models live in the workers, not in this process
+    pool = model_workers.get_pool()
+    ready = pool.is_ready() if pool is not None else model_registry.is_ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "models": model_registry.status(),
+            "model_workers": pool.stats() if pool is not None else None
+        }
+    )
+
+@app.get("/api/embeddings/stats")
+async def embedding_cache_stats():
+    cache = embedding_cache.get_cache()
+    return {
+        "cache": cache.stats() if cache is not None else {"enabled": False},
+        "router": embedding_router.stats()
+    }
+
+@app.get("/api/classifier/stats")
+async def classifier_stats():
+    pool = model_workers.get_pool()
+    return {
+        "classifier": fake_news_classifier.stats(),
+        "model_workers": pool.stats() if pool is not None else None
+    }
+
 # -----------------------------
 # Helper Functions for S3 and MongoDB
 # -----------------------------
@@ -386,7 +433,8 @@ async def factcheck_stream(request: ArticleRequest):
                 yield f"data: {json.dumps(update)}\n\n"
                 if update.get("status") == "completed" and update.get("data", {}).get("result_data"):
                     final_result = update.get("data", {}).get("result_data")
-                await asyncio.sleep(0.1)
+                # Summary tokens are forwarded as they arrive; other updates keep the pacing
+                await asyncio.sleep(0 if "summary_delta" in (update.get("data") or {}) else 0.1)
         except Exception as e:
             error_msg = {"status": "error", "message": f"Error during processing: {str(e)}"}
             yield f"data: {json.dumps(error_msg)}\n\n"
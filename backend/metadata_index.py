@@ -0,0 +1,146 @@
+import bisect
+import datetime
+from array import array
+
+import numpy as np
+
+# Metadata values indexed for equality filters; anything else (lists, dicts)
+# can't be matched exactly and is left out
+_SCALARS = (str, int, float, bool)
+
+
+def _posting_key(value):
+    # True == 1 and False == 0 as dict keys, so booleans get keys of their
+    # own; ints and floats still match by numeric value
+    return ("bool", value) if isinstance(value, bool) else value
+
+
+def parse_date(value):
+    """ISO-8601 date or timestamp (e.g. verification_date) -> UTC epoch seconds, or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+class MetadataIndex:
+    """
+    Precomputed row sets over document metadata, for filtered vector search.
+
+    - verification_date: rows sorted by timestamp, so a date range is two
+      binary searches
+    - analysis_id: ids sorted, so a prefix is a contiguous slice
+    - every scalar metadata field: value -> posting list of rows
+
+    Rows added after construction (live ingest) go to small append-only
+    side lists and posting arrays, so readers never wait on writers.
+    """
+
+    def __init__(self, docs=()):
+        dated, keyed = [], []
+        self.postings = {}
+        self.rows = 0
+        for row, doc in enumerate(docs):
+            self._index_fields(row, doc)
+            timestamp, analysis_id = self._keys(doc)
+            if timestamp is not None:
+                dated.append((timestamp, row))
+            if analysis_id:
+                keyed.append((analysis_id, row))
+            self.rows = row + 1
+
+        dated.sort()
+        self._timestamps = np.array([t for t, _ in dated], dtype=np.float64)
+        self._timestamp_rows = np.array([r for _, r in dated], dtype=np.int64)
+        keyed.sort()
+        self._analysis_ids = [k for k, _ in keyed]
+        self._analysis_id_rows = np.array([r for _, r in keyed], dtype=np.int64)
+        # (row, timestamp, analysis_id) for rows added after construction
+        self._recent = []
+
+    @staticmethod
+    def _keys(doc):
+        metadata = doc.get("metadata") or {}
+        return parse_date(metadata.get("verification_date")), metadata.get("analysis_id") or doc.get("id")
+
+    def _index_fields(self, row, doc):
+        for field, value in (doc.get("metadata") or {}).items():
+            if isinstance(value, _SCALARS):
+                self.postings.setdefault(field, {}).setdefault(_posting_key(value), array("q")).append(row)
+
+    def add(self, row, doc):
+        self._index_fields(row, doc)
+        timestamp, analysis_id = self._keys(doc)
+        self._recent.append((row, timestamp, analysis_id))
+        self.rows = max(self.rows, row + 1)
+
+    def _date_rows(self, date_from, date_to):
+        low = parse_date(date_from) if date_from else -np.inf
+        high = parse_date(date_to) if date_to else np.inf
+        if low is None or high is None:
+            raise ValueError("Dates must be ISO-8601, e.g. 2025-01-31 or 2025-01-31T12:00:00Z")
+        if date_to and len(str(date_to)) == 10:
+            # A bare end date includes that whole day
+            high += 86400 - 1e-6
+        start = np.searchsorted(self._timestamps, low, side="left")
+        end = np.searchsorted(self._timestamps, high, side="right")
+        recent = [row for row, t, _ in list(self._recent) if t is not None and low <= t <= high]
+        return np.concatenate([self._timestamp_rows[start:end], np.array(recent, dtype=np.int64)])
+
+    def _prefix_rows(self, prefix):
+        start = bisect.bisect_left(self._analysis_ids, prefix)
+        end = bisect.bisect_left(self._analysis_ids, prefix + "\U0010ffff")
+        recent = [row for row, _, key in list(self._recent) if key and key.startswith(prefix)]
+        return np.concatenate([self._analysis_id_rows[start:end], np.array(recent, dtype=np.int64)])
+
+    def _equal_rows(self, field, value):
+        if not isinstance(value, _SCALARS):
+            return np.zeros(0, dtype=np.int64)
+        posting = self.postings.get(field, {}).get(_posting_key(value))
+        if posting is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.frombuffer(posting[:], dtype=np.int64)
+
+    def select(self, date_from=None, date_to=None, analysis_id_prefix=None, equals=None):
+        """
+        Rows matching every given condition.
+
+        Parameters:
+        date_from (str, optional): Earliest verification_date (inclusive)
+        date_to (str, optional): Latest verification_date (inclusive)
+        analysis_id_prefix (str, optional): analysis_id prefix
+        equals (dict, optional): metadata field -> required value
+
+        Returns:
+        numpy.ndarray or None: Sorted int64 rows, or None when no condition was given
+        """
+        sets = []
+        if date_from or date_to:
+            sets.append(self._date_rows(date_from, date_to))
+        if analysis_id_prefix:
+            sets.append(self._prefix_rows(analysis_id_prefix))
+        for field, value in (equals or {}).items():
+            sets.append(self._equal_rows(field, value))
+        if not sets:
+            return None
+
+        # Intersect smallest first so the work tracks the most selective condition
+        sets.sort(key=len)
+        rows = np.unique(sets[0])
+        for other in sets[1:]:
+            if not len(rows):
+                break
+            rows = np.intersect1d(rows, other)
+        return rows
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "dated_rows": len(self._timestamps) + sum(t is not None for _, t, _ in list(self._recent)),
+            "fields": {field: len(values) for field, values in list(self.postings.items())},
+        }
@@ -0,0 +1,83 @@
+"""
+One-shot migration of an existing RAG corpus to cosine scoring.
+
+Older corpora hold raw (unnormalized) vectors in embeddings.npy behind an L2
+index, whose scores can't be thresholded. This rewrites embeddings.npy with
+L2-normalized rows and rebuilds the index as an inner-product index of the
+same type, so answer.py reports true cosine similarities. Safe to re-run:
+already-normalized rows are left as they are.
+
+Stop answer.py (or at least its snapshotting) while this runs.
+
+Usage:
+    python migrate_cosine.py [--embeddings-dir embeddings-s3-bucket] [--index PATH] [--type TYPE]
+                             [--keep-original] [--skip-index]
+"""
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+
+import vector_index
+
+BLOCK_ROWS = 65536
+
+
+def normalize_embeddings(path, keep_original=False):
+    """Rewrite the float32 matrix at ``path`` with unit-length rows; returns (rows, rows changed)."""
+    old = np.load(path, mmap_mode="r")
+    tmp_path = path + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=old.shape)
+    changed = 0
+    for start in range(0, old.shape[0], BLOCK_ROWS):
+        block = np.asarray(old[start:start + BLOCK_ROWS], dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1)
+        changed += int(np.sum(np.abs(norms - 1.0) > 1e-4))
+        out[start:start + len(block)] = vector_index.normalize(block)
+    out.flush()
+    rows = old.shape[0]
+    del out, old
+
+    if keep_original:
+        backup = path[:-len(".npy")] + ".unnormalized.npy"
+        shutil.copy2(path, backup)
+        print(f"Kept the original vectors in {backup}")
+    os.replace(tmp_path, path)
+    return rows, changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings-dir", default="embeddings-s3-bucket")
+    parser.add_argument("--index", default=None, help="Index file to rebuild (default <embeddings-dir>/index.faiss)")
+    parser.add_argument("--type", default=None, choices=sorted(vector_index.INDEX_TYPES),
+                        help="Index type to rebuild as (default: the type recorded for the current index, else flat)")
+    parser.add_argument("--keep-original", action="store_true")
+    parser.add_argument("--skip-index", action="store_true", help="Only normalize embeddings.npy")
+    args = parser.parse_args()
+
+    embeddings_path = os.path.join(args.embeddings_dir, "embeddings.npy")
+    index_path = args.index or os.path.join(args.embeddings_dir, "index.faiss")
+
+    start_time = time.time()
+    rows, changed = normalize_embeddings(embeddings_path, keep_original=args.keep_original)
+    print(f"Normalized {changed} of {rows} vectors in {time.time() - start_time:.2f} seconds")
+    if args.skip_index:
+        return
+
+    meta = vector_index.read_index_meta(index_path)
+    index_type = args.type or meta.get("index_type", "flat")
+    options = meta.get("options", {})
+    start_time = time.time()
+    index = vector_index.build_index(np.load(embeddings_path, mmap_mode="r"), index_type, metric="ip", **options)
+    tmp_path = index_path + ".tmp"
+    vector_index.write_index(index, tmp_path, index_type, **options)
+    os.replace(tmp_path + ".meta.json", index_path + ".meta.json")
+    os.replace(tmp_path, index_path)
+    print(f"Rebuilt {index_type} inner-product index at {index_path} in {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
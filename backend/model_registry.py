@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+
+# "torch" runs models through transformers/sentence-transformers; "onnx" runs
+# int8-quantized exports through ONNX Runtime (see onnx_backend.py).
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+
+# Models the fact-checking pipeline uses. Each entry is loaded on first use and
+# then shared by every request handled by this process.
+MODEL_SPECS = {
+    "fake-news": {
+        "task": "text-classification",
+        "model": os.getenv("FAKE_NEWS_MODEL", "dhruvpal/fake-news-bert"),
+        "backend": INFERENCE_BACKEND,
+    },
+    "nli": {
+        "task": "text-classification",
+        "model": os.getenv("NLI_MODEL", "cross-encoder/nli-deberta-v3-xsmall"),
+        "backend": INFERENCE_BACKEND,
+    },
+    "minilm": {
+        "task": "sentence-embedding",
+        "model": os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+        "backend": INFERENCE_BACKEND,
+    },
+}
+
+# Comma-separated list of model names to load when the server starts
+# (e.g. "fake-news"). Empty means everything is loaded lazily.
+WARMUP_MODELS = [m.strip() for m in os.getenv("WARMUP_MODELS", "").split(",") if m.strip()]
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded models.
+
+    Loading happens at most once per model, guarded by a per-model lock so two
+    requests arriving together don't both pull the weights from disk. Inference
+    goes through ``run`` which serializes calls into the same pipeline.
+    """
+
+    def __init__(self, specs):
+        self.specs = dict(specs)
+        self._models = {}
+        self._load_locks = {name: threading.Lock() for name in self.specs}
+        self._run_locks = {name: threading.Lock() for name in self.specs}
+        self._errors = {}
+
+    def _load(self, name):
+        spec = self.specs[name]
+        start_time = time.time()
+        if spec.get("backend") == "onnx":
+            import onnx_backend
+            model = onnx_backend.load(spec)
+        elif spec["task"] == "sentence-embedding":
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(spec["model"])
+        else:
+            from transformers import pipeline
+            model = pipeline(spec["task"], model=spec["model"])
+        print(f"✅ Loaded model '{name}' ({spec['model']}, {spec.get('backend', 'torch')}) in {time.time() - start_time:.2f} seconds")
+        return model
+
+    def get(self, name):
+        """Return the loaded pipeline for ``name``, loading it on first use."""
+        if name not in self.specs:
+            raise KeyError(f"Unknown model: {name}")
+
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._load_locks[name]:
+            # Another thread may have finished loading while we waited
+            model = self._models.get(name)
+            if model is None:
+                try:
+                    model = self._load(name)
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    raise
+                self._models[name] = model
+                self._errors.pop(name, None)
+        return model
+
+    def run(self, name, inputs, **kwargs):
+        """Run the shared model for ``name`` on ``inputs``.
+
+        Embedding models are called through ``encode``; everything else is
+        called like a transformers pipeline.
+        """
+        model = self.get(name)
+        with self._run_locks[name]:
+            if self.specs[name]["task"] == "sentence-embedding":
+                return model.encode(inputs, **kwargs)
+            return model(inputs, **kwargs)
+
+    def warmup(self, names=None):
+        """Load the given models (default: WARMUP_MODELS) and run one dummy input through each."""
+        names = WARMUP_MODELS if names is None else names
+        for name in names:
+            try:
+                self.run(name, "warmup")
+            except Exception as e:
+                print(f"Error warming up model '{name}': {e}")
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def is_ready(self, names=None):
+        """True once every model in ``names`` (default: WARMUP_MODELS) is loaded.
+
+        With nothing to warm up, models load lazily on first use, so there is
+        nothing to wait for and the process is ready straight away.
+        """
+        names = WARMUP_MODELS if names is None else names
+        return all(self.is_loaded(name) for name in names)
+
+    def status(self):
+        return {
+            name: {
+                "model": spec["model"],
+                "backend": spec.get("backend", "torch"),
+                "loaded": self.is_loaded(name),
+                "error": self._errors.get(name),
+            }
+            for name, spec in self.specs.items()
+        }
+
+
+registry = ModelRegistry(MODEL_SPECS)
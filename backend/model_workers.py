@@ -0,0 +1,277 @@
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# Number of model worker processes. 0 keeps inference inside the calling
+# process (the default, and what single-worker dev setups want).
+MODEL_WORKERS = int(os.getenv("MODEL_WORKERS", "0"))
+# Models each worker loads as soon as it starts
+MODEL_WORKER_WARMUP = [m.strip() for m in os.getenv("MODEL_WORKER_WARMUP", "fake-news").split(",") if m.strip()]
+# How long a caller waits on any one job (a first call may include loading a model)
+MODEL_WORKER_TIMEOUT_S = float(os.getenv("MODEL_WORKER_TIMEOUT_S", "120"))
+# Minimum time between restarts of the same worker slot, so a worker that
+# crashes while loading doesn't get respawned on every request
+MODEL_WORKER_RESPAWN_S = float(os.getenv("MODEL_WORKER_RESPAWN_S", "10"))
+
+
+# -----------------------------
+# Worker process side
+# -----------------------------
+def _html_to_text(html):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    return "\n".join(line.strip() for line in soup.get_text("\n").splitlines() if line.strip())
+
+
+def _handle(registry, op, kwargs):
+    if op == "classify":
+        return registry.run(kwargs["model"], kwargs["texts"], batch_size=len(kwargs["texts"]),
+                            truncation=True, padding=True, top_k=None)
+    if op == "embed":
+        return np.ascontiguousarray(
+            registry.run(kwargs["model"], kwargs["texts"], normalize_embeddings=True), dtype=np.float32)
+    if op == "html_to_text":
+        return [_html_to_text(html) for html in kwargs["documents"]]
+    raise ValueError(f"Unknown model worker op: {op}")
+
+
+def _worker_main(conn, warmup):
+    # Each worker holds its own copy of the models, loaded once for its lifetime
+    from model_registry import registry
+
+    registry.warmup(warmup)
+    # Tell the parent whether every model it asked for is loaded
+    conn.send((None, "ready", registry.is_ready(warmup)))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        job_id, op, kwargs = message
+        try:
+            result = _handle(registry, op, kwargs)
+        except Exception as e:
+            conn.send((job_id, "error", f"{type(e).__name__}: {e}"))
+            continue
+
+        if isinstance(result, np.ndarray):
+            # Arrays go as a small header plus the raw buffer, so the parent can
+            # read the bytes straight into a preallocated array without pickling
+            conn.send((job_id, "array", (result.shape, result.dtype.str)))
+            conn.send_bytes(memoryview(result).cast("B"))
+        else:
+            conn.send((job_id, "ok", result))
+    conn.close()
+
+
+# -----------------------------
+# Parent (uvicorn worker) side
+# -----------------------------
+class _Worker:
+    def __init__(self, ctx, warmup):
+        self.conn, child_conn = ctx.Pipe(duplex=True)
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, warmup), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.send_lock = threading.Lock()
+        # Guards pending and closed, so a job is either registered before the
+        # reader's cleanup (and failed by it) or refused after it
+        self.pending_lock = threading.Lock()
+        self.pending = {}
+        self.closed = False
+        # Set once the worker has loaded its warmup models
+        self.warmed_up = False
+        self.started_at = time.time()
+        self.reader = threading.Thread(target=self._read_results, daemon=True)
+        self.reader.start()
+
+    def _read_results(self):
+        while True:
+            try:
+                job_id, kind, payload = self.conn.recv()
+                if kind == "array":
+                    shape, dtype = payload
+                    result = np.empty(shape, dtype=np.dtype(dtype))
+                    if result.nbytes:
+                        self.conn.recv_bytes_into(memoryview(result).cast("B"))
+                    else:
+                        self.conn.recv_bytes()
+                else:
+                    result = payload
+            except Exception as e:
+                if not isinstance(e, (EOFError, OSError)):
+                    print(f"Error reading from model worker: {e}")
+                break
+
+            if job_id is None:
+                self.warmed_up = bool(result)
+                continue
+            with self.pending_lock:
+                future = self.pending.pop(job_id, None)
+            if future is None or future.done():
+                continue
+            if kind == "error":
+                future.set_exception(RuntimeError(result))
+            else:
+                future.set_result(result)
+
+        # Worker went away; fail whatever was still waiting on it
+        with self.pending_lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError("Model worker exited"))
+
+    def alive(self):
+        return self.process.is_alive() and not self.closed
+
+    def submit(self, job_id, op, kwargs):
+        future = Future()
+        with self.pending_lock:
+            if self.closed:
+                future.set_exception(RuntimeError("Model worker is not running"))
+                return future
+            self.pending[job_id] = future
+        try:
+            with self.send_lock:
+                self.conn.send((job_id, op, kwargs))
+        except (OSError, BrokenPipeError) as e:
+            with self.pending_lock:
+                self.pending.pop(job_id, None)
+            if not future.done():
+                future.set_exception(RuntimeError(f"Model worker is not running: {e}"))
+        return future
+
+    def result(self, job_id, future, timeout=MODEL_WORKER_TIMEOUT_S):
+        """Wait for one job; on timeout it is dropped from pending and TimeoutError raised."""
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            with self.pending_lock:
+                self.pending.pop(job_id, None)
+            raise TimeoutError(f"Model worker did not answer within {timeout:.0f}s")
+
+    def close(self, timeout=5):
+        try:
+            with self.send_lock:
+                self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class ModelWorkerPool:
+    """Pool of processes that each hold the classifier/embedding models.
+
+    Requests are routed to the live worker with the fewest outstanding jobs
+    over a dedicated pipe, so model inference and HTML parsing run outside the
+    GIL of the process serving HTTP. A worker that dies is replaced on the
+    next request. Results come back as futures.
+    """
+
+    def __init__(self, num_workers, warmup=MODEL_WORKER_WARMUP):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._warmup = warmup
+        self._workers = [_Worker(self._ctx, warmup) for _ in range(num_workers)]
+        self._workers_lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self.respawns = 0
+
+    def _respawn_dead(self):
+        with self._workers_lock:
+            for i, worker in enumerate(self._workers):
+                # Don't restart a worker that keeps dying at startup more than once per backoff
+                if worker.alive() or time.time() - worker.started_at < MODEL_WORKER_RESPAWN_S:
+                    continue
+                print(f"Model worker {worker.process.pid} exited (code {worker.process.exitcode}); starting a replacement")
+                worker.close(timeout=0)
+                self._workers[i] = _Worker(self._ctx, self._warmup)
+                self.respawns += 1
+
+    def submit(self, op, **kwargs):
+        """
+        Send a job to the least busy live worker.
+
+        Returns:
+        tuple: (worker, job id, Future) to pass to ``_Worker.result``
+        """
+        self._respawn_dead()
+        live = [w for w in self._workers if w.alive()]
+        job_id = next(self._job_ids)
+        if not live:
+            future = Future()
+            future.set_exception(RuntimeError("No model worker is running"))
+            return None, job_id, future
+        worker = min(live, key=lambda w: len(w.pending))
+        return worker, job_id, worker.submit(job_id, op, kwargs)
+
+    def run(self, op, timeout=None, **kwargs):
+        worker, job_id, future = self.submit(op, **kwargs)
+        if worker is None:
+            return future.result()
+        return worker.result(job_id, future, MODEL_WORKER_TIMEOUT_S if timeout is None else timeout)
+
+    def classify(self, texts, model="fake-news"):
+        return self.run("classify", model=model, texts=list(texts))
+
+    def embed(self, texts, model="minilm"):
+        return self.run("embed", model=model, texts=list(texts))
+
+    def html_to_text(self, documents):
+        return self.run("html_to_text", documents=list(documents))
+
+    def is_ready(self):
+        """True once every worker is running and has loaded its warmup models."""
+        return all(w.alive() and w.warmed_up for w in self._workers)
+
+    def stats(self):
+        return {
+            "workers": len(self._workers),
+            "alive": sum(w.alive() for w in self._workers),
+            "warmed_up": sum(w.alive() and w.warmed_up for w in self._workers),
+            "respawns": self.respawns,
+            "outstanding": [len(w.pending) for w in self._workers],
+        }
+
+    def shutdown(self):
+        for worker in self._workers:
+            worker.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the shared worker pool, or None when MODEL_WORKERS is 0."""
+    global _pool
+    if MODEL_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ModelWorkerPool(MODEL_WORKERS)
+                print(f"Started {MODEL_WORKERS} model worker processes")
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
@@ -0,0 +1,194 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# Where exported/quantized models are written. Each model gets its own
+# subdirectory holding model.onnx, model.int8.onnx, the tokenizer and labels.
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx_models")
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "1") != "0"
+# Threads used inside one operator (matmuls etc). Defaults to every core; lower
+# it when several processes share a node.
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", str(os.cpu_count() or 1)))
+ONNX_OPSET = 14
+
+
+def _model_dir(model_id):
+    return os.path.join(ONNX_MODEL_DIR, model_id.replace("/", "__"))
+
+
+def export_model(model_id, task, quantize=ONNX_QUANTIZE):
+    """
+    Export a HuggingFace model to ONNX and optionally apply dynamic int8 quantization.
+
+    Parameters:
+    model_id (str): HuggingFace model id, e.g. 'dhruvpal/fake-news-bert'
+    task (str): 'text-classification' or 'sentence-embedding'
+    quantize (bool): Also write an int8 dynamically quantized copy
+
+    Returns:
+    str: Path of the model file to load (quantized if requested)
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModel, AutoModelForSequenceClassification
+
+    out_dir = _model_dir(model_id)
+    os.makedirs(out_dir, exist_ok=True)
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    int8_path = os.path.join(out_dir, "model.int8.onnx")
+
+    start_time = time.time()
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    if task == "text-classification":
+        model = AutoModelForSequenceClassification.from_pretrained(model_id)
+        output_names = ["logits"]
+    else:
+        model = AutoModel.from_pretrained(model_id)
+        output_names = ["last_hidden_state"]
+    model.eval()
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes[output_names[0]] = {0: "batch"} if task == "text-classification" else {0: "batch", 1: "sequence"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+        )
+
+    tokenizer.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, "labels.json"), "w") as f:
+        json.dump({str(k): v for k, v in getattr(model.config, "id2label", {}).items()}, f)
+
+    model_path = fp32_path
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        model_path = int8_path
+
+    print(f"✅ Exported {model_id} to {model_path} in {time.time() - start_time:.2f} seconds")
+    return model_path
+
+
+def _create_session(model_path):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class OnnxTextClassifier:
+    """ONNX Runtime stand-in for a transformers text-classification pipeline.
+
+    Accepts the same call shape the registry and classifier service use
+    (a string, list of strings or list of ``{"text", "text_pair"}`` dicts plus
+    pipeline keyword arguments) and returns results in the pipeline's format.
+    """
+
+    def __init__(self, model_dir, model_path):
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = _create_session(model_path)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        with open(os.path.join(model_dir, "labels.json")) as f:
+            labels = json.load(f)
+        self.labels = [labels.get(str(i), f"LABEL_{i}") for i in range(len(labels))]
+
+    def __call__(self, inputs, truncation=True, padding=True, top_k=1, batch_size=None, **kwargs):
+        single = isinstance(inputs, str)
+        texts = [inputs] if single else list(inputs)
+        batch_size = batch_size or len(texts) or 1
+
+        results = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            if isinstance(batch[0], dict):
+                # Sentence pairs, given the way pipelines take them
+                encoded = self.tokenizer([item["text"] for item in batch], [item["text_pair"] for item in batch],
+                                         truncation=truncation, padding=padding, return_tensors="np")
+            else:
+                encoded = self.tokenizer(batch, truncation=truncation, padding=padding, return_tensors="np")
+            feed = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            probs = _softmax(self.session.run(None, feed)[0])
+            for row in probs:
+                ranked = [{"label": self.labels[i], "score": float(row[i])} for i in np.argsort(-row)]
+                results.append(ranked if top_k is None else ranked[:top_k])
+
+        if top_k == 1:
+            # Pipelines return one flat dict per input when top_k is 1
+            results = [ranked[0] for ranked in results]
+        if single and top_k is None:
+            return results[0]
+        return results
+
+
+class OnnxSentenceEmbedder:
+    """ONNX Runtime sentence embedder with the same ``encode`` call shape and defaults as SentenceTransformer."""
+
+    def __init__(self, model_dir, model_path, max_length=256):
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = _create_session(model_path)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.max_seq_length = max_length
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(texts[start:start + batch_size], truncation=True, padding=True,
+                                     max_length=self.max_seq_length, return_tensors="np")
+            feed = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+
+            # Mean over real tokens only
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled.astype(np.float32))
+
+        embeddings = np.vstack(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+    def get_sentence_embedding_dimension(self):
+        return int(self.encode(["dimension probe"]).shape[1])
+
+
+def load(spec, quantize=None):
+    """Load (exporting first if needed) the ONNX version of a registry model spec."""
+    if quantize is None:
+        quantize = ONNX_QUANTIZE
+    model_dir = _model_dir(spec["model"])
+    model_path = os.path.join(model_dir, "model.int8.onnx" if quantize else "model.onnx")
+    if not os.path.exists(model_path):
+        model_path = export_model(spec["model"], spec["task"], quantize=quantize)
+
+    if spec["task"] == "text-classification":
+        return OnnxTextClassifier(model_dir, model_path)
+    if spec["task"] == "sentence-embedding":
+        return OnnxSentenceEmbedder(model_dir, model_path)
+    raise ValueError(f"ONNX backend does not support task: {spec['task']}")
@@ -0,0 +1,171 @@
+"""
+Partition a compacted RAG corpus into shards served by separate processes.
+
+Reads <embeddings-dir>/embeddings.npy and the document store (see
+compact_embeddings.py) and writes one complete corpus per shard:
+    <embeddings-dir>/shards/shard-{i}/embeddings.npy, documents.jsonl, ...
+    <embeddings-dir>/shards/shard-{i}/index.faiss (+ .meta.json)
+    <embeddings-dir>/shards/shards.json     partitioning scheme, read by sharded_index.py
+
+--by hash spreads documents evenly by a hash of their id; --by time splits
+on metadata.verification_date quantiles, so recent documents share a shard
+(undated ones go to the last, like undated live ingests). Run answer.py with RAG_SHARDED=1 to serve the
+result. A single shard can later be rebuilt in place with build_index.py
+--embeddings-dir <shard dir> and swapped in with POST /shards/{i}/reload.
+
+Usage:
+    python shard_corpus.py --shards 4 [--by hash] [--type hnsw] [--embeddings-dir embeddings-s3-bucket]
+                           [--M 32] [--ef-construction 200] [--nlist 1024] [--m 16] [--nbits 8] [--force]
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+import zlib
+
+import numpy as np
+
+import doc_store
+import vector_index
+from metadata_index import parse_date
+
+SPEC_FILE = "shards.json"
+PARTITIONS = {"hash", "time"}
+BLOCK_ROWS = 65536
+DOCUMENT_BATCH = 10000
+
+
+def shard_path(shards_dir, shard):
+    return os.path.join(shards_dir, f"shard-{shard}")
+
+
+def load_spec(shards_dir):
+    with open(os.path.join(shards_dir, SPEC_FILE), 'r') as f:
+        return json.load(f)
+
+
+def shard_of(doc, spec):
+    """Shard a document belongs to under ``spec``; also routes newly ingested documents."""
+    if spec["by"] == "hash":
+        return zlib.crc32(str(doc["id"]).encode("utf-8")) % spec["count"]
+    timestamp = parse_date((doc.get("metadata") or {}).get("verification_date"))
+    if timestamp is None:
+        # Undated documents (partitioned or ingested live) go with the most recent ones
+        return spec["count"] - 1
+    return int(np.searchsorted(spec["boundaries"], timestamp, side="right"))
+
+
+def time_boundaries(timestamps, count):
+    """Quantile cut points giving ``count`` shards of roughly equal size."""
+    dated = np.sort(timestamps[np.isfinite(timestamps)])
+    if not len(dated):
+        return [float("inf")] * (count - 1)
+    return [float(dated[min(int(len(dated) * i / count), len(dated) - 1)]) for i in range(1, count)]
+
+
+def build_shard_index(directory, index_type, options):
+    """Build the index for the corpus in ``directory`` and write it atomically next to it."""
+    index_path = os.path.join(directory, "index.faiss")
+    index = vector_index.build_index(np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r"),
+                                     index_type, **options)
+    tmp_path = index_path + ".tmp"
+    vector_index.write_index(index, tmp_path, index_type, **options)
+    os.replace(tmp_path + ".meta.json", index_path + ".meta.json")
+    os.replace(tmp_path, index_path)
+    return index.ntotal
+
+
+def partition(embeddings_dir, count, by="hash", index_type="hnsw", options=None, force=False):
+    """
+    Split the corpus in ``embeddings_dir`` into ``count`` shards and index each one.
+
+    Returns:
+    dict: The written shard spec
+    """
+    options = options or {}
+    shards_dir = os.path.join(embeddings_dir, "shards")
+    if os.path.exists(shards_dir):
+        if not force:
+            raise Exception(f"'{shards_dir}' already exists; pass --force to replace it")
+        shutil.rmtree(shards_dir)
+
+    store = doc_store.DocumentStore(embeddings_dir)
+    vectors = np.load(os.path.join(embeddings_dir, "embeddings.npy"), mmap_mode="r")
+    if vectors.shape[0] != len(store):
+        raise Exception(f"embeddings.npy has {vectors.shape[0]} rows but the document store has {len(store)}")
+
+    start_time = time.time()
+    spec = {"by": by, "count": count, "boundaries": []}
+    if by == "time":
+        timestamps = np.array([parse_date((store[row].get("metadata") or {}).get("verification_date")) or np.nan
+                               for row in range(len(store))], dtype=np.float64)
+        spec["boundaries"] = time_boundaries(timestamps, count)
+        # Same rule as shard_of, so a re-ingested document routes to the shard that holds it
+        assignment = np.where(np.isnan(timestamps), count - 1,
+                              np.searchsorted(spec["boundaries"], np.nan_to_num(timestamps), side="right"))
+    else:
+        assignment = np.array([shard_of({"id": doc_id}, spec) for doc_id in sorted(store.ids, key=store.ids.get)],
+                              dtype=np.int64)
+
+    spec["rows"] = np.bincount(assignment, minlength=count).tolist()
+    if min(spec["rows"]) == 0:
+        # Every shard process needs an index to serve, so an empty shard can't start
+        raise Exception(f"Partitioning by {by} leaves empty shards ({spec['rows']}); use fewer shards")
+
+    for shard in range(count):
+        directory = shard_path(shards_dir, shard)
+        os.makedirs(directory)
+        rows = np.flatnonzero(assignment == shard)
+        out = np.lib.format.open_memmap(os.path.join(directory, "embeddings.npy"), mode="w+",
+                                        dtype=np.float32, shape=(len(rows), vectors.shape[1]))
+        for start in range(0, len(rows), BLOCK_ROWS):
+            out[start:start + BLOCK_ROWS] = vectors[rows[start:start + BLOCK_ROWS]]
+        out.flush()
+        del out
+        for start in range(0, len(rows), DOCUMENT_BATCH):
+            doc_store.append_documents(directory, [store[int(row)] for row in rows[start:start + DOCUMENT_BATCH]],
+                                       expected_rows=start)
+        build_shard_index(directory, index_type, options)
+        print(f"Shard {shard}: {len(rows)} documents")
+    store.close()
+
+    spec["index_type"] = index_type
+    spec["created_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    with open(os.path.join(shards_dir, SPEC_FILE), 'w') as f:
+        json.dump(spec, f, indent=2)
+    print(f"Wrote {count} {by} shards of {vectors.shape[0]} documents to {shards_dir} "
+          f"in {time.time() - start_time:.2f} seconds")
+    return spec
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--by", default="hash", choices=sorted(PARTITIONS))
+    parser.add_argument("--type", default="hnsw", choices=sorted(vector_index.INDEX_TYPES))
+    parser.add_argument("--embeddings-dir", default="embeddings-s3-bucket")
+    parser.add_argument("--M", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["M"])
+    parser.add_argument("--ef-construction", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["ef_construction"])
+    parser.add_argument("--nlist", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["nlist"])
+    parser.add_argument("--m", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["m"])
+    parser.add_argument("--nbits", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["nbits"])
+    parser.add_argument("--train-sample", type=int, default=vector_index.DEFAULT_BUILD_OPTIONS["train_sample"])
+    parser.add_argument("--force", action="store_true", help="Replace an existing shards directory")
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+
+    options = {
+        "M": args.M,
+        "ef_construction": args.ef_construction,
+        "nlist": args.nlist,
+        "m": args.m,
+        "nbits": args.nbits,
+        "train_sample": args.train_sample,
+    }
+    partition(args.embeddings_dir, args.shards, by=args.by, index_type=args.type, options=options, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,552 @@
+import concurrent.futures
+import glob
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+import doc_store
+import shard_corpus
+from lexical_index import reciprocal_rank_fusion
+
+# Requests a shard process works on at once (e.g. both legs of a hybrid query)
+SHARD_THREADS = int(os.getenv("RAG_SHARD_THREADS", "2"))
+# How long a shard process may take to load (or rebuild) its index before startup fails
+SHARD_START_TIMEOUT_S = float(os.getenv("RAG_SHARD_START_TIMEOUT_S", "600"))
+# How long a query, lookup or ingest waits on any one shard
+SHARD_TIMEOUT_S = float(os.getenv("RAG_SHARD_TIMEOUT_S", "30"))
+WATCH_INTERVAL_S = float(os.getenv("RAG_WATCH_INTERVAL_S", "10"))
+
+
+class ShardUnavailable(RuntimeError):
+    """A shard process is not running (it is being restarted); the request can be retried."""
+
+
+# -----------------------------
+# Shard process side
+# -----------------------------
+def _hits(index, scores, rows, state):
+    # Rows are local to the shard, so resolve them to documents before replying
+    return [(float(score), index.document(int(row))) for score, row in zip(scores, rows) if 0 <= row < state.ntotal]
+
+
+def _handle(index, op, kwargs):
+    if op == "search":
+        rows = index.metadata.select(**kwargs["filter"]) if kwargs.get("filter") else None
+        scores, ids, state = index.search(kwargs["queries"], kwargs["k"], ef_search=kwargs.get("ef_search"),
+                                          nprobe=kwargs.get("nprobe"), rows=rows, min_score=kwargs.get("min_score"))
+        return [_hits(index, s, r, state) for s, r in zip(scores, ids)]
+    if op == "lexical":
+        rows = index.metadata.select(**kwargs["filter"]) if kwargs.get("filter") else None
+        state = index.state
+        return [_hits(index, s, r, state)
+                for s, r in index.lexical_search(kwargs["texts"], kwargs["k"], rows=rows, state=state)]
+    if op == "add":
+        return index.add(kwargs["docs"], kwargs["vectors"])
+    if op == "get":
+        return index.get(kwargs["doc_id"])
+    if op == "contains":
+        return [doc_id for doc_id in kwargs["ids"] if index.get(doc_id) is not None]
+    if op == "stats":
+        return index.stats()
+    if op == "snapshot":
+        return index.snapshot()
+    if op == "pause":
+        # Before a replacement process takes over the directory: stop
+        # maintenance, optionally fold the delta to disk, and hand over the
+        # writer lock so the new process loads as the writer
+        index.stop(wait=True)
+        if kwargs.get("snapshot"):
+            try:
+                index.snapshot()
+            except Exception:
+                index.start_background()
+                raise
+        index.release_writer()
+        return True
+    if op == "resume":
+        # The replacement failed to start; carry on as before
+        if not index.acquire_writer():
+            raise RuntimeError("Another process holds the shard's writer lock")
+        index.start_background()
+        return True
+    raise ValueError(f"Unknown shard op: {op}")
+
+
+def _shard_main(conn, directory, mmap, rebuild):
+    # Each shard process holds one LiveIndex over its own corpus directory
+    import vector_index
+    from live_index import LiveIndex
+
+    index_path = os.path.join(directory, "index.faiss")
+    try:
+        if rebuild:
+            meta = vector_index.read_index_meta(index_path)
+            shard_corpus.build_shard_index(directory, meta.get("index_type", "flat"), meta.get("options", {}))
+        index = LiveIndex(directory, index_path, mmap=mmap)
+        index.load()
+    except Exception as e:
+        conn.send((None, "error", f"{type(e).__name__}: {e}"))
+        conn.close()
+        return
+    index.start_background()
+    conn.send((None, "ok", index.stats()))
+
+    send_lock = threading.Lock()
+
+    def run(job_id, op, kwargs):
+        try:
+            reply = (job_id, "ok", _handle(index, op, kwargs))
+        except ValueError as e:
+            reply = (job_id, "invalid", str(e))
+        except Exception as e:
+            reply = (job_id, "error", f"{type(e).__name__}: {e}")
+        with send_lock:
+            try:
+                conn.send(reply)
+            except (OSError, BrokenPipeError):
+                pass
+
+    executor = ThreadPoolExecutor(max_workers=SHARD_THREADS)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        executor.submit(run, *message)
+    # Finish whatever was queued before the shutdown message
+    executor.shutdown(wait=True)
+    index.stop(wait=True)
+    conn.close()
+
+
+# -----------------------------
+# Coordinator (uvicorn worker) side
+# -----------------------------
+class _Shard:
+    def __init__(self, ctx, shard, directory, mmap, rebuild=False):
+        self.shard = shard
+        self.directory = directory
+        self.conn, child_conn = ctx.Pipe(duplex=True)
+        self.process = ctx.Process(target=_shard_main, args=(child_conn, directory, mmap, rebuild), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.send_lock = threading.Lock()
+        # Guards pending and closed, so a job is either registered before the
+        # reader's cleanup (and failed by it) or refused after it
+        self.pending_lock = threading.Lock()
+        self.pending = {}
+        self.closed = False
+        # Resolves to the shard's stats once its index is loaded
+        self.ready = Future()
+        self.reader = threading.Thread(target=self._read_results, daemon=True)
+        self.reader.start()
+
+    def _read_results(self):
+        while True:
+            try:
+                job_id, kind, payload = self.conn.recv()
+            except Exception as e:
+                if not isinstance(e, (EOFError, OSError)):
+                    print(f"Error reading from shard {self.shard}: {e}")
+                break
+
+            if job_id is None:
+                future = self.ready
+            else:
+                with self.pending_lock:
+                    future = self.pending.pop(job_id, None)
+            if future is None or future.done():
+                continue
+            if kind == "invalid":
+                future.set_exception(ValueError(payload))
+            elif kind == "error":
+                future.set_exception(RuntimeError(f"Shard {self.shard}: {payload}"))
+            else:
+                future.set_result(payload)
+
+        # Shard went away; fail whatever was still waiting on it
+        if not self.ready.done():
+            self.ready.set_exception(ShardUnavailable(f"Shard {self.shard} exited during startup"))
+        with self.pending_lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ShardUnavailable(f"Shard {self.shard} exited"))
+
+    def alive(self):
+        return self.process.is_alive() and not self.closed
+
+    def submit(self, job_id, op, kwargs):
+        future = Future()
+        with self.pending_lock:
+            if self.closed:
+                future.set_exception(ShardUnavailable(f"Shard {self.shard} is not running"))
+                return future
+            self.pending[job_id] = future
+        try:
+            with self.send_lock:
+                self.conn.send((job_id, op, kwargs))
+        except (OSError, BrokenPipeError) as e:
+            with self.pending_lock:
+                self.pending.pop(job_id, None)
+            if not future.done():
+                future.set_exception(ShardUnavailable(f"Shard {self.shard} is not running: {e}"))
+        return future
+
+    def result(self, job_id, future, timeout=SHARD_TIMEOUT_S):
+        """Wait for one of this shard's jobs; a shard that doesn't answer in time raises TimeoutError."""
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # Stop tracking the job, so a hung shard doesn't accumulate them
+            with self.pending_lock:
+                self.pending.pop(job_id, None)
+            raise TimeoutError(f"Shard {self.shard} did not answer within {timeout:.0f}s")
+
+    def close(self, timeout=30):
+        try:
+            with self.send_lock:
+                self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class ShardedIndex:
+    """
+    A corpus partitioned by shard_corpus.py, served by one process per shard.
+
+    Queries are scattered to every shard in parallel and the per-shard top-k
+    lists merged by score. Cosine scores compare directly across shards; BM25
+    scores use per-shard statistics, so the lexical merge is approximate.
+    New documents go to the shard the partitioning scheme assigns them, and
+    any shard can be reloaded (optionally rebuilding its index) by starting
+    a replacement process and swapping it in once loaded, while the others
+    and the old process keep serving. A shard process that dies is restarted
+    in the background; until it is back, requests that need it raise
+    ShardUnavailable.
+    """
+
+    def __init__(self, shards_dir, mmap=True, encode=None, embedding_model_id=None):
+        """
+        Parameters:
+        shards_dir (str): Directory written by shard_corpus.py
+        mmap (bool): Memory-map each shard's index
+        encode (callable, optional): texts -> float32 matrix, for watched analyses from another model
+        embedding_model_id (str, optional): Model the shard vectors come from
+        """
+        self.shards_dir = shards_dir
+        self.mmap = mmap
+        self.encode = encode
+        self.embedding_model_id = embedding_model_id
+        self.spec = shard_corpus.load_spec(shards_dir)
+        self.shards = []
+        self.dimension = None
+        self.version = 0
+        self.reloads = 0
+
+        self._ctx = multiprocessing.get_context("spawn")
+        self._job_ids = itertools.count()
+        self._version_lock = threading.Lock()
+        # Held while writing to a shard or replacing it, so no ingest lands in a process being retired
+        self._shard_locks = [threading.Lock() for _ in range(self.spec["count"])]
+        # Time shards route by date, so one id could land in two shards; ingest
+        # checks every shard for the id first, one batch at a time
+        self._add_lock = threading.Lock()
+        self._restarting = set()
+        self._restart_lock = threading.Lock()
+        self._seen_files = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _start(self, shard, rebuild=False):
+        return _Shard(self._ctx, shard, shard_corpus.shard_path(self.shards_dir, shard), self.mmap, rebuild)
+
+    def _bump_version(self):
+        with self._version_lock:
+            self.version += 1
+
+    def load(self):
+        # Start every process first so the shards load in parallel
+        shards = [self._start(shard) for shard in range(self.spec["count"])]
+        try:
+            infos = [shard.ready.result(timeout=SHARD_START_TIMEOUT_S) for shard in shards]
+        except Exception:
+            for shard in shards:
+                shard.close(timeout=5)
+            raise
+        dimensions = {info["dimension"] for info in infos}
+        if len(dimensions) != 1:
+            raise Exception(f"Shards in '{self.shards_dir}' disagree on dimension: {sorted(dimensions)}")
+        self.dimension = dimensions.pop()
+        self.shards = shards
+        return infos
+
+    # Reads
+
+    def _restart_dead(self, shards=None):
+        """Restart, in the background, any of ``shards`` (default: all) whose process has died."""
+        for shard in shards if shards is not None else self.shards:
+            if shard.alive():
+                continue
+            with self._restart_lock:
+                if shard.shard in self._restarting:
+                    continue
+                self._restarting.add(shard.shard)
+            threading.Thread(target=self._restart, args=(shard.shard,), daemon=True,
+                             name=f"rag-shard-{shard.shard}-restart").start()
+
+    def _restart(self, shard):
+        try:
+            print(f"Shard {shard} process exited; restarting it")
+            self.reload(shard, only_if_dead=True)
+        except Exception as e:
+            print(f"Restart of shard {shard} failed (retried on the next check): {str(e)}")
+        finally:
+            with self._restart_lock:
+                self._restarting.discard(shard)
+
+    def _call(self, shard, op, kwargs, timeout=SHARD_TIMEOUT_S):
+        """Run one job on one shard process and wait for its answer."""
+        self._restart_dead([shard])
+        job_id = next(self._job_ids)
+        return shard.result(job_id, shard.submit(job_id, op, kwargs), timeout)
+
+    def _scatter(self, op, **kwargs):
+        """Send one job to every shard; returns (shard, job id, future) triples to wait on."""
+        self._restart_dead()
+        jobs = []
+        for shard in self.shards:
+            job_id = next(self._job_ids)
+            jobs.append((shard, job_id, shard.submit(job_id, op, kwargs)))
+        return jobs
+
+    @staticmethod
+    def _gather(jobs, k):
+        """Merge per-shard hit lists into the global top-k per query."""
+        per_shard = [shard.result(job_id, future) for shard, job_id, future in jobs]
+        return [
+            heapq.nlargest(k, itertools.chain.from_iterable(hits[q] for hits in per_shard), key=lambda hit: hit[0])
+            for q in range(len(per_shard[0]) if per_shard else 0)
+        ]
+
+    def search(self, queries, k, ef_search=None, nprobe=None, conditions=None, min_score=None):
+        """
+        Dense search over every shard.
+
+        Parameters:
+        queries (numpy.ndarray): Query vectors
+        conditions (dict, optional): MetadataIndex.select keyword arguments, applied inside each shard
+
+        Returns:
+        list: (score, document) pairs per query, best first
+        """
+        futures = self._scatter("search", queries=np.asarray(queries, dtype=np.float32), k=k, ef_search=ef_search,
+                                nprobe=nprobe, filter=conditions, min_score=min_score)
+        return self._gather(futures, k)
+
+    def lexical_search(self, texts, k, conditions=None):
+        return self._gather(self._scatter("lexical", texts=list(texts), k=k, filter=conditions), k)
+
+    def hybrid_search(self, queries, texts, k, depth, ef_search=None, nprobe=None, conditions=None,
+                      min_score=None, rrf_k=60):
+        """Both legs scattered at once, merged globally to ``depth`` each, then fused by reciprocal rank."""
+        dense_futures = self._scatter("search", queries=np.asarray(queries, dtype=np.float32), k=depth,
+                                      ef_search=ef_search, nprobe=nprobe, filter=conditions, min_score=min_score)
+        lexical_futures = self._scatter("lexical", texts=list(texts), k=depth, filter=conditions)
+        results = []
+        for dense, lexical in zip(self._gather(dense_futures, depth), self._gather(lexical_futures, depth)):
+            # Fuse on document ids, numbered locally since rows differ between shards
+            keys, docs = {}, []
+            for _, doc in dense + lexical:
+                if doc["id"] not in keys:
+                    keys[doc["id"]] = len(docs)
+                    docs.append(doc)
+            scores, fused = reciprocal_rank_fusion([[keys[doc["id"]] for _, doc in dense],
+                                                    [keys[doc["id"]] for _, doc in lexical]], k, rrf_k)
+            results.append([(float(score), docs[key]) for score, key in zip(scores, fused)])
+        return results
+
+    def get(self, doc_id):
+        if self.spec["by"] == "hash":
+            return self._call(self.shards[shard_corpus.shard_of({"id": doc_id}, self.spec)], "get",
+                              {"doc_id": doc_id})
+        for shard, job_id, future in self._scatter("get", doc_id=doc_id):
+            doc = shard.result(job_id, future)
+            if doc is not None:
+                return doc
+        return None
+
+    # Writes
+
+    def add(self, docs, vectors):
+        """
+        Route documents to their shards and append them there (see LiveIndex.add).
+
+        Returns:
+        list: Ids that were added, in input order
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimension:
+            raise ValueError(f"Expected vectors of dimension {self.dimension}, got shape {vectors.shape}")
+        if self.spec["by"] != "time":
+            return self._add(docs, vectors)
+        with self._add_lock:
+            ids = list({doc["id"] for doc in docs})
+            present = set()
+            for shard, job_id, future in self._scatter("contains", ids=ids):
+                present.update(shard.result(job_id, future))
+            keep = [i for i, doc in enumerate(docs) if doc["id"] not in present]
+            return self._add([docs[i] for i in keep], vectors[keep])
+
+    def _add(self, docs, vectors):
+        groups, seen = {}, set()
+        for i, doc in enumerate(docs):
+            # Later copies of an id in the same batch could route elsewhere
+            if doc["id"] in seen:
+                continue
+            seen.add(doc["id"])
+            groups.setdefault(shard_corpus.shard_of(doc, self.spec), []).append(i)
+
+        added = set()
+        for shard, positions in sorted(groups.items()):
+            with self._shard_locks[shard]:
+                added.update(self._call(self.shards[shard], "add", {
+                    "docs": [docs[i] for i in positions],
+                    "vectors": vectors[positions],
+                }))
+        if added:
+            self._bump_version()
+        routed = sorted(i for positions in groups.values() for i in positions)
+        return [docs[i]["id"] for i in routed if docs[i]["id"] in added]
+
+    def reload(self, shard, rebuild=False, only_if_dead=False):
+        """
+        Replace one shard's process with a fresh one loaded from disk.
+
+        The old process keeps answering queries until the new one is ready;
+        ingest into this shard waits. With ``rebuild`` the delta is snapshotted
+        first and the new process rebuilds the shard's index from its
+        embeddings.npy before loading it. A dead shard process is simply
+        restarted; with ``only_if_dead`` a live one is left alone.
+
+        Returns:
+        dict: The new shard process's stats, or None if nothing was reloaded
+        """
+        if not 0 <= shard < len(self.shards):
+            raise ValueError(f"No shard {shard}; there are {len(self.shards)}")
+        with self._shard_locks[shard]:
+            old = self.shards[shard]
+            if only_if_dead and old.alive():
+                return None
+            paused = old.alive()
+            if paused:
+                self._call(old, "pause", {"snapshot": rebuild}, timeout=SHARD_START_TIMEOUT_S)
+            new = self._start(shard, rebuild)
+            try:
+                info = new.ready.result(timeout=SHARD_START_TIMEOUT_S)
+            except Exception:
+                new.close(timeout=5)
+                if paused:
+                    # Hand the directory back so the old process snapshots again
+                    try:
+                        self._call(old, "resume", {})
+                    except Exception as e:
+                        print(f"Shard {shard} could not resume writing after the failed reload: {str(e)}")
+                print(f"Reload of shard {shard} failed; the old process keeps serving")
+                raise
+            shards = list(self.shards)
+            shards[shard] = new
+            self.shards = shards
+        # Queries already sent to the old process are answered before it exits
+        old.close()
+        self.reloads += 1
+        self._bump_version()
+        print(f"Reloaded shard {shard} ({info['ntotal']} documents{', index rebuilt' if rebuild else ''})")
+        return info
+
+    # Watching for uploaded analyses
+
+    def ingest_file(self, path):
+        """Ingest one embeddings/{analysis_id}.json file into the shard it belongs to."""
+        with open(path, 'r') as f:
+            data = json.load(f)
+        doc = doc_store.document_from_shard(data)
+        if doc is None:
+            return []
+        vector = np.asarray(data.get("embeddings") or [], dtype=np.float32)
+        same_space = (vector.shape == (self.dimension,)
+                      and (data.get("model_id") is None or data.get("model_id") == self.embedding_model_id))
+        if not same_space:
+            if self.encode is None:
+                print(f"Skipping {path}: {data.get('model_id')} vectors don't match the index")
+                return []
+            vector = self.encode([doc["content"]])[0]
+        return self.add([doc], vector.reshape(1, -1))
+
+    def scan(self, watch_dir):
+        added = 0
+        for path in glob.glob(os.path.join(watch_dir, "*.json")):
+            try:
+                mtime = os.path.getmtime(path)
+                if self._seen_files.get(path) == mtime:
+                    continue
+                added += len(self.ingest_file(path))
+                self._seen_files[path] = mtime
+            except Exception as e:
+                print(f"Error ingesting {path}: {str(e)}")
+        return added
+
+    def start_background(self, watch_dir=None, watch_interval=WATCH_INTERVAL_S):
+        """
+        Check every ``watch_interval`` for dead shard processes and restart
+        them, and ingest new analyses from ``watch_dir`` if given. Each shard
+        process snapshots its own delta.
+        """
+        if self._thread is not None:
+            return
+
+        def watch():
+            while not self._stop.wait(watch_interval):
+                self._restart_dead()
+                if watch_dir is not None and os.path.isdir(watch_dir):
+                    added = self.scan(watch_dir)
+                    if added:
+                        print(f"Ingested {added} new analyses from {watch_dir}")
+
+        self._thread = threading.Thread(target=watch, daemon=True, name="rag-shard-watcher")
+        self._thread.start()
+
+    def stats(self):
+        shard_stats = []
+        for shard, job_id, future in self._scatter("stats"):
+            try:
+                stats = shard.result(job_id, future, timeout=10)
+            except Exception as e:
+                stats = {"error": str(e)}
+            shard_stats.append(dict(stats, shard=shard.shard, pid=shard.process.pid, outstanding=len(shard.pending)))
+        return {
+            "by": self.spec["by"],
+            "count": len(self.shards),
+            "ntotal": sum(stats.get("ntotal", 0) for stats in shard_stats),
+            "version": self.version,
+            "reloads": self.reloads,
+            "restarting": sorted(self._restarting),
+            "shards": shard_stats,
+        }
+
+    def shutdown(self):
+        self._stop.set()
+        for shard in self.shards:
+            shard.close()
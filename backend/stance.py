@@ -0,0 +1,106 @@
+import os
+import re
+
+from classifier_service import nli_classifier
+
+# Evidence passages taken from each scraped article, and their maximum length
+MAX_PASSAGES_PER_ARTICLE = int(os.getenv("STANCE_MAX_PASSAGES_PER_ARTICLE", "4"))
+MAX_PASSAGE_CHARS = int(os.getenv("STANCE_MAX_PASSAGE_CHARS", "1000"))
+# Minimum entailment/contradiction probability for a claim to count as
+# supported/refuted rather than uncertain
+STANCE_THRESHOLD = float(os.getenv("STANCE_THRESHOLD", "0.5"))
+
+
+def _label_kind(label):
+    label = label.lower()
+    if label.startswith("entail"):
+        return "support"
+    if label.startswith("contradict"):
+        return "refute"
+    return "neutral"
+
+
+def evidence_passages(article):
+    """Split one scraped article into short passages to test a claim against."""
+    passages = []
+    snippet = (article.get("snippet") or "").strip()
+    if snippet and snippet != "No snippet available":
+        passages.append(snippet)
+
+    content = article.get("content") or ""
+    if content.startswith("Failed to scrape") or content.startswith("No valid URL"):
+        content = ""
+    for paragraph in re.split(r"\n\s*\n|\n", content):
+        paragraph = paragraph.strip()
+        # Skip navigation crumbs and other fragments that can't carry a claim
+        if len(paragraph) < 80:
+            continue
+        passages.append(paragraph[:MAX_PASSAGE_CHARS])
+        if len(passages) >= MAX_PASSAGES_PER_ARTICLE:
+            break
+    return passages
+
+
+def score_stances(fact_checks, threshold=STANCE_THRESHOLD):
+    """
+    Score whether the gathered evidence supports or refutes each claim.
+
+    Every (claim, passage) pair across the whole analysis is sent to the NLI
+    model at once, so the classifier service runs them in large padded batches.
+
+    Parameters:
+    fact_checks (list): The ``result_data["fact_checks"]`` entries
+    threshold (float): Minimum probability for a supported/refuted verdict
+
+    Returns:
+    tuple: (per-claim stance dicts in fact_checks order, overall factuality score or None)
+    """
+    pairs = []
+    owners = []
+    for claim_index, fact_check in enumerate(fact_checks):
+        for article in fact_check.get("articles", []):
+            for passage in evidence_passages(article):
+                pairs.append({"text": passage, "text_pair": fact_check["statement"]})
+                owners.append((claim_index, article.get("url", ""), passage))
+
+    results = nli_classifier.classify(pairs) if pairs else []
+
+    stances = [
+        {"verdict": "uncertain", "support": 0.0, "refute": 0.0, "passages": 0, "evidence": []}
+        for _ in fact_checks
+    ]
+    for (claim_index, url, passage), result in zip(owners, results):
+        probs = {"support": 0.0, "refute": 0.0, "neutral": 0.0}
+        for label, score in result["scores"].items():
+            probs[_label_kind(label)] += score
+
+        stance = stances[claim_index]
+        stance["passages"] += 1
+        stance["support"] = max(stance["support"], probs["support"])
+        stance["refute"] = max(stance["refute"], probs["refute"])
+        kind = max(probs, key=probs.get)
+        if kind != "neutral":
+            stance["evidence"].append({
+                "url": url,
+                "passage": passage[:200],
+                "stance": kind,
+                "score": probs[kind]
+            })
+
+    claim_scores = []
+    for stance in stances:
+        stance["evidence"].sort(key=lambda item: item["score"], reverse=True)
+        stance["evidence"] = stance["evidence"][:3]
+        if stance["support"] >= threshold and stance["support"] > stance["refute"]:
+            stance["verdict"] = "supported"
+        elif stance["refute"] >= threshold and stance["refute"] > stance["support"]:
+            stance["verdict"] = "refuted"
+        if stance["passages"]:
+            # 1.0 = fully supported, 0.0 = fully refuted, 0.5 = evidence is silent
+            stance["factuality"] = 0.5 + 0.5 * (stance["support"] - stance["refute"])
+            claim_scores.append(stance["factuality"])
+        else:
+            stance["factuality"] = None
+
+    factuality_score = sum(claim_scores) / len(claim_scores) if claim_scores else None
+    return stances, factuality_score
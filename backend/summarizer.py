@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import gemini_client
+
+# Articles longer than this are summarized map-reduce style: paragraph groups
+# of about SUMMARY_CHUNK_CHARS are summarized concurrently (at most
+# SUMMARY_FANOUT Gemini calls in flight) and the partial summaries are then
+# combined into the final one.
+MAP_REDUCE_THRESHOLD = int(os.getenv("SUMMARY_MAP_REDUCE_THRESHOLD", "12000"))
+CHUNK_CHARS = int(os.getenv("SUMMARY_CHUNK_CHARS", "6000"))
+FANOUT = int(os.getenv("SUMMARY_FANOUT", "8"))
+MAP_CACHE_SIZE = int(os.getenv("SUMMARY_MAP_CACHE_SIZE", "1024"))
+# Which summarizer to use: "gemini" (remote), "extractive" (local, see
+# extractive_summary.py) or "auto" (Gemini when GEMINI_API_KEY is set, with the
+# extractive summarizer as fallback when it's missing or the call fails)
+SUMMARY_TIER = os.getenv("SUMMARY_TIER", "auto")
+
+MAP_PROMPT = (
+    "The following is one section of a longer news article. Summarize this section, "
+    "keeping every factual claim, name, number and date it contains:\n\n{text}"
+)
+REDUCE_PROMPT = (
+    "The following are summaries of consecutive sections of one news article. "
+    "Combine them into a single coherent summary of the whole article:\n\n{text}"
+)
+
+_map_cache = OrderedDict()
+_map_cache_lock = threading.Lock()
+
+
+def split_paragraph_groups(text, chunk_chars=CHUNK_CHARS):
+    """Group consecutive paragraphs into chunks of at most ``chunk_chars`` characters."""
+    groups = []
+    current = []
+    current_len = 0
+    for paragraph in (p.strip() for p in text.split("\n")):
+        if not paragraph:
+            continue
+        # A single oversized paragraph is cut into pieces on its own
+        while len(paragraph) > chunk_chars:
+            if current:
+                groups.append("\n\n".join(current))
+                current, current_len = [], 0
+            groups.append(paragraph[:chunk_chars])
+            paragraph = paragraph[chunk_chars:]
+        if current and current_len + len(paragraph) > chunk_chars:
+            groups.append("\n\n".join(current))
+            current, current_len = [], 0
+        current.append(paragraph)
+        current_len += len(paragraph)
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+
+def _cache_key(chunk, model):
+    return hashlib.sha256(f"{model}\n{chunk}".encode("utf-8")).hexdigest()
+
+
+async def _summarize_chunk(chunk, semaphore, model):
+    key = _cache_key(chunk, model)
+    with _map_cache_lock:
+        if key in _map_cache:
+            _map_cache.move_to_end(key)
+            return _map_cache[key]
+
+    async with semaphore:
+        summary = await gemini_client.generate(MAP_PROMPT.format(text=chunk), model=model)
+
+    with _map_cache_lock:
+        _map_cache[key] = summary
+        while len(_map_cache) > MAP_CACHE_SIZE:
+            _map_cache.popitem(last=False)
+    return summary
+
+
+async def map_reduce_stream(text, model=gemini_client.GEMINI_MODEL, chunk_chars=CHUNK_CHARS, fanout=FANOUT):
+    """Async generator: summarize chunks concurrently, then stream the combined summary."""
+    groups = split_paragraph_groups(text, chunk_chars)
+    semaphore = asyncio.Semaphore(fanout)
+    partials = await asyncio.gather(*(_summarize_chunk(group, semaphore, model) for group in groups))
+
+    combined = "\n\n".join(f"Section {i + 1}:\n{partial}" for i, partial in enumerate(partials))
+    async for delta in gemini_client.stream_generate(REDUCE_PROMPT.format(text=combined), model=model):
+        yield delta
+
+
+def summary_stream(text, model=gemini_client.GEMINI_MODEL):
+    """Async generator of summary deltas, using map-reduce for long articles."""
+    if len(text) > MAP_REDUCE_THRESHOLD:
+        return map_reduce_stream(text, model=model)
+    return gemini_client.stream_generate(gemini_client.SUMMARY_PROMPT.format(text=text), model=model)
+
+
+def start_summary_stream(text, model=gemini_client.GEMINI_MODEL):
+    """Start summarizing ``text`` in the background and return a SummaryStream."""
+    return gemini_client.SummaryStream(lambda: summary_stream(text, model=model))
+
+
+def use_remote():
+    """True when summaries should come from Gemini rather than the local summarizer."""
+    if SUMMARY_TIER == "extractive":
+        return False
+    if SUMMARY_TIER == "gemini":
+        return True
+    return bool(os.getenv("GEMINI_API_KEY"))
+
+
+def summarize_locally(text):
+    """Extractive summary computed in-process, no network needed."""
+    import extractive_summary
+
+    return extractive_summary.summarize(text)
+
+
+async def summarize(text, model=gemini_client.GEMINI_MODEL):
+    """Return the full summary of ``text``."""
+    parts = []
+    async for delta in summary_stream(text, model=model):
+        parts.append(delta)
+    return "".join(parts)
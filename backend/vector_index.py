@@ -0,0 +1,247 @@
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+# Index types the RAG service can serve. Each maps to a faiss index_factory
+# string; {nlist}, {m}, {nbits} and {M} are filled from the build options.
+INDEX_TYPES = {
+    "flat": "Flat",
+    "hnsw": "HNSW{M}",
+    "ivfpq": "IVF{nlist},PQ{m}x{nbits}",
+    # OPQ learns a rotation before product quantization; better recall at the same code size
+    "ivfopq": "OPQ{m},IVF{nlist},PQ{m}x{nbits}",
+}
+# Types storing lossy codes (m * nbits / 8 bytes per vector instead of 4 * d);
+# their candidates are re-ranked against the full-precision vectors
+COMPRESSED_TYPES = {"ivfpq", "ivfopq"}
+DEFAULT_BUILD_OPTIONS = {
+    "M": 32,                # HNSW graph degree
+    "ef_construction": 200,
+    "nlist": 1024,          # IVF cells
+    "m": 16,                # PQ sub-quantizers
+    "nbits": 8,             # bits per PQ code
+    "train_sample": 100000, # vectors used to train IVF/PQ
+}
+ADD_BLOCK_ROWS = 65536
+# "ip" indexes hold L2-normalized vectors, so inner product is cosine
+# similarity; "l2" is only kept for indexes built before that
+METRICS = {
+    "ip": faiss.METRIC_INNER_PRODUCT,
+    "l2": faiss.METRIC_L2,
+}
+
+
+def normalize(vectors):
+    """L2-normalized float32 copy of ``vectors`` (one per row); zero rows stay zero."""
+    vectors = np.array(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return vectors
+
+
+def to_similarity(distances, metric_type):
+    """
+    Cosine similarity from faiss distances over normalized vectors.
+
+    Inner product already is the cosine; squared L2 between unit vectors is
+    2 - 2cos.
+    """
+    if metric_type == faiss.METRIC_INNER_PRODUCT:
+        return distances
+    return 1.0 - distances / 2.0
+
+
+def build_index(embeddings, index_type="flat", metric="ip", **options):
+    """
+    Build a FAISS index over ``embeddings``.
+
+    Parameters:
+    embeddings (numpy.ndarray): float32 matrix, one row per document (row = document id)
+    index_type (str): 'flat', 'hnsw', 'ivfpq' or 'ivfopq'
+    metric (str): 'ip' (vectors are normalized, scores are cosine similarity) or legacy 'l2'
+    options: Overrides for DEFAULT_BUILD_OPTIONS
+
+    Returns:
+    faiss.Index: The trained, populated index
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+    opts = dict(DEFAULT_BUILD_OPTIONS, **options)
+    n, dimension = embeddings.shape
+    # Works block by block so a memmapped embeddings.npy never has to fit in memory
+    prepare = normalize if metric == "ip" else (lambda block: np.ascontiguousarray(block, dtype=np.float32))
+
+    if index_type in COMPRESSED_TYPES:
+        # Can't have more cells than training points
+        opts["nlist"] = max(1, min(opts["nlist"], n // 39 or 1))
+    factory = INDEX_TYPES[index_type].format(**opts)
+    index = faiss.index_factory(dimension, factory, METRICS[metric])
+
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = opts["ef_construction"]
+    if not index.is_trained:
+        if n > opts["train_sample"]:
+            rows = np.sort(np.random.default_rng(0).choice(n, opts["train_sample"], replace=False))
+            sample = prepare(embeddings[rows])
+        else:
+            sample = prepare(embeddings[:])
+        start_time = time.time()
+        index.train(sample)
+        print(f"Trained {factory} on {len(sample)} vectors in {time.time() - start_time:.2f} seconds")
+        del sample
+
+    for start in range(0, n, ADD_BLOCK_ROWS):
+        index.add(prepare(embeddings[start:start + ADD_BLOCK_ROWS]))
+    return index
+
+
+def write_index(index, path, index_type, **options):
+    """Write the index plus a small JSON sidecar describing how it was built."""
+    faiss.write_index(index, path)
+    with open(path + ".meta.json", "w") as f:
+        json.dump({
+            "index_type": index_type,
+            "metric": "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2",
+            "options": dict(DEFAULT_BUILD_OPTIONS, **options),
+            "dimension": index.d,
+            "ntotal": index.ntotal,
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }, f, indent=2)
+
+
+def read_index_meta(path):
+    meta_path = path + ".meta.json"
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def load_index(path, mmap=True):
+    """
+    Load an index written by write_index.
+
+    With mmap the index data is mapped from disk instead of copied into the
+    process heap: startup is near-instant and every worker on the node shares
+    the same page cache. Falls back to a normal read for index types faiss
+    can't map.
+    """
+    if mmap:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError as e:
+            print(f"Could not mmap {path} ({e}); loading it into memory instead")
+    return faiss.read_index(path)
+
+
+def id_selector(rows, ntotal):
+    """
+    faiss ID selector admitting only ``rows`` (int64 ids below ``ntotal``).
+
+    Dense sets become a bitmap (one bit per row); sparse ones an id batch.
+    Returns (selector, buffer): faiss doesn't copy the bitmap, so the buffer
+    must stay alive for as long as the selector is used.
+    """
+    rows = np.ascontiguousarray(rows, dtype=np.int64)
+    if len(rows) * 64 > ntotal:
+        mask = np.zeros(ntotal, dtype=bool)
+        mask[rows] = True
+        bitmap = np.packbits(mask, bitorder="little")
+        return faiss.IDSelectorBitmap(ntotal, faiss.swig_ptr(bitmap)), bitmap
+    return faiss.IDSelectorBatch(len(rows), faiss.swig_ptr(rows)), rows
+
+
+def search_parameters(index, ef_search=None, nprobe=None, selector=None):
+    """
+    Per-query search parameters for ``index``.
+
+    Passing these to ``index.search`` leaves the shared index untouched, so
+    concurrent queries can use different recall/latency settings and filters.
+    Returns None when there is nothing to set.
+    """
+    inner = index
+    if isinstance(index, faiss.IndexPreTransform):
+        inner = faiss.downcast_index(index.index)
+
+    params = None
+    if isinstance(inner, faiss.IndexHNSW) and (ef_search or selector is not None):
+        params = faiss.SearchParametersHNSW()
+        if ef_search:
+            params.efSearch = int(ef_search)
+    elif isinstance(inner, faiss.IndexIVF) and (nprobe or selector is not None):
+        params = faiss.SearchParametersIVF()
+        if nprobe:
+            params.nprobe = int(nprobe)
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+
+    if params is not None and inner is not index:
+        wrapper = faiss.SearchParametersPreTransform()
+        wrapper.index_params = params
+        # Keep the inner params alive as long as the wrapper
+        wrapper.referenced_objects = [params]
+        params = wrapper
+    return params
+
+
+def search(index, queries, k, ef_search=None, nprobe=None, selector=None):
+    """Search ``index`` for each row of ``queries``; returns (distances, ids) like faiss."""
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    params = search_parameters(index, ef_search=ef_search, nprobe=nprobe, selector=selector)
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
+
+
+def empty_results(n_queries, k, metric_type=faiss.METRIC_L2):
+    """faiss-shaped (distances, ids) with no hits."""
+    worst = -np.inf if metric_type == faiss.METRIC_INNER_PRODUCT else np.inf
+    return np.full((n_queries, k), worst, dtype=np.float32), np.full((n_queries, k), -1, dtype=np.int64)
+
+
+def merge_results(distances_list, ids_list, k, metric_type=faiss.METRIC_L2):
+    """
+    Merge per-index (distances, ids) results into one top-k per query.
+
+    ids must already be global (callers offset them); -1 marks padding.
+    """
+    distances = np.concatenate(distances_list, axis=1)
+    ids = np.concatenate(ids_list, axis=1)
+    larger_is_better = metric_type == faiss.METRIC_INNER_PRODUCT
+    worst = -np.inf if larger_is_better else np.inf
+    distances = np.where(ids >= 0, distances, worst)
+    order = np.argsort(-distances if larger_is_better else distances, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+def rerank(queries, ids, vectors, k):
+    """
+    Exact inner-product re-ranking of candidate ids.
+
+    Candidate rows are read from ``vectors`` (usually a memmap of
+    embeddings.npy, so only the touched pages are loaded) in file order.
+
+    Returns:
+    tuple: (scores, ids) of shape (len(queries), k), best first, -1 padded
+    """
+    queries = normalize(queries)
+    scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for i, (query, candidates) in enumerate(zip(queries, ids)):
+        rows = np.sort(candidates[candidates >= 0])
+        if not len(rows):
+            continue
+        exact = normalize(vectors[rows]) @ query
+        best = np.argsort(-exact, kind="stable")[:k]
+        scores[i, :len(best)] = exact[best]
+        best_ids[i, :len(best)] = rows[best]
+    return scores, best_ids
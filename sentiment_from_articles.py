@@ -3,9 +3,11 @@
 import boto3
 import json
 import sys 
-from transformers import pipeline
 import os
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from model_registry import registry as model_registry
+
 def analyze_article_with_bedrock(article_text):
     # Initialize the Bedrock client
     bedrock_client = boto3.client("bedrock-runtime")
@@ -57,12 +59,8 @@ def analyze_article_with_bedrock(article_text):
         return {"score": 0.5, "reasoning": "Error in analysis"}
 
 def analyze_article_with_pipeline(article_text):
-    # Use a pipeline as a high-level helper
-    from transformers import pipeline
-
-    pipe = pipeline("text-classification", model="dhruvpal/fake-news-bert")
-    result = pipe(article_text)
-    return result
+    # Reuse the process-wide fake-news classifier instead of rebuilding it per call
+    return model_registry.run("fake-news", article_text)
 
 
 def load_text_file(file_path):
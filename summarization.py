@@ -3,6 +3,14 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
+_client = None
+
+def get_client(api_key):
+    global _client
+    if _client is None:
+        _client = genai.Client(api_key=api_key)
+    return _client
+
 def summarization(text, api_key=None):
     # Use provided API key or check environment variable
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
@@ -13,8 +21,8 @@ def summarization(text, api_key=None):
         return "API key not found"
     
     try:
-        # Initialize the client
-        client = genai.Client(api_key=GEMINI_API_KEY)
+        # Reuse one client for every call
+        client = get_client(GEMINI_API_KEY)
         
         # Generate the summary
         response = client.models.generate_content(
@@ -1,11 +1,17 @@
 from crewai_tools import YoutubeVideoSearchTool
 from crewai import LLM
 import os
+import sys
 import boto3
 import json
+import concurrent.futures
+import numpy as np
 from dotenv import load_dotenv
 from typing import List
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from embeddings import BEDROCK_EMBED_CONCURRENCY, bedrock_rate_limiter
+
 
 load_dotenv()
 
@@ -14,12 +20,17 @@ class BaseEmbedder:
     def embed_text(self, text: str) -> List[float]:
         raise NotImplementedError("Subclasses must implement this method")
 
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        return np.asarray([self.embed_text(text) for text in texts], dtype=np.float32)
+
 class BedrockEmbedder(BaseEmbedder):
     def __init__(self, client, model_name):
         self.client = client
         self.model_name = model_name
         
     def embed_text(self, text: str) -> List[float]:
+        # Same token bucket as the backend's Bedrock calls (BEDROCK_EMBED_RPS)
+        bedrock_rate_limiter.acquire()
         response = self.client.invoke_model(
             body=json.dumps({"inputText": text}),
             modelId=self.model_name,
@@ -29,6 +40,12 @@ class BedrockEmbedder(BaseEmbedder):
         response_body = json.loads(response.get('body').read())
         return response_body.get('embedding')
 
+    def embed_texts(self, texts: List[str], max_workers: int = BEDROCK_EMBED_CONCURRENCY) -> np.ndarray:
+        # Titan takes one text per request, so send them concurrently, throttled by embed_text
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            vectors = list(executor.map(self.embed_text, texts))
+        return np.asarray(vectors, dtype=np.float32)
+
 # Set up AWS client
 try:
     bedrock_client = boto3.client("bedrock-runtime", 